@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the Onsager calculators: construction of vacancy-mediated diffusers, HDF5
+storage, evaluation of transport coefficients (cold and warm GF cache), interstitial
+diffusivity and elastodiffusion, and supercell equivalence mapping.
+
+Written in the style of asv (airspeed velocity): each class has a ``setup()`` method and
+``time_*()`` methods, with ``params`` / ``param_names`` for parameterized benchmarks, so this
+directory can be used directly as an asv benchmark directory. It can also be run on its own,
+which times every benchmark and writes the results as JSON, to compare runs across commits::
+
+    python benchmarks/benchmarks.py -o results.json [-r repeat] [-k name]
+"""
+
+__author__ = 'Dallas R. Trinkle'
+
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import itertools, timeit, json, time, subprocess, platform
+import numpy as np
+import h5py
+import onsager.crystal as crystal
+import onsager.OnsagerCalc as OnsagerCalc
+import onsager.supercell as supercell
+
+
+def vacancycrystal(name):
+    """Return crystal, and cutoff for vacancy jumpnetwork, for one of our test crystals"""
+    if name == 'FCC':
+        return crystal.Crystal.FCC(1.), 0.75
+    if name == 'BCC':
+        return crystal.Crystal.BCC(1.), 0.87
+    if name == 'HCP':
+        return crystal.Crystal.HCP(1., np.sqrt(8 / 3)), 1.01
+    if name == 'omega':
+        # multi-site crystal: omega phase (two Wyckoff positions)
+        return crystal.Crystal(np.array([[1 / 2, 1 / 2, 0.],
+                                         [-np.sqrt(3 / 4), np.sqrt(3 / 4), 0.],
+                                         [0., 0., np.sqrt(3 / 8)]]),
+                               [np.zeros(3), np.array([1 / 3, 2 / 3, 1 / 2]), np.array([2 / 3, 1 / 3, 1 / 2])]), \
+               0.7
+    raise ValueError('Unknown crystal {}'.format(name))
+
+
+def vacancydiffuser(name, Nthermo):
+    """Return a vacancy-mediated diffuser for one of our test crystals"""
+    crys, cutoff = vacancycrystal(name)
+    return OnsagerCalc.VacancyMediated(crys, 0, crys.sitelist(0), crys.jumpnetwork(0, cutoff), Nthermo)
+
+
+def vacancythermodict(diffuser):
+    """Thermodynamic / kinetic data (with some variation, so nothing is accidentally symmetric)"""
+    Nsites, Njumps, Ninteract = len(diffuser.sitelist), len(diffuser.om0_jn), len(diffuser.interactlist())
+    tdict = {'preV': np.ones(Nsites), 'eneV': np.linspace(0, 0.1, Nsites),
+             'preS': np.ones(Nsites), 'eneS': np.zeros(Nsites),
+             'preT0': np.ones(Njumps), 'eneT0': np.linspace(0.5, 0.7, Njumps),
+             'preSV': np.ones(Ninteract), 'eneSV': np.linspace(-0.1, 0.05, Ninteract)}
+    tdict.update(diffuser.makeLIMBpreene(**tdict))
+    return tdict
+
+
+class VacancyMediatedConstruction(object):
+    """Construction of the vacancy-mediated diffuser: stars, vector stars, GF calculator, matrices"""
+    params = (['FCC', 'BCC', 'HCP', 'omega'], [1, 2, 3])
+    param_names = ['crystal', 'Nthermo']
+    timeout = 600
+
+    def setup(self, name, Nthermo):
+        self.crys, cutoff = vacancycrystal(name)
+        self.sitelist = self.crys.sitelist(0)
+        self.jumpnetwork = self.crys.jumpnetwork(0, cutoff)
+
+    def time_VacancyMediated(self, name, Nthermo):
+        OnsagerCalc.VacancyMediated(self.crys, 0, self.sitelist, self.jumpnetwork, Nthermo)
+
+
+class VacancyMediatedHDF5(object):
+    """Writing and reading a vacancy-mediated diffuser to / from HDF5"""
+    params = (['FCC', 'HCP', 'omega'],)
+    param_names = ['crystal']
+
+    def setup(self, name):
+        self.diffuser = vacancydiffuser(name, 1)
+        self.f = h5py.File('/dev/null', 'w', driver='core', backing_store=False)
+        self.diffuser.addhdf5(self.f.create_group('load'))
+
+    def teardown(self, name):
+        self.f.close()
+
+    def time_addhdf5(self, name):
+        group = 'add'
+        if group in self.f: del self.f[group]
+        self.diffuser.addhdf5(self.f.create_group(group))
+
+    def time_loadhdf5(self, name):
+        OnsagerCalc.VacancyMediated.loadhdf5(self.f['load'])
+
+
+class VacancyMediatedLij(object):
+    """Transport coefficients: with a cold GF cache, a warm GF cache, and a temperature sweep"""
+    params = (['FCC', 'HCP', 'omega'], [1, 2])
+    param_names = ['crystal', 'Nthermo']
+    kTlist = np.linspace(0.05, 0.2, 32)
+
+    def setup(self, name, Nthermo):
+        self.diffuser = vacancydiffuser(name, Nthermo)
+        self.tdict = vacancythermodict(self.diffuser)
+        self.betaF = self.diffuser.preene2betafree(0.1, **self.tdict)
+        self.diffuser.Lij(*self.betaF)  # warm up cache
+
+    def time_Lij_cold(self, name, Nthermo):
+        self.diffuser.clearcache()
+        self.diffuser.Lij(*self.betaF)
+
+    def time_Lij_warm(self, name, Nthermo):
+        self.diffuser.Lij(*self.betaF)
+
+    def time_Lij_sweep(self, name, Nthermo):
+        for kT in self.kTlist:
+            self.diffuser.Lij(*self.diffuser.preene2betafree(kT, **self.tdict))
+
+    def time_Lijbatch_sweep(self, name, Nthermo):
+        self.diffuser.Lijbatch(*self.diffuser.preene2betafreebatch(self.kTlist, **self.tdict))
+
+
+class InterstitialDiffusion(object):
+    """Interstitial diffusivity (with and without derivatives) and elastodiffusion; HCP octa-tetra network"""
+
+    def setup(self):
+        a0, c_a = 3., np.sqrt(8. / 3.)
+        hexlatt = a0 * np.array([[0.5, 0.5, 0], [-np.sqrt(0.75), np.sqrt(0.75), 0], [0, 0, c_a]])
+        hcpbasis = [[np.array([1. / 3., 2. / 3., 0.25]), np.array([2. / 3., 1. / 3., 0.75])],
+                    [np.array([0., 0., 0.]), np.array([0., 0., 0.5]),
+                     np.array([1. / 3., 2. / 3., 0.625]), np.array([1. / 3., 2. / 3., 0.875]),
+                     np.array([2. / 3., 1. / 3., 0.125]), np.array([2. / 3., 1. / 3., 0.375])]]
+        crys = crystal.Crystal(hexlatt, hcpbasis, chemistry=['Mg', 'O'])
+        sitelist = crys.sitelist(1)
+        jumpnetwork = crys.jumpnetwork(1, a0 * 0.7)
+        self.diffuser = OnsagerCalc.Interstitial(crys, 1, sitelist, jumpnetwork)
+        self.pre, self.betaene = np.ones(len(sitelist)), np.linspace(0, 0.5, len(sitelist))
+        self.preT, self.betaeneT = np.ones(len(jumpnetwork)), np.linspace(1., 1.5, len(jumpnetwork))
+        self.dipole = [np.diag([1., 1., 2.]) * (n + 1) for n in range(len(sitelist))]
+        self.dipoleT = [np.diag([0.5, 0.5, -1.]) * (n + 1) for n in range(len(jumpnetwork))]
+        self.betalist = np.linspace(1., 20., 128)
+
+    def time_diffusivity(self):
+        self.diffuser.diffusivity(self.pre, self.betaene, self.preT, self.betaeneT)
+
+    def time_diffusivity_deriv(self):
+        self.diffuser.diffusivity(self.pre, self.betaene, self.preT, self.betaeneT, CalcDeriv=True)
+
+    def time_diffusivity_sweep(self):
+        for beta in self.betalist:
+            self.diffuser.diffusivity(self.pre, beta * self.betaene, self.preT, beta * self.betaeneT, CalcDeriv=True)
+
+    def time_diffusivitybatch_sweep(self):
+        self.diffuser.diffusivitybatch(self.pre, np.outer(self.betalist, self.betaene),
+                                       self.preT, np.outer(self.betalist, self.betaeneT), CalcDeriv=True)
+
+    def time_elastodiffusion(self):
+        self.diffuser.elastodiffusion(self.pre, self.betaene, self.dipole,
+                                      self.preT, self.betaeneT, self.dipoleT)
+
+    def time_elastodiffusionbatch_sweep(self):
+        self.diffuser.elastodiffusionbatch(self.pre, np.outer(self.betalist, self.betaene),
+                                           [beta * np.array(self.dipole) for beta in self.betalist],
+                                           self.preT, np.outer(self.betalist, self.betaeneT),
+                                           [beta * np.array(self.dipoleT) for beta in self.betalist])
+
+
+class SupercellEquivalence(object):
+    """Finding the group operation and mapping between two equivalent supercells"""
+    params = ([2, 3],)
+    param_names = ['size']
+
+    def setup(self, size):
+        np.random.seed(0)
+        crys = crystal.Crystal.FCC(1., 'Al')
+        self.super = supercell.Supercell(crys, size * np.eye(3, dtype=int), Nsolute=1)
+        self.super.definesolute(self.super.Nchem - 1, 's')
+        Nocc = self.super.size * self.super.N
+        for c, ind in zip(np.random.randint(-1, self.super.Nchem, size=Nocc // 4),
+                          np.random.randint(Nocc, size=Nocc // 4)):
+            self.super.setocc(ind, c)
+        self.supercopy = self.super.copy()
+        # permute the ordering in the copy:
+        for ind in np.random.randint(Nocc, size=Nocc):
+            c, self.supercopy[ind] = self.supercopy[ind], -1
+            self.supercopy[ind] = c
+
+    def time_equivalencemap(self, size):
+        self.super.equivalencemap(self.supercopy)
+
+
+def benchmarklist():
+    """List of (name, class, method name, params) for every benchmark in this module"""
+    benchmarks = []
+    for cls in (VacancyMediatedConstruction, VacancyMediatedHDF5, VacancyMediatedLij,
+                InterstitialDiffusion, SupercellEquivalence):
+        paramlist = list(itertools.product(*cls.params)) if hasattr(cls, 'params') else [()]
+        for method in sorted(m for m in dir(cls) if m.startswith('time_')):
+            for params in paramlist:
+                name = '{}.{}'.format(cls.__name__, method)
+                if len(params) > 0:
+                    name += '(' + ', '.join('{}={}'.format(pn, p) for pn, p in zip(cls.param_names, params)) + ')'
+                benchmarks.append((name, cls, method, params))
+    return benchmarks
+
+
+def runbenchmark(cls, method, params, repeat=3):
+    """
+    Run a single benchmark: setup once, then time repeat calls.
+
+    :param cls: benchmark class
+    :param method: name of timing method
+    :param params: tuple of parameters passed to setup and the method
+    :param repeat: number of timings
+    :return times: list of wall times (in seconds)
+    """
+    bench = cls()
+    if hasattr(bench, 'setup'): bench.setup(*params)
+    try:
+        timer = timeit.Timer(lambda: getattr(bench, method)(*params))
+        return timer.repeat(repeat=repeat, number=1)
+    finally:
+        if hasattr(bench, 'teardown'): bench.teardown(*params)
+
+
+def gitcommit():
+    """Current git commit of the source tree (None if not available)"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run Onsager benchmarks, and store timings as JSON')
+    parser.add_argument('--output', '-o', default='benchmarks.json', help='JSON output file')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='number of timings per benchmark')
+    parser.add_argument('--select', '-k', action='append', default=[],
+                        help='only run benchmarks whose name contains this string (can repeat)')
+    args = parser.parse_args()
+
+    results = {'commit': gitcommit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'machine': platform.node(), 'python': platform.python_version(),
+               'numpy': np.__version__, 'repeat': args.repeat, 'benchmarks': {}}
+    for name, cls, method, params in benchmarklist():
+        if args.select and not any(sel in name for sel in args.select): continue
+        times = runbenchmark(cls, method, params, args.repeat)
+        results['benchmarks'][name] = {'times': times, 'min': min(times), 'median': float(np.median(times))}
+        print('{:<72s} {:10.4f} s'.format(name, min(times)), flush=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -15,8 +15,10 @@ __author__ = 'Dallas R. Trinkle'
 
 import numpy as np
 from onsager import PowerExpansion as PE
+from onsager import instrument
 import itertools
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from numpy import linalg as LA
 from scipy.special import hyp1f1, gamma, expi #, gammainc
 
@@ -68,12 +70,15 @@ class Fnl_u(object):
         if not self.log:
             return self.pre * u ** self.l * hyp1f1(self.a, self.b, -(u * self.half_pm) ** 2)
         else:
-            if u == 0:
-                return self.pre * (-0.5*np.euler_gamma + np.log(self.half_pm))
-            else:
-                # incomplete Gamma(0,x) = -Ei(-x) (exponential integral), turns out...
-                # return self.pre * (-np.euler_gamma - np.log(u) -0.5*gammainc(0, (u*self.half_pm)**2))
-                return self.pre * (-np.euler_gamma - np.log(u) + 0.5*expi(-(u*self.half_pm)**2))
+            # works for scalar or array u; u == 0 is treated separately
+            u = np.asarray(u, dtype=float)
+            uzero = (u == 0)
+            unonzero = np.where(uzero, 1., u)
+            # incomplete Gamma(0,x) = -Ei(-x) (exponential integral), turns out...
+            # return self.pre * (-np.euler_gamma - np.log(u) -0.5*gammainc(0, (u*self.half_pm)**2))
+            return self.pre * np.where(uzero, -0.5*np.euler_gamma + np.log(self.half_pm),
+                                       -np.euler_gamma - np.log(unonzero) +
+                                       0.5*expi(-(unonzero*self.half_pm)**2))[()]
 
 
 class GFCrystalcalc(object):
@@ -125,8 +130,11 @@ class GFCrystalcalc(object):
         # make sure we have even meshes
         self.kptgrid = np.array([2 * np.int(np.ceil(2 * Nmax * b)) for b in bmagn], dtype=int) \
             if kptwt is None else np.zeros(self.crys.dim, dtype=int)
-        self.kpts, self.wts = crys.reducekptmesh(crys.fullkptmesh(self.kptgrid)) \
-            if kptwt is None else deepcopy(kptwt)
+        if kptwt is None:
+            kptfull, meshindices, Ndiv = crys.fullkptmesh(self.kptgrid, returnindices=True)
+            self.kpts, self.wts = crys.reducekptmesh(kptfull, meshindices=meshindices)
+        else:
+            self.kpts, self.wts = deepcopy(kptwt)
         self.Nkpt = self.kpts.shape[0]
         # generate the Fourier transformation for each jump
         # also includes the multiplicity for the onsite terms (site expansion)
@@ -165,6 +173,11 @@ class GFCrystalcalc(object):
             # connectivity.append(cset)  # if we want to keep lists of connectivity sets
         return connectivity
 
+    # maximum number of elements in the phase matrix used by GFbatch()
+    GFbatchsize = 2 ** 21
+    # number of threads used to invert omega over the k-point mesh in SetRates()
+    Nthreads = 1
+
     # this is part of our *class* definition:
     __HDF5list__ = ('N', 'Ndiff', 'invmap', 'NG', 'grouparray', 'indexpair', 'kptgrid',
                     'kpts', 'wts', 'Nkpt', 'FTjumps', 'SEjumps')
@@ -303,6 +316,7 @@ class GFCrystalcalc(object):
         :param betaeneT: list of beta*ET (energy/kB T) for each transition state
         :param pmaxerror: parameter controlling error from pmax value. Should be same order as integration error.
         """
+        clock = instrument.timer.stopwatch('GFCrystalcalc.SetRates')
         self.symmrate = self.SymmRates(pre, betaene, preT, betaeneT)
         self.maxrate = self.symmrate.max()
         self.symmrate /= self.maxrate
@@ -315,6 +329,7 @@ class GFCrystalcalc(object):
                                 for symmrate, expansion in zip(self.symmrate, self.Taylorjumps))
         self.omega_Taylor += self.escape
         Taylor = T3D if self.crys.dim == 3 else T2D
+        clock.split('0.rates')
 
         # 1. Diagonalize gamma point value; use to rotate to diffusive / relaxive, and reduce
         self.r, self.vr = self.DiagGamma()
@@ -322,9 +337,11 @@ class GFCrystalcalc(object):
             raise ArithmeticError("Did not find {} equilibrium solution to rates?".format(self.Ndiff))
         self.omega_Taylor_rotate = (self.omega_Taylor.ldot(self.vr.T)).rdot(self.vr)
         oT_dd, oT_dr, oT_rd, oT_rr, oT_D, etav = self.BlockRotateOmegaTaylor(self.omega_Taylor_rotate)
+        clock.split('1.diagonalize')
         # 2. Calculate D and eta
         self.D = self.Diffusivity(oT_D)
         self.eta = self.biascorrection(etav)
+        clock.split('2.diffusivity')
         # 3. Spatially rotate the Taylor expansion
         self.d, self.e = LA.eigh(self.D / self.maxrate)
         # had been 1e-11; changed to 1e-7 to reflect likely integration accuracy of k-point grids
@@ -341,6 +358,7 @@ class GFCrystalcalc(object):
             t.irotate(powtrans)  # rotate in place
             t.reduce()
         if oT_D.coefflist[0][1] != 0: raise ArithmeticError("Problem isotropizing D?")
+        clock.split('3.rotate')
         # 4. Invert Taylor expansion using block inversion formula, and truncate at n=0
         gT_rotate = self.BlockInvertOmegaTaylor(oT_dd, oT_dr, oT_rd, oT_rr, oT_D)
         self.g_Taylor = (gT_rotate.ldot(self.vr)).rdot(self.vr.T)
@@ -349,18 +367,23 @@ class GFCrystalcalc(object):
         prefactor = self.crys.volume / np.sqrt(np.product(self.d))
         self.g_Taylor_fnlu = {(n, l): Fnl_u(n, l, self.pmax, prefactor, d=self.crys.dim)
                               for (n, l) in self.g_Taylor.nl()}
+        clock.split('4.Taylor')
         # 5. Invert Fourier expansion
         gsc_qij = np.zeros_like(self.omega_qij)
-        for qind, q in enumerate(self.kpts):
-            if np.allclose(q, 0):
-                # gamma point... need to treat separately
-                gsc_qij[qind] = (-1 / self.pmax ** 2) * \
-                                sum(np.outer(self.vr[:, n], self.vr[:, n])
-                                    for n in range(self.Ndiff))
-            else:
-                # invert, subtract off Taylor expansion to leave semicontinuum piece
-                gsc_qij[qind] = np.linalg.inv(self.omega_qij[qind, :, :]) \
-                                - self.g_Taylor(np.dot(self.pqtrans, q), g_Taylor_fnlp)
+        gammapoint = np.array([np.allclose(q, 0) for q in self.kpts])
+        # gamma point... need to treat separately
+        gsc_qij[gammapoint] = (-1 / self.pmax ** 2) * \
+                              sum(np.outer(self.vr[:, n], self.vr[:, n]) for n in range(self.Ndiff))
+        # everything else in chunks (in parallel, if Nthreads > 1)
+        qchunks = np.array_split(np.arange(self.Nkpt)[~gammapoint], max(1, self.Nthreads))
+        if len(qchunks) > 1:
+            with ThreadPoolExecutor(max_workers=len(qchunks)) as executor:
+                for qinds, gsc in zip(qchunks, executor.map(lambda qinds: self.gsc_qpoints(qinds, g_Taylor_fnlp),
+                                                            qchunks)):
+                    gsc_qij[qinds] = gsc
+        else:
+            gsc_qij[qchunks[0]] = self.gsc_qpoints(qchunks[0], g_Taylor_fnlp)
+        clock.split('5.Fourier')
         # 6. Slice the pieces we want for fast(er) evaluation (since we specify i and j in evaluation)
         self.gsc_ijq = np.zeros((self.N, self.N, self.Nkpt), dtype=complex)
         for i in range(self.N):
@@ -370,6 +393,21 @@ class GFCrystalcalc(object):
         self.gT_ij = tuple(tuple(self.g_Taylor[i, j].copy().reduce().separate()
                                  for j in range(self.N))
                            for i in range(self.N))
+        clock.split('6.slice')
+        clock.stop()
+
+    def gsc_qpoints(self, qinds, g_Taylor_fnlp):
+        """
+        Semicontinuum piece of the Green function (the inverse, with the Taylor expansion subtracted
+        off) at a set of k-points; needs to be called by SetRates() after g_Taylor is constructed.
+
+        :param qinds[Nq]: indices of k-points (none can be the gamma point)
+        :param g_Taylor_fnlp: dictionary of (n,l): Fnl_p functions to evaluate g_Taylor
+        :return gsc_qij[Nq, N, N]: semicontinuum piece of the Green function
+        """
+        if len(qinds) == 0: return np.zeros((0, self.N, self.N), dtype=complex)
+        return np.linalg.inv(self.omega_qij[qinds]) - \
+               self.g_Taylor(np.dot(self.kpts[qinds], self.pqtrans.T), g_Taylor_fnlp)
 
     def exp_dxq(self, dx):
         """
@@ -403,6 +441,46 @@ class GFCrystalcalc(object):
         # combine:
         return (gIFT + gTaylor).real / self.maxrate
 
+    def GFbatch(self, ilist, jlist, dxlist):
+        """
+        Evaluate the Green function for a list of targets at once; equivalent to
+        ``[GFcalc(i, j, dx) for i, j, dx in zip(ilist, jlist, dxlist)]``, but the Fourier transform
+        is done for all of the rotated displacements together, as a phase matrix (in chunks of
+        at most GFbatchsize elements).
+
+        :param ilist[Ntarget]: site indices
+        :param jlist[Ntarget]: site indices
+        :param dxlist[Ntarget, 3]: vectors pointing from i to j (can include lattice contributions)
+        :return G[Ntarget]: Green function values
+        """
+        if self.D is 0: raise ValueError("Need to SetRates first")
+        ilist, jlist = np.asarray(ilist, dtype=int), np.asarray(jlist, dtype=int)
+        Ntarget, dim = len(ilist), self.crys.dim
+        dxlist = np.asarray(dxlist, dtype=float).reshape((Ntarget, dim))
+        # weighted semicontinuum pieces, one row for each (i,j) pair:
+        wgsc_pq = (self.gsc_ijq * self.wts).reshape((self.N * self.N, self.Nkpt))
+        # row of wgsc_pq, and rotated displacement, for each target and group operation:
+        pairs = self.indexpair[ilist, jlist]  # [Ntarget, NG, 2]
+        pairrows = (pairs[:, :, 0] * self.N + pairs[:, :, 1]).reshape(-1)
+        gdx = np.einsum('gab,tb->tga', self.grouparray, dxlist).reshape((-1, dim))
+        gIFT = np.zeros(Ntarget * self.NG, dtype=complex)
+        Nchunk = self.NG * max(1, self.GFbatchsize // (self.NG * self.Nkpt))
+        for n0 in range(0, Ntarget * self.NG, Nchunk):
+            n1 = min(n0 + Nchunk, Ntarget * self.NG)
+            phase_qn = np.exp(-1j * np.dot(self.kpts, gdx[n0:n1].T))
+            gIFT[n0:n1] = np.einsum('nq,qn->n', wgsc_pq[pairrows[n0:n1]], phase_qn)
+        gIFT = np.sum(gIFT.reshape((Ntarget, self.NG)), axis=1) / self.NG
+        if not np.allclose(gIFT.imag, 0): raise ArithmeticError("Got complex IFT? {}".format(gIFT))
+        # evaluate Taylor expansion component, for all targets with the same (i,j) at once:
+        gTaylor = np.zeros(Ntarget, dtype=complex)
+        for i, j in set(zip(ilist, jlist)):
+            targets = np.logical_and(ilist == i, jlist == j)
+            gTaylor[targets] = self.gT_ij[i][j](np.dot(dxlist[targets], self.uxtrans.T), self.g_Taylor_fnlu)
+        if not np.allclose(gTaylor.imag, 0):
+            raise ArithmeticError("Got complex IFT from Taylor? {}".format(gTaylor))
+        # combine:
+        return (gIFT + gTaylor).real / self.maxrate
+
     def DiagGamma(self, omega=None):
         """
         Diagonalize the gamma point (q=0) term
@@ -501,8 +579,9 @@ class GFCrystalcalc(object):
         rr = omega_Taylor_rotate[ND:, ND:].copy()
         for t in [dd, dr, rd, rr]: t.reduce()
         if self.N > ND:
-            D = dd - dr * rr.inv() * rd
-            etav = rr.inv() * rd
+            rr_inv = rr.inv()
+            D = dd - dr * rr_inv * rd
+            etav = rr_inv * rd
             etav.truncate(1, inplace=True)
         else:
             D = dd.copy()
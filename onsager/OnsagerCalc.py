@@ -21,13 +21,16 @@ Now with HDF5 write / read capability for VacancyMediated module
 __author__ = 'Dallas R. Trinkle'
 
 import numpy as np
-from scipy.linalg import pinv2, solve
+from scipy.linalg import pinv2, solve, lu_factor, lu_solve
 import copy, collections, itertools, warnings
+import hashlib
 from functools import reduce
 from onsager import GFcalc
 from onsager import crystal
 from onsager import crystalStars as stars
 from onsager import supercell
+from onsager import instrument
+from onsager import cachestore
 
 # database tags
 INTERSTITIAL_TAG = 'i'
@@ -79,6 +82,9 @@ class Interstitial(object):
         self.jumpnetwork = jumpnetwork
         self.VectorBasis, self.VV = self.crys.FullVectorBasis(self.chem)
         self.NV = len(self.VectorBasis)
+        # flattened versions of our jumpnetwork and VectorBasis, for batched evaluation
+        self.jump_i, self.jump_j, self.jump_dx, self.jump_t = self.generateJumpArrays()
+        self.VectorBasisArray = np.array(self.VectorBasis).reshape((self.NV, self.N, self.dim))
         # quick check to see if our projected omega matrix will be invertible
         # only really needed if we have a non-empty vector basis
         self.omega_invertible = True
@@ -96,6 +102,7 @@ class Interstitial(object):
         self.jumpgroupops = self.generateJumpGroupOps()  # list of group ops to take first rep. into whole list
         self.siteSymmTensorBasis = self.generateSiteSymmTensorBasis()  # projections for *first rep. only*
         self.jumpSymmTensorBasis = self.generateJumpSymmTensorBasis()  # projections for *first rep. only*
+        self.siteDipoleMap, self.jumpDipoleMap = self.generateDipoleMaps()  # linear maps for siteDipoles, jumpDipoles
         self.tags, self.tagdict, self.tagdicttype = self.generatetags()  # now with tags!
 
     @staticmethod
@@ -254,6 +261,21 @@ class Interstitial(object):
             groupops.append(oplist)
         return groupops
 
+    def generateJumpArrays(self):
+        """
+        Flattens the jumpnetwork into arrays, one entry for each jump.
+
+        :return jump_i[Njumps]: initial site index
+        :return jump_j[Njumps]: final site index
+        :return jump_dx[Njumps, 3]: jump vector
+        :return jump_t[Njumps]: transition type (index into jumpnetwork)
+        """
+        jumps = [(i, j, dx, t) for t, jumplist in enumerate(self.jumpnetwork) for ((i, j), dx) in jumplist]
+        return np.array([i for (i, j, dx, t) in jumps], dtype=int), \
+               np.array([j for (i, j, dx, t) in jumps], dtype=int), \
+               np.array([dx for (i, j, dx, t) in jumps], dtype=float).reshape((len(jumps), self.dim)), \
+               np.array([t for (i, j, dx, t) in jumps], dtype=int)
+
     def generateSiteSymmTensorBasis(self):
         """
         Generates a list of symmetric tensor bases for the first representative site
@@ -317,6 +339,26 @@ class Interstitial(object):
                  for (i, j), dx in t]
                 for t, pT, beT in zip(self.jumpnetwork, preT, betaeneT)]
 
+    def generateDipoleMaps(self):
+        """
+        Generates the linear maps equivalent to siteDipoles() and jumpDipoles(), to populate
+        dipoles for each site and jump from the representatives with array operations.
+
+        :return siteDipoleMap[N, 3, 3, 3, 3]: sitedipole[i] = siteDipoleMap[i] : dipole[invmap[i]]
+        :return jumpDipoleMap[Njumps, 3, 3, 3, 3]: jumpdipole[k] = jumpDipoleMap[k] : dipoleT[jump_t[k]]
+        """
+        siteDipoleMap = np.zeros((self.N, self.dim, self.dim, self.dim, self.dim))
+        jumpDipoleMap = np.zeros((len(self.jump_i), self.dim, self.dim, self.dim, self.dim))
+        for c, d in itertools.product(range(self.dim), repeat=2):
+            e_cd = np.zeros((self.dim, self.dim))
+            e_cd[c, d] = 1
+            siteDipoleMap[:, :, :, c, d] = self.siteDipoles([e_cd for sites in self.sitelist])
+            jumpdipoles = [dip for diplist in self.jumpDipoles([e_cd for jumps in self.jumpnetwork])
+                           for dip in diplist]
+            if len(jumpdipoles) > 0:
+                jumpDipoleMap[:, :, :, c, d] = jumpdipoles
+        return siteDipoleMap, jumpDipoleMap
+
     def siteDipoles(self, dipoles):
         """
         Returns a list of the elastic dipole on each site, given the dipoles
@@ -424,6 +466,121 @@ class Interstitial(object):
         else:
             return D0 + Dcorrection, Db
 
+    def diffusivitybatch(self, pre, betaene, preT, betaeneT, CalcDeriv=False):
+        """
+        Array version of diffusivity(): computes the diffusivity (and optionally the negative
+        derivative with respect to beta) for a set of NT thermodynamic / kinetic inputs at once,
+        such as a range of temperatures. Each input can either be a single list (used for all NT),
+        or have the first index run over the NT inputs.
+
+        :param pre[(NT,) Nsites]: prefactors for unique sites
+        :param betaene[(NT,) Nsites]: site energies divided by kB T
+        :param preT[(NT,) Njumps]: prefactors for transition states
+        :param betaeneT[(NT,) Njumps]: transition state energies divided by kB T
+        :return D[NT, 3, 3]: diffusivity as a 3x3 tensor
+        :return DE[NT, 3, 3]: diffusivity times activation barrier (if CalcDeriv == True)
+        """
+        siteene, rho, bET, rate, symmrate = self._ratesbatch(pre, betaene, preT, betaeneT)
+        sqrtrho = np.sqrt(rho)
+        ji, jj, jdx = self.jump_i, self.jump_j, self.jump_dx
+        Eave = np.sum(rho * siteene, axis=1, keepdims=True)
+        dxdx = 0.5 * np.einsum('ka,kb->kab', jdx, jdx)
+        D0 = np.einsum('tk,kab->tab', rho[:, ji] * rate, dxdx)
+        Db = np.einsum('tk,kab->tab', rho[:, ji] * rate * (bET - Eave), dxdx)
+        if self.NV > 0:
+            # scatter the jumps into omega_ij and bias_i, then project onto our VectorBasis
+            onehot_i = np.eye(self.N)[ji]
+            omega_ij = self._omegabatch(symmrate, rate)
+            domega_ij = self._omegabatch(symmrate * (bET - 0.5 * (siteene[:, ji] + siteene[:, jj])),
+                                         rate * (bET - siteene[:, ji]))
+            bias_i = np.einsum('ki,tk,kd->tid', onehot_i, sqrtrho[:, ji] * rate, jdx)
+            dbias_i = np.einsum('ki,tk,kd->tid', onehot_i,
+                                sqrtrho[:, ji] * rate * (bET - 0.5 * (siteene[:, ji] + Eave)), jdx)
+            VB = self.VectorBasisArray
+            omega_v = np.einsum('aid,tij,bjd->tab', VB, omega_ij, VB)
+            domega_v = np.einsum('aid,tij,bjd->tab', VB, domega_ij, VB)
+            bias_v, dbias_v = np.einsum('tid,aid->ta', bias_i, VB), np.einsum('tid,aid->ta', dbias_i, VB)
+            if self.omega_invertible:
+                gamma_v = np.linalg.solve(omega_v, bias_v[..., np.newaxis])[..., 0]
+            else:
+                gamma_v = np.einsum('tab,tb->ta', np.linalg.pinv(omega_v), bias_v)
+            dgamma_v = np.einsum('tab,tb->ta', domega_v, gamma_v)
+            D0 += np.einsum('xyab,ta,tb->txy', self.VV, bias_v, gamma_v)
+            Db += np.einsum('xyab,ta,tb->txy', self.VV, dbias_v, gamma_v) \
+                  + np.einsum('xyab,ta,tb->txy', self.VV, gamma_v, dbias_v) \
+                  - np.einsum('xyab,ta,tb->txy', self.VV, gamma_v, dgamma_v)
+
+        if not CalcDeriv:
+            return D0
+        else:
+            return D0, Db
+
+    def _ratesbatch(self, pre, betaene, preT, betaeneT, NT=1):
+        """
+        Site probabilities and rates for each jump, for the batched evaluations. Each input can
+        either be a single list, or have the first index run over the inputs; all are broadcast
+        to a common number of inputs NT.
+
+        :param pre[(NT,) Nsites]: prefactors for unique sites
+        :param betaene[(NT,) Nsites]: site energies divided by kB T
+        :param preT[(NT,) Njumps]: prefactors for transition states
+        :param betaeneT[(NT,) Njumps]: transition state energies divided by kB T
+        :param NT: minimum number of inputs (for broadcasting with other inputs)
+        :return siteene[NT, N]: site energy divided by kB T for each site
+        :return rho[NT, N]: site probabilities, normalized
+        :return bET[NT, Njumps]: transition state energy divided by kB T for each jump
+        :return rate[NT, Njumps]: rate for each jump (follows jump_i, jump_j)
+        :return symmrate[NT, Njumps]: symmetrized rate for each jump
+        """
+        pre, betaene = np.atleast_2d(pre), np.atleast_2d(betaene)
+        preT, betaeneT = np.atleast_2d(preT), np.atleast_2d(betaeneT)
+        if __debug__:
+            if pre.shape[-1] != len(self.sitelist): raise IndexError(
+                "length of prefactor {} doesn't match sitelist".format(pre))
+            if betaene.shape[-1] != len(self.sitelist): raise IndexError(
+                "length of energies {} doesn't match sitelist".format(betaene))
+            if preT.shape[-1] != len(self.jumpnetwork): raise IndexError(
+                "length of prefactor {} doesn't match jump network".format(preT))
+            if betaeneT.shape[-1] != len(self.jumpnetwork): raise IndexError(
+                "length of energies {} doesn't match jump network".format(betaeneT))
+        NT = max(NT, pre.shape[0], betaene.shape[0], preT.shape[0], betaeneT.shape[0])
+        pre, betaene = np.broadcast_to(pre, (NT, pre.shape[-1])), np.broadcast_to(betaene, (NT, betaene.shape[-1]))
+        preT, betaeneT = np.broadcast_to(preT, (NT, preT.shape[-1])), \
+                         np.broadcast_to(betaeneT, (NT, betaeneT.shape[-1]))
+        ji, jj = self.jump_i, self.jump_j
+        # be careful to make sure that we don't under-/over-flow on beta*ene
+        siteene, sitepre = betaene[:, self.invmap], pre[:, self.invmap]
+        rho = sitepre * np.exp(np.min(betaene, axis=1, keepdims=True) - siteene)
+        rho /= np.sum(rho, axis=1, keepdims=True)
+        bET = betaeneT[:, self.jump_t]
+        rate = preT[:, self.jump_t] * np.exp(siteene[:, ji] - bET) / sitepre[:, ji]
+        symmrate = preT[:, self.jump_t] * np.exp(0.5 * siteene[:, ji] + 0.5 * siteene[:, jj] - bET) / \
+                   np.sqrt(sitepre[:, ji] * sitepre[:, jj])
+        return siteene, rho, bET, rate, symmrate
+
+    def _omegabatch(self, symmrate, rate):
+        """
+        Scatter symmetrized rates (off-diagonal) and escape rates (diagonal) into site matrices.
+
+        :param symmrate[NT, Njumps]: symmetrized rate for each jump
+        :param rate[NT, Njumps]: rate for each jump, removed from the diagonal of the initial site
+        :return omega_ij[NT, N, N]: symmetrized rate matrix
+        """
+        onehot_i, onehot_j = np.eye(self.N)[self.jump_i], np.eye(self.N)[self.jump_j]
+        return np.matmul(onehot_i.T * symmrate[:, np.newaxis, :], onehot_j) - \
+               np.einsum('ta,ab->tab', np.dot(rate, onehot_i), np.eye(self.N))
+
+    def _sitedipolesbatch(self, dipole, NT):
+        """
+        Array version of siteDipoles().
+
+        :param dipole[NT', Nsites, 3, 3]: dipoles for the first representative site; NT' = 1 or NT
+        :param NT: number of inputs
+        :return sitedipoles[NT, N, 3, 3]: dipole for each site
+        """
+        dipole = np.broadcast_to(dipole, (NT,) + dipole.shape[1:])
+        return np.einsum('iabcd,ticd->tiab', self.siteDipoleMap, dipole[:, self.invmap])
+
     def elastodiffusion(self, pre, betaene, dipole, preT, betaeneT, dipoleT):
         """
         Computes the elastodiffusion tensor for our element given prefactors, energies/kB T,
@@ -439,21 +596,6 @@ class Interstitial(object):
         :return D[3,3]: diffusivity as 3x3 tensor
         :return dD[3,3,3,3]: elastodiffusion tensor as 3x3x3x3 tensor
         """
-
-        def vector_tensor_outer(v, a):
-            """Construct the outer product of v and a"""
-            va = np.zeros((self.dim, self.dim, self.dim))
-            for i, j, k in itertools.product(range(self.dim), repeat=3):
-                va[i, j, k] = v[i] * a[j, k]
-            return va
-
-        def tensor_tensor_outer(a, b):
-            """Construct the outer product of a and b"""
-            ab = np.zeros((self.dim, self.dim, self.dim, self.dim))
-            for i, j, k, l in itertools.product(range(self.dim), repeat=4):
-                ab[i, j, k, l] = a[i, j] * b[k, l]
-            return ab
-
         if __debug__:
             if len(pre) != len(self.sitelist): raise IndexError(
                 "length of prefactor {} doesn't match sitelist".format(pre))
@@ -467,61 +609,70 @@ class Interstitial(object):
                 "length of energies {} doesn't match jump network".format(betaeneT))
             if len(dipoleT) != len(self.jumpnetwork): raise IndexError(
                 "length of dipoles {} doesn't match jump network".format(dipoleT))
-        rho = self.siteprob(pre, betaene)
-        sqrtrho = np.sqrt(rho)
-        ratelist = self.ratelist(pre, betaene, preT, betaeneT)
-        symmratelist = self.symmratelist(pre, betaene, preT, betaeneT)
-        omega_ij = np.zeros((self.N, self.N))
-        bias_i = np.zeros((self.N, self.dim))
-        biasP_i = np.zeros((self.N, self.dim, self.dim, self.dim))
-        domega_ij = np.zeros((self.N, self.N, self.dim, self.dim))
-        sitedipoles = self.siteDipoles(dipole)
-        jumpdipoles = self.jumpDipoles(dipoleT)
-        dipoleave = np.tensordot(rho, sitedipoles, [(0), (0)])  # average dipole
+        D0, Dp = self.elastodiffusionbatch(pre, betaene, dipole, preT, betaeneT, dipoleT)
+        return D0[0], Dp[0]
 
-        D0 = np.zeros((self.dim, self.dim))
-        Dp = np.zeros((self.dim, self.dim, self.dim, self.dim))
-        for transitionset, rates, symmrates, dipoles in zip(self.jumpnetwork, ratelist, symmratelist, jumpdipoles):
-            for ((i, j), dx), rate, symmrate, dipole in zip(transitionset, rates, symmrates, dipoles):
-                # symmrate = sqrtrho[i]*invsqrtrho[j]*rate
-                omega_ij[i, j] += symmrate
-                omega_ij[i, i] -= rate
-                domega_ij[i, j] -= symmrate * (dipole - 0.5 * (sitedipoles[i] + sitedipoles[j]))
-                domega_ij[i, i] += rate * (dipole - sitedipoles[i])
-                bias_i[i] += sqrtrho[i] * rate * dx
-                biasP_i[i] += vector_tensor_outer(sqrtrho[i] * rate * dx, dipole - 0.5 * (sitedipoles[i] + dipoleave))
-                D0 += 0.5 * np.outer(dx, dx) * rho[i] * rate
-                Dp += 0.5 * tensor_tensor_outer(np.outer(dx, dx) * rho[i] * rate, dipole - dipoleave)
+    def elastodiffusionbatch(self, pre, betaene, dipole, preT, betaeneT, dipoleT):
+        """
+        Array version of elastodiffusion(): computes the diffusivity and elastodiffusion tensor
+        for a set of NT thermodynamic / kinetic inputs and elastic dipoles at once, such as a range
+        of temperatures. Each input can either be a single list (used for all NT), or have the
+        first index run over the NT inputs.
+
+        :param pre[(NT,) Nsites]: prefactors for unique sites
+        :param betaene[(NT,) Nsites]: site energies divided by kB T
+        :param dipole[(NT,) Nsites, 3, 3]: elastic dipoles divided by kB T
+        :param preT[(NT,) Njumps]: prefactors for transition states
+        :param betaeneT[(NT,) Njumps]: transition state energies divided by kB T
+        :param dipoleT[(NT,) Njumps, 3, 3]: elastic dipoles divided by kB T
+        :return D[NT, 3, 3]: diffusivity as 3x3 tensor
+        :return dD[NT, 3, 3, 3, 3]: elastodiffusion tensor as 3x3x3x3 tensor
+        """
+        dipole = np.array(dipole, dtype=float).reshape((-1, len(self.sitelist), self.dim, self.dim))
+        dipoleT = np.array(dipoleT, dtype=float).reshape((-1, len(self.jumpnetwork), self.dim, self.dim))
+        siteene, rho, bET, rate, symmrate = self._ratesbatch(pre, betaene, preT, betaeneT,
+                                                             max(dipole.shape[0], dipoleT.shape[0]))
+        sqrtrho = np.sqrt(rho)
+        ji, jj, jdx = self.jump_i, self.jump_j, self.jump_dx
+        # populate the dipoles on all of the sites and jumps, and our average dipole
+        sitedipoles = self._sitedipolesbatch(dipole, rho.shape[0])
+        jumpdipoles = np.einsum('kabcd,tkcd->tkab', self.jumpDipoleMap,
+                                np.broadcast_to(dipoleT, (rho.shape[0],) + dipoleT.shape[1:])[:, self.jump_t])
+        dipoleave = np.einsum('ti,tiab->tab', rho, sitedipoles)
+
+        D0 = 0.5 * np.einsum('tk,ka,kb->tab', rho[:, ji] * rate, jdx, jdx)
+        Dp = 0.5 * np.einsum('tk,ka,kb,tkcd->tabcd', rho[:, ji] * rate, jdx, jdx,
+                             jumpdipoles - dipoleave[:, np.newaxis])
         if self.NV > 0:
-            omega_v = np.zeros((self.NV, self.NV))
-            bias_v = np.zeros(self.NV)
-            domega_v = np.zeros((self.NV, self.NV, self.dim, self.dim))
-            # NOTE: there's probably a SUPER clever way to do this with higher dimensional arrays and dot...
-            for a, va in enumerate(self.VectorBasis):
-                bias_v[a] = np.tensordot(bias_i, va, ((0, 1), (0, 1)))  # can also use trace(dot(bias_i.T, va))
-                for b, vb in enumerate(self.VectorBasis):
-                    omega_v[a, b] = np.tensordot(va, np.tensordot(omega_ij, vb, ((1), (0))), ((0, 1), (0, 1)))
-                    domega_v[a, b] = np.tensordot(va, np.tensordot(domega_ij, vb, ((1), (0))), ((0, 1), (0, 3)))
-            gamma_v = self.bias_solver(omega_v, bias_v)
-            dg = np.tensordot(domega_v, gamma_v, ((1), (0)))
-            # need to project gamma_v *back onto* our sites; not sure if we can just do with a dot since
-            # self.VectorBasis is a list of Nx3 matrices
-            gamma_i = sum(g * va for g, va in zip(gamma_v, self.VectorBasis))
-            D0 += np.dot(np.dot(self.VV, bias_v), gamma_v)
-            for c, d in itertools.product(range(self.dim), repeat=2):
-                Dp[:, :, c, d] += np.tensordot(gamma_i, biasP_i[:, :, c, d], ((0), (0))) + \
-                                  np.tensordot(biasP_i[:, :, c, d], gamma_i, ((0), (0)))
-            Dp += np.tensordot(np.tensordot(self.VV, gamma_v, ((3), (0))), dg, ((2), (0)))
-
-        for a, b, c, d in itertools.product(range(self.dim), repeat=4):
-            if a == c:
-                Dp[a, b, c, d] += 0.5 * D0[b, d]
-            if a == d:
-                Dp[a, b, c, d] += 0.5 * D0[b, c]
-            if b == c:
-                Dp[a, b, c, d] += 0.5 * D0[a, d]
-            if b == d:
-                Dp[a, b, c, d] += 0.5 * D0[a, c]
+            # scatter the jumps into omega_ij and bias_i, then project onto our VectorBasis
+            onehot_i, onehot_j = np.eye(self.N)[ji], np.eye(self.N)[jj]
+            omega_ij = self._omegabatch(symmrate, rate)
+            ddipole_ij = jumpdipoles - 0.5 * (sitedipoles[:, ji] + sitedipoles[:, jj])
+            ddipole_ii = jumpdipoles - sitedipoles[:, ji]
+            domega_ij = -np.einsum('ki,kj,tk,tkcd->tijcd', onehot_i, onehot_j, symmrate, ddipole_ij) + \
+                        np.einsum('ki,ij,tk,tkcd->tijcd', onehot_i, np.eye(self.N), rate, ddipole_ii)
+            bias_i = np.einsum('ki,tk,kx->tix', onehot_i, sqrtrho[:, ji] * rate, jdx)
+            biasP_i = np.einsum('ki,tk,kx,tkcd->tixcd', onehot_i, sqrtrho[:, ji] * rate, jdx,
+                                jumpdipoles - 0.5 * (sitedipoles[:, ji] + dipoleave[:, np.newaxis]))
+            VB = self.VectorBasisArray
+            omega_v = np.einsum('aie,tij,bje->tab', VB, omega_ij, VB)
+            domega_v = np.einsum('aie,tijcd,bje->tabcd', VB, domega_ij, VB)
+            bias_v = np.einsum('tie,aie->ta', bias_i, VB)
+            if self.omega_invertible:
+                gamma_v = np.linalg.solve(omega_v, bias_v[..., np.newaxis])[..., 0]
+            else:
+                gamma_v = np.einsum('tab,tb->ta', np.linalg.pinv(omega_v), bias_v)
+            dg = np.einsum('tabcd,tb->tacd', domega_v, gamma_v)
+            # project gamma_v *back onto* our sites
+            gamma_i = np.einsum('ta,aie->tie', gamma_v, VB)
+            D0 += np.einsum('xyab,ta,tb->txy', self.VV, bias_v, gamma_v)
+            Dp += np.einsum('tix,tiycd->txycd', gamma_i, biasP_i) + \
+                  np.einsum('tixcd,tiy->txycd', biasP_i, gamma_i) + \
+                  np.einsum('xyab,tb,tacd->txycd', self.VV, gamma_v, dg)
+
+        delta = np.eye(self.dim)
+        Dp += 0.5 * (np.einsum('ac,tbd->tabcd', delta, D0) + np.einsum('ad,tbc->tabcd', delta, D0) +
+                     np.einsum('bc,tad->tabcd', delta, D0) + np.einsum('bd,tac->tabcd', delta, D0))
         return D0, Dp
 
     def losstensors(self, pre, betaene, dipole, preT, betaeneT):
@@ -595,6 +746,48 @@ class Interstitial(object):
         # pass back list
         return lambdaL
 
+    def losstensorsbatch(self, pre, betaene, dipole, preT, betaeneT, frequencies=None):
+        """
+        Array version of losstensors(): computes the relaxation rates and internal friction loss tensors
+        for a set of NT thermodynamic / kinetic inputs and elastic dipoles at once, such as a range of
+        temperatures. Each input can either be a single list (used for all NT), or have the first index
+        run over the NT inputs. Unlike losstensors(), every eigenmode is returned--degenerate modes
+        are *not* combined, and the equilibrium mode is included with a zero loss tensor--so that
+        the results are dense arrays. Optionally, also evaluates the (Debye) loss function
+        sum_modes L lambda nu/(lambda^2 + nu^2) for a set of loading frequencies nu.
+
+        :param pre[(NT,) Nsites]: prefactors for unique sites
+        :param betaene[(NT,) Nsites]: site energies divided by kB T
+        :param dipole[(NT,) Nsites, 3, 3]: elastic dipoles divided by kB T
+        :param preT[(NT,) Njumps]: prefactors for transition states
+        :param betaeneT[(NT,) Njumps]: transition state energies divided by kB T
+        :param frequencies[Nfreq]: loading frequencies (same units as rates) for the loss function (optional)
+        :return lamb[NT, N]: relaxation rate for each eigenmode, in ascending order
+        :return L[NT, N, 3, 3, 3, 3]: loss tensor for each eigenmode; needs to be multiplied by kB T
+        :return Q[NT, Nfreq, 3, 3, 3, 3]: loss function at each frequency (only if frequencies is not None);
+            needs to be multiplied by kB T
+        """
+        dipole = np.array(dipole, dtype=float).reshape((-1, len(self.sitelist), self.dim, self.dim))
+        siteene, rho, bET, rate, symmrate = self._ratesbatch(pre, betaene, preT, betaeneT, dipole.shape[0])
+        sqrtrho = np.sqrt(rho)
+        sitedipoles = self._sitedipolesbatch(dipole, rho.shape[0])
+        omega_ij = self._omegabatch(symmrate, rate)
+        # diagonalize; omega is negative definite, so negate (and reverse) to get ascending relaxation rates
+        lamb, phi = np.linalg.eigh(omega_ij)
+        lamb, phi = -lamb[:, ::-1], phi[:, :, ::-1]
+        averate = np.abs(np.trace(omega_ij, axis1=1, axis2=2)) / self.N
+        F = np.einsum('tim,ti,tiab->tmab', phi, sqrtrho, sitedipoles)
+        L = np.einsum('tmab,tmcd->tmabcd', F, F)
+        # zero out the equilibrium mode(s):
+        L[(np.abs(lamb) < 1e-8 * averate[:, np.newaxis]) |
+          np.isclose(np.einsum('tim,ti->tm', phi, sqrtrho), 1)] = 0
+        if frequencies is None:
+            return lamb, L
+        nu = np.atleast_1d(frequencies)[np.newaxis, :, np.newaxis]
+        denom = lamb[:, np.newaxis, :] ** 2 + nu ** 2
+        weight = np.divide(lamb[:, np.newaxis, :] * nu, denom, out=np.zeros_like(denom), where=denom > 0)
+        return lamb, L, np.einsum('tfm,tmabcd->tfabcd', weight, L)
+
 
 # YAML tags
 VACANCYTHERMOKINETICS_YAMLTAG = '!VacancyThermoKinetics'
@@ -609,8 +802,15 @@ class vacancyThermoKinetics(collections.namedtuple('vacancyThermoKinetics',
     :param betaene: energy for sites / kBT
     :param preT: prefactors for transition states
     :param betaeneT: transition state energy for sites / kBT
+
+    Equality and hashing use a canonical key: prefactors are folded into the energies
+    (:math:`\\beta E - \\ln(\\text{pre})`), both are shifted by the minimum site value, and
+    then quantized to ``tolerance``; the GF values are unchanged by any of these operations.
     """
 
+    # quantization of the (scaled) energies in the canonical key
+    tolerance = 1e-8
+
     def __repr__(self):
         return "{}(pre={}, betaene={}, preT={}, betaeneT={})".format(self.__class__.__name__,
                                                                      self.pre, self.betaene,
@@ -620,18 +820,31 @@ class vacancyThermoKinetics(collections.namedtuple('vacancyThermoKinetics',
         """Return a proper dict"""
         return {'pre': self.pre, 'betaene': self.betaene, 'preT': self.preT, 'betaeneT': self.betaeneT}
 
+    def canonicalkey(self):
+        """
+        Canonical (integer) representation: prefactors folded into energies, shifted by
+        the minimum site value, and quantized to tolerance. Computed once, and stored.
+
+        :return key[Nsites + Ntrans]: quantized site energies followed by transition state energies
+        """
+        key = self.__dict__.get('_canonicalkey')
+        if key is None:
+            bF = np.asarray(self.betaene, dtype=float) - np.log(self.pre)
+            bFT = np.asarray(self.betaeneT, dtype=float) - np.log(self.preT)
+            bFmin = np.min(bF)
+            key = np.round(np.hstack((bF - bFmin, bFT - bFmin)) / self.tolerance).astype(np.int64)
+            self.__dict__['_canonicalkey'] = key
+        return key
+
     def __eq__(self, other):
-        # Note: could scale all prefactors by min(pre) and subtract all energies by min(ene)...?
         return isinstance(other, self.__class__) and \
-               np.allclose(self.pre, other.pre) and np.allclose(self.betaene, other.betaene) and \
-               np.allclose(self.preT, other.preT) and np.allclose(self.betaeneT, other.betaeneT)
+               np.array_equal(self.canonicalkey(), other.canonicalkey())
 
     def __ne__(self, other):
-        return not __eq__(other)
+        return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(self.pre.data.tobytes() + self.betaene.data.tobytes() +
-                    self.preT.data.tobytes() + self.betaeneT.data.tobytes())
+        return hash(self.canonicalkey().tobytes())
 
     @staticmethod
     def vacancyThermoKinetics_representer(dumper, data):
@@ -679,13 +892,89 @@ def arrays2vTKdict(vTKarray, valarray, vTKsplits):
     :param vTKsplits: split placement for vTK entries
     :return vTKdict: dictionary, indexed by vTK objects, whose entries are arrays
     """
-    if all(x is None for x in (vTKarray, valarray, vTKsplits)): return {}
-    vTKdict = {}
+    if all(x is None for x in (vTKarray, valarray, vTKsplits)): return collections.OrderedDict()
+    vTKdict = collections.OrderedDict()
     for vTKa, val in zip(vTKarray, valarray):
         vTKdict[vacancyThermoKinetics(*np.hsplit(vTKa, vTKsplits))] = val
     return vTKdict
 
 
+def lowrankGFupdate(G, indices, om):
+    """
+    Green function update (1 + G*omega)^-1 G for a rate matrix change omega that is only non-zero
+    in the block om = omega[indices, indices]. Done as a low-rank (Woodbury) update,
+    G - G[:, indices] (1 + om G[indices, indices])^-1 om G[indices, :], so that we only solve a
+    system the size of the block. Also works for stacks of matrices (first index).
+
+    :param G: array[..., N, N] Green function
+    :param indices: list of indices where omega is non-zero
+    :param om: array[..., Nind, Nind] block of omega
+    :return G: array[..., N, N] updated Green function
+    """
+    if len(indices) == 0: return G.copy()
+    Gcol = G[..., :, indices]
+    omGrow = np.matmul(om, G[..., indices, :])
+    return G - np.matmul(Gcol, np.linalg.solve(np.eye(len(indices)) + np.matmul(om, Gcol[..., indices, :]),
+                                               omGrow))
+
+
+class GFcacheHDF5(object):
+    """
+    Persistent store of GF evaluations (GF values, bare vacancy diffusivity, bias correction) in an
+    HDF5 file, so that separate processes working with the same diffuser can reuse each other's
+    evaluations. Entries are keyed by the diffuser key (see VacancyMediated.GFcachekey()) and
+    the vacancyThermoKinetics. Kept in a cachestore.HDF5CacheStore, which handles the locking and
+    the eviction of the oldest entries once there are more than maxentries.
+    """
+
+    def __init__(self, filename, maxentries=4096):
+        """
+        Create (or open) a persistent GF cache.
+
+        :param filename: name of HDF5 file to store cache
+        :param maxentries: maximum number of entries to keep; oldest entries are evicted first
+        """
+        self.store = cachestore.HDF5CacheStore(filename, maxentries)
+
+    @staticmethod
+    def entrykey(diffkey, vTK):
+        """
+        Key for an entry in the cache.
+
+        :param diffkey: key identifying the diffuser
+        :param vTK: vacancyThermoKinetics
+        :return key: hex digest string
+        """
+        return hashlib.sha1(diffkey.encode('utf-8') + vTK.canonicalkey().tobytes()).hexdigest()
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, diffkey, vTK):
+        """
+        Return cached values, or None if not present.
+
+        :param diffkey: key identifying the diffuser
+        :param vTK: vacancyThermoKinetics
+        :return (GF, L0vv, etav): cached values, or None
+        """
+        values = self.store.get(self.entrykey(diffkey, vTK))
+        if values is None: return None
+        return values['GF'], values['L0vv'], values['etav']
+
+    def put(self, diffkey, vTK, GF, L0vv, etav):
+        """
+        Store values in the cache; evicts the oldest entries if we have more than maxentries.
+
+        :param diffkey: key identifying the diffuser
+        :param vTK: vacancyThermoKinetics
+        :param GF[NGFstars]: Green function values
+        :param L0vv[3, 3]: bare vacancy diffusivity
+        :param etav[N, 3]: vacancy bias correction
+        """
+        self.store.put(self.entrykey(diffkey, vTK), {'GF': GF, 'L0vv': L0vv, 'etav': etav})
+
+
 class VacancyMediated(object):
     """
     A class to compute vacancy-mediated solute transport coefficients, specifically
@@ -700,6 +989,12 @@ class VacancyMediated(object):
     range (number of "shells" -- see ``crystalStars.StarSet`` for precise definition).
     """
 
+    # persistent GF cache (see setGFcache()) and our key for it (see GFcachekey())
+    GFcache = None
+    _GFcachekey = None
+    # maximum number of entries in the in-memory GF cache (least recently used are removed); None = no limit
+    GFcachemax = 4096
+
     def __init__(self, crys, chem, sitelist, jumpnetwork, Nthermo=0, NGFmax=4):
         """
         Create our diffusion calculator for a given crystal structure, chemical identity,
@@ -750,7 +1045,35 @@ class VacancyMediated(object):
 
     def clearcache(self):
         """Clear out the GF cache values"""
-        self.GFvalues, self.Lvvvalues, self.etavvalues = {}, {}, {}
+        self.GFvalues, self.Lvvvalues, self.etavvalues = \
+            collections.OrderedDict(), collections.OrderedDict(), collections.OrderedDict()
+        self._GFcachekey = None
+
+    def setGFcache(self, GFcache):
+        """
+        Attach a persistent GF cache (such as GFcacheHDF5) that is consulted when our in-memory
+        cache misses, and that receives any newly evaluated GF values; None to detach.
+
+        :param GFcache: object with get(diffkey, vTK) and put(diffkey, vTK, GF, L0vv, etav) methods
+        """
+        self.GFcache = GFcache
+
+    def GFcachekey(self):
+        """
+        Canonical key identifying the GF values of this diffuser in a persistent cache: built from
+        the crystal, chemistry, NGFmax, the vacancy jumpnetwork, and the GF star representatives.
+
+        :return diffkey: hex digest string
+        """
+        if self._GFcachekey is None:
+            keystr = '{!r}|{}|{}|'.format(self.crys, self.chem, self.NGFmax)
+            keystr += '|'.join('{},{}:{}'.format(i, j, np.round(dx, 8).tolist())
+                               for jumplist in self.om0_jn for ((i, j), dx) in jumplist)
+            keystr += '|'
+            keystr += '|'.join('{},{}:{}'.format(PS.i, PS.j, np.round(PS.dx, 8).tolist())
+                               for PS in [self.GFstarset.states[s[0]] for s in self.GFstarset.stars])
+            self._GFcachekey = hashlib.sha1(keystr.encode('utf-8')).hexdigest()
+        return self._GFcachekey
 
     def generate(self, Nthermo):
         """
@@ -761,12 +1084,19 @@ class VacancyMediated(object):
         """
         if Nthermo == getattr(self, 'Nthermo', 0): return
         self.Nthermo = Nthermo
+        clock = instrument.timer.stopwatch('VacancyMediated.generate')
 
         self.thermo.generate(Nthermo, originstates=False)
+        clock.split('thermo')
         self.kinetic.generate(Nthermo + 1, originstates=True)  # now include origin states (for removal)
+        clock.split('kinetic')
         self.vkinetic.generate(self.kinetic)
+        # vstarouter: outer products of the vector stars, block diagonal by star, stored sparse
+        self.vstarouter = self.vkinetic.sparseouter
+        clock.split('vkinetic')
         # TODO: check the GF calculator against the range in GFstarset to make sure its adequate
-        self.GFexpansion, self.GFstarset = self.vkinetic.GFexpansion()
+        self.GFexpansion, self.GFstarset = self.vkinetic.GFexpansion(sparse=True)
+        clock.split('GFexpansion')
 
         # some indexing helpers:
         # thermo2kin maps star index in thermo to kinetic (should just be range(n), but we use this for safety)
@@ -781,9 +1111,12 @@ class VacancyMediated(object):
         self.vstar2kin = [self.kinetic.index[Rs[0]] for Rs in self.vkinetic.vecpos]
         self.kin2vstar = [[j for j in range(self.vkinetic.Nvstars) if self.vstar2kin[j] == i]
                           for i in range(self.kinetic.Nstars)]
+        clock.split('indexing')
         # jumpnetwork, jumptype (omega0), star-pair for jump
         self.om1_jn, self.om1_jt, self.om1_SP = self.kinetic.jumpnetwork_omega1()
+        clock.split('omega1')
         self.om2_jn, self.om2_jt, self.om2_SP = self.kinetic.jumpnetwork_omega2()
+        clock.split('omega2')
         # Prune the om1 list: remove entries that have jumps between stars in outerkin:
         # work in reverse order so that popping is safe (and most of the offending entries are at the end
         for i, SP in zip(reversed(range(len(self.om1_SP))), reversed(self.om1_SP)):
@@ -791,6 +1124,8 @@ class VacancyMediated(object):
                 self.om1_jn.pop(i), self.om1_jt.pop(i), self.om1_SP.pop(i)
         # empty dictionaries to store GF values
         self.clearcache()
+        clock.split('prune')
+        clock.stop()
 
     def generatematrices(self):
         """
@@ -798,17 +1133,22 @@ class VacancyMediated(object):
         This has been separated out in case the user wants to, e.g., prune / modify the networks
         after they've been created with generate(), then generatematrices() can be rerun.
         """
+        clock = instrument.timer.stopwatch('VacancyMediated.generatematrices')
 
         self.Dom1_om0, self.Dom1 = self.vkinetic.bareexpansions(self.om1_jn, self.om1_jt)
         self.Dom2_om0, self.Dom2 = self.vkinetic.bareexpansions(self.om2_jn, self.om2_jt)
+        clock.split('bareexpansions')
         self.om1_om0, self.om1_om0escape, self.om1expansion, self.om1escape = \
-            self.vkinetic.rateexpansions(self.om1_jn, self.om1_jt)
+            self.vkinetic.rateexpansions(self.om1_jn, self.om1_jt, sparse=True)
         self.om2_om0, self.om2_om0escape, self.om2expansion, self.om2escape = \
-            self.vkinetic.rateexpansions(self.om2_jn, self.om2_jt, omega2=True)
+            self.vkinetic.rateexpansions(self.om2_jn, self.om2_jt, omega2=True, sparse=True)
+        clock.split('rateexpansions')
         self.om1_b0, self.om1bias = self.vkinetic.biasexpansions(self.om1_jn, self.om1_jt)
         self.om2_b0, self.om2bias = self.vkinetic.biasexpansions(self.om2_jn, self.om2_jt, omega2=True)
+        clock.split('biasexpansions')
         self.OSindices, self.OSfolddown, self.OS_VB = self.vkinetic.originstateVectorBasisfolddown('solute')
         self.OSVfolddown = self.vkinetic.originstateVectorBasisfolddown('vacancy')[1]  # only need the folddown
+        clock.split('originstates')
 
         # more indexing helpers:
         # kineticsvWyckoff: Wyckoff position of solute and vacancy for kinetic stars
@@ -817,6 +1157,8 @@ class VacancyMediated(object):
                                  [self.kinetic.states[si[0]] for si in self.kinetic.stars]]
         self.omega0vacancyWyckoff = [(self.invmap[jumplist[0][0][0]], self.invmap[jumplist[0][0][1]])
                                      for jumplist in self.om0_jn]
+        clock.split('indexing')
+        clock.stop()
 
     def generatetags(self):
         """
@@ -1030,13 +1372,14 @@ class VacancyMediated(object):
     __HDF5list__ = ('chem', 'N', 'Nthermo', 'NGFmax', 'invmap',
                     'thermo2kin', 'kin2vacancy', 'outerkin', 'vstar2kin',
                     'om1_jt', 'om1_SP', 'om2_jt', 'om2_SP',
-                    'GFexpansion',
                     'Dom1_om0', 'Dom1', 'Dom2_om0', 'Dom2',
-                    'om1_om0', 'om1_om0escape', 'om1expansion', 'om1escape',
-                    'om2_om0', 'om2_om0escape', 'om2expansion', 'om2escape',
+                    'om1_om0escape', 'om1escape',
+                    'om2_om0escape', 'om2escape',
                     'om1_b0', 'om1bias', 'om2_b0', 'om2bias',
                     'OSindices', 'OSfolddown', 'OS_VB', 'OSVfolddown',
                     'kineticsvWyckoff', 'omega0vacancyWyckoff')
+    # expansions that are stored as SparseArrays:
+    __HDF5sparselist__ = ('GFexpansion', 'om1_om0', 'om1expansion', 'om2_om0', 'om2expansion')
     __taglist__ = ('vacancy', 'solute', 'solute-vacancy', 'omega0', 'omega1', 'omega2')
 
     def addhdf5(self, HDF5group):
@@ -1063,6 +1406,8 @@ class VacancyMediated(object):
         # arrays that we can deal with:
         for internal in self.__HDF5list__:
             HDF5group[internal] = getattr(self, internal)
+        for internal in self.__HDF5sparselist__:
+            getattr(self, internal).addhdf5(HDF5group.create_group(internal))
         # convert jumplist:
         jumplist, jumpindex = stars.doublelist2flatlistindex(self.jumpnetwork)
         HDF5group['jump_ij'], HDF5group['jump_dx'], HDF5group['jump_index'] = \
@@ -1119,6 +1464,8 @@ class VacancyMediated(object):
         diffuser.dim = diffuser.crys.dim
         for internal in cls.__HDF5list__:
             setattr(diffuser, internal, HDF5group[internal].value)
+        for internal in cls.__HDF5sparselist__:
+            setattr(diffuser, internal, stars.SparseArray.loadhdf5(HDF5group[internal]))
         diffuser.sitelist = [[] for i in range(max(diffuser.invmap) + 1)]
         for i, site in enumerate(diffuser.invmap):
             diffuser.sitelist[site].append(i)
@@ -1136,6 +1483,7 @@ class VacancyMediated(object):
         diffuser.NNstar = stars.StarSet.loadhdf5(diffuser.crys, HDF5group['NNstar'])
         diffuser.kinetic = stars.StarSet.loadhdf5(diffuser.crys, HDF5group['kinetic'])
         diffuser.vkinetic = stars.VectorStarSet.loadhdf5(diffuser.kinetic, HDF5group['vkinetic'])
+        diffuser.vstarouter = diffuser.vkinetic.sparseouter
         diffuser.GFstarset = stars.StarSet.loadhdf5(diffuser.crys, HDF5group['GFstarset'])
 
         # jump networks:
@@ -1159,7 +1507,7 @@ class VacancyMediated(object):
                                                  HDF5group['etavvalues_values'],
                                                  HDF5group['etavvalues_splits'])
         else:
-            diffuser.GFvalues, diffuser.Lvvvalues, diffuser.etavvalues = {}, {}, {}
+            diffuser.clearcache()
         # tags
         diffuser.tags, diffuser.tagdict, diffuser.tagdicttype = {}, {}, {}
         for tag in cls.__taglist__:
@@ -1370,51 +1718,241 @@ class VacancyMediated(object):
         bFT2 -= bFVmin + bFSmin
         return bFV, bFS, bFSV, bFT0, bFT1, bFT2
 
-    def _symmetricandescaperates(self, bFV, bFSVkinetic, bFT0, bFT1, bFT2):
+    def _probabilities(self, bFV, bFS, bFSV):
+        """
+        Compute the vacancy and solute-vacancy probabilities for a stack of scaled free
+        energies. Used by _Lijstack().
+
+        :param bFV[NT, NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
+        :param bFS[NT, NWyckoff]: beta*eneS - ln(preS) (relative to minimum value)
+        :param bFSV[NT, Nthermo]: beta*eneSV - ln(preSV) (excess)
+        :return probV[NT, NWyckoff]: vacancy probability at each Wyckoff position
+        :return probVsqrt[NT, NVstars]: sqrt of vacancy probability for each vector star
+        :return prob[NT, Nkinetic]: solute-vacancy probability for each kinetic star
+        :return bFSVkinetic[NT, Nkinetic]: beta*eneSV - ln(preSV) (TOTAL for solute-vacancy complex)
         """
-        Compute the symmetric, escape, and escape reference rates. Used by _lij().
+        Wyckoffsites = [sites[0] for sites in self.sitelist]
+        svS = np.array([s for (s, v) in self.kineticsvWyckoff], dtype=int)
+        svV = np.array([v for (s, v) in self.kineticsvWyckoff], dtype=int)
+        vstarvacancy = np.array([self.kin2vacancy[starindex] for starindex in self.vstar2kin], dtype=int)
+        probVsites = np.exp(np.min(bFV, axis=1, keepdims=True) - bFV[:, self.invmap])
+        probVsites *= self.N / np.sum(probVsites, axis=1, keepdims=True)  # normalize
+        probV = probVsites[:, Wyckoffsites]  # Wyckoff positions
+        probVsqrt = np.sqrt(probV[:, vstarvacancy])
+        probSsites = np.exp(np.min(bFS, axis=1, keepdims=True) - bFS[:, self.invmap])
+        probSsites *= self.N / np.sum(probSsites, axis=1, keepdims=True)  # normalize
+        probS = probSsites[:, Wyckoffsites]  # Wyckoff positions
+        bFSVkinetic = bFS[:, svS] + bFV[:, svV]  # NOT EXCESS: total
+        prob = probS[:, svS] * probV[:, svV]
+        for tindex, kindex in enumerate(self.thermo2kin):
+            bFSVkinetic[:, kindex] += bFSV[:, tindex]
+            prob[:, kindex] *= np.exp(-bFSV[:, tindex])
+        # zero out probability of any origin states... not clear this is really needed
+        for kindex, s in enumerate(self.kinetic.stars):
+            if self.kinetic.states[s[0]].iszero():
+                prob[:, kindex] = 0
+        return probV, probVsqrt, prob, bFSVkinetic
 
-        :param bFV[NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
-        :param bFSVkinetic[Nkinetic]: beta*eneSV - ln(preSV) (TOTAL for solute-vacancy complex)
-        :param bFT0[Nomega0]: beta*eneT0 - ln(preT0) (relative to minimum value of bFV)
-        :param bFT1[Nomega1]: beta*eneT1 - ln(preT1) (relative to minimum value of bFV + bFS)
-        :param bFT2[Nomega2]: beta*eneT2 - ln(preT2) (relative to minimum value of bFV + bFS)
-        :return omega0[Nomega0]: symmetric rate for omega0 jumps
-        :return omega1[Nomega1]: symmetric rate for omega1 jumps
-        :return omega2[Nomega2]: symmetric rate for omega2 jumps
-        :return omega0escape[NWyckoff, Nomega0]: escape rate elements for omega0 jumps
-        :return omega1escape[NVstars, Nomega1]: escape rate elements for omega1 jumps
-        :return omega2escape[NVstars, Nomega2]: escape rate elements for omega2 jumps
-        """
-        omega0 = np.zeros(len(self.om0_jn))
-        omega0escape = np.zeros((len(self.sitelist), len(self.om0_jn)))
-        for j, bF, (v1, v2) in zip(itertools.count(), bFT0, self.omega0vacancyWyckoff):
-            omega0escape[v1, j] = np.exp(-bF + bFV[v1])
-            omega0escape[v2, j] = np.exp(-bF + bFV[v2])
-            omega0[j] = np.sqrt(omega0escape[v1, j] * omega0escape[v2, j])
-        omega1 = np.zeros(len(self.om1_jn))
-        omega1escape = np.zeros((self.vkinetic.Nvstars, len(self.om1_jn)))
-        for j, (st1, st2), bFT in zip(itertools.count(), self.om1_SP, bFT1):
-            omF, omB = np.exp(-bFT + bFSVkinetic[st1]), np.exp(-bFT + bFSVkinetic[st2])
-            omega1[j] = np.sqrt(omF * omB)
-            for vst1 in self.kin2vstar[st1]: omega1escape[vst1, j] = omF
-            for vst2 in self.kin2vstar[st2]: omega1escape[vst2, j] = omB
-        omega2 = np.zeros(len(self.om2_jn))
-        omega2escape = np.zeros((self.vkinetic.Nvstars, len(self.om2_jn)))
-        for j, (st1, st2), bFT in zip(itertools.count(), self.om2_SP, bFT2):
-            omF, omB = np.exp(-bFT + bFSVkinetic[st1]), np.exp(-bFT + bFSVkinetic[st2])
-            omega2[j] = np.sqrt(omF * omB)
-            for vst1 in self.kin2vstar[st1]: omega2escape[vst1, j] = omF
-            for vst2 in self.kin2vstar[st2]: omega2escape[vst2, j] = omB
+    def _symmetricandescaperates(self, bFV, bFSVkinetic, bFT0, bFT1, bFT2):
+        """
+        Compute the symmetric, escape, and escape reference rates for a stack of scaled free
+        energies. Used by _Lijstack().
+
+        :param bFV[NT, NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
+        :param bFSVkinetic[NT, Nkinetic]: beta*eneSV - ln(preSV) (TOTAL for solute-vacancy complex)
+        :param bFT0[NT, Nomega0]: beta*eneT0 - ln(preT0) (relative to minimum value of bFV)
+        :param bFT1[NT, Nomega1]: beta*eneT1 - ln(preT1) (relative to minimum value of bFV + bFS)
+        :param bFT2[NT, Nomega2]: beta*eneT2 - ln(preT2) (relative to minimum value of bFV + bFS)
+        :return omega0[NT, Nomega0]: symmetric rate for omega0 jumps
+        :return omega1[NT, Nomega1]: symmetric rate for omega1 jumps
+        :return omega2[NT, Nomega2]: symmetric rate for omega2 jumps
+        :return omega0escape[NT, NWyckoff, Nomega0]: escape rate elements for omega0 jumps
+        :return omega1escape[NT, NVstars, Nomega1]: escape rate elements for omega1 jumps
+        :return omega2escape[NT, NVstars, Nomega2]: escape rate elements for omega2 jumps
+        """
+        NT, Nv = bFV.shape[0], self.vkinetic.Nvstars
+        om0_1 = np.array([v1 for (v1, v2) in self.omega0vacancyWyckoff], dtype=int)
+        om0_2 = np.array([v2 for (v1, v2) in self.omega0vacancyWyckoff], dtype=int)
+        om0_j = np.arange(len(self.om0_jn))
+        omega0escape = np.zeros((NT, len(self.sitelist), len(self.om0_jn)))
+        omF, omB = np.exp(-bFT0 + bFV[:, om0_1]), np.exp(-bFT0 + bFV[:, om0_2])
+        omega0escape[:, om0_1, om0_j], omega0escape[:, om0_2, om0_j] = omF, omB
+        omega0 = np.sqrt(omF * omB)
+        omegaescape = []
+        for SPlist, bFT in ((self.om1_SP, bFT1), (self.om2_SP, bFT2)):
+            SP1, SP2 = (np.array([SP[n] for SP in SPlist], dtype=int) for n in (0, 1))
+            omF, omB = np.exp(-bFT + bFSVkinetic[:, SP1]), np.exp(-bFT + bFSVkinetic[:, SP2])
+            escape = np.zeros((NT, Nv, len(SPlist)))
+            for j, (st1, st2) in enumerate(SPlist):
+                escape[:, self.kin2vstar[st1], j] = omF[:, j:j + 1]
+                escape[:, self.kin2vstar[st2], j] = omB[:, j:j + 1]
+            omegaescape.append((np.sqrt(omF * omB), escape))
+        (omega1, omega1escape), (omega2, omega2escape) = omegaescape
         return omega0, omega1, omega2, \
                omega0escape, omega1escape, omega2escape
 
-    def Lij(self, bFV, bFS, bFSV, bFT0, bFT1, bFT2, large_om2=1e8):
+    def _expansions(self, probV, probVsqrt, prob, omega0, omega1, omega2,
+                    omega0escape, omega1escape, omega2escape):
+        """
+        Expand out the bare diffusivities, rate matrices, and bias vectors for a stack of
+        probabilities and rates. Used by _Lijstack().
+
+        :param probV[NT, NWyckoff]: vacancy probability at each Wyckoff position
+        :param probVsqrt[NT, NVstars]: sqrt of vacancy probability for each vector star
+        :param prob[NT, Nkinetic]: solute-vacancy probability for each kinetic star
+        :param omega0[NT, Nomega0]: symmetric rate for omega0 jumps
+        :param omega1[NT, Nomega1]: symmetric rate for omega1 jumps
+        :param omega2[NT, Nomega2]: symmetric rate for omega2 jumps
+        :param omega0escape[NT, NWyckoff, Nomega0]: escape rate elements for omega0 jumps
+        :param omega1escape[NT, NVstars, Nomega1]: escape rate elements for omega1 jumps
+        :param omega2escape[NT, NVstars, Nomega2]: escape rate elements for omega2 jumps
+        :return D0ss[NT, 3, 3]: bare solute-solute diffusivity (with origin state correction)
+        :return D0sv[NT, 3, 3]: bare solute-vacancy diffusivity (with origin state correction)
+        :return D0vv[NT, 3, 3]: bare vacancy-vacancy diffusivity
+        :return D2vv[NT, 3, 3]: bare vacancy-vacancy diffusivity from omega2
+        :return delta_om[NT, NVstars, NVstars]: change in rate matrix from omega1
+        :return om2[NT, NVstars, NVstars]: rate matrix from omega2
+        :return biasSvec[NT, NVstars]: solute bias vector (with origin state correction)
+        :return biasVvec[NT, NVstars]: vacancy bias vector, without the omega2 contribution
+        :return biasVvec_om2[NT, NVstars]: omega2 contribution to the vacancy bias vector
+        """
+        Nv = self.vkinetic.Nvstars
+        # Note: we handle the equivalent of om1_om0 for omega2 (om2_om0) differently. Those
+        # jumps correspond to the vacancy *landing* on the solute site; the "origin states"
+        # are treated below--they only need to be considered *if* there is broken symmetry, such
+        # that we have a non-empty VectorBasis in our *unit cell* (NVB > 0)
+        # 4a. Bare diffusivities
+        om0_1, om0_2 = (np.array([SP[n] for SP in self.omega0vacancyWyckoff], dtype=int) for n in (0, 1))
+        om1_1, om1_2 = (np.array([SP[n] for SP in self.om1_SP], dtype=int) for n in (0, 1))
+        om2_1, om2_2 = (np.array([SP[n] for SP in self.om2_SP], dtype=int) for n in (0, 1))
+        symmprobV0 = np.sqrt(probV[:, om0_1] * probV[:, om0_2])
+        symmprobSV1 = np.sqrt(prob[:, om1_1] * prob[:, om1_2])
+        symmprobSV2 = np.sqrt(prob[:, om2_1] * prob[:, om2_2])
+        D0ss = np.tensordot(omega2 * symmprobSV2, self.Dom2, axes=(1, 2)) / self.N
+        D0sv = -D0ss
+        D0vv = (np.tensordot(omega1 * symmprobSV1, self.Dom1, axes=(1, 2)) -
+                np.tensordot(omega0 * symmprobV0, self.Dom1_om0 + self.Dom2_om0, axes=(1, 2))) / self.N
+        D2vv = D0ss.copy()
+
+        # 4b. Bias vectors (before correction) and rate matrices
+        vstarvacancy = np.array([self.kin2vacancy[starindex] for starindex in self.vstar2kin], dtype=int)
+        omega0escape_sv = omega0escape[:, vstarvacancy, :]
+        probsqrt = np.sqrt(prob[:, self.vstar2kin])
+        svdiag = np.arange(Nv)
+        om2 = self.om2expansion.dotstack(omega2)
+        delta_om = self.om1expansion.dotstack(omega1) - self.om1_om0.dotstack(omega0) - \
+                   self.om2_om0.dotstack(omega0)
+        delta_om[:, svdiag, svdiag] += np.einsum('vj,tvj->tv', self.om1escape, omega1escape) - \
+                                       np.einsum('vj,tvj->tv', self.om1_om0escape + self.om2_om0escape,
+                                                 omega0escape_sv)
+        om2[:, svdiag, svdiag] += np.einsum('vj,tvj->tv', self.om2escape, omega2escape)
+        # note: our solute bias is negative of the contribution to the vacancy, and also the
+        # reference value is 0
+        biasSvec = -np.einsum('vj,tvj->tv', self.om2bias, omega2escape) * probsqrt
+        # removed the om2 contribution--will be added back in later. Separation necessary for large_om2 case
+        biasVvec = np.einsum('vj,tvj->tv', self.om1bias, omega1escape) * probsqrt - \
+                   np.einsum('vj,tvj->tv', self.om1_b0 + self.om2_b0, omega0escape_sv) * probVsqrt
+        biasVvec_om2 = -biasSvec
+
+        # 4c. origin state corrections for solute: (corrections for vacancy appear in _Lijstack)
+        # these corrections are due to the null space for the vacancy without solute
+        if len(self.OSindices) > 0:
+            OSouter = self.vstarouter.block(self.OSindices)
+            for n in range(probV.shape[0]):
+                # need to multiply by sqrt(probV) first
+                OSprobV = self.OSfolddown * probVsqrt[n]  # proper null space projection
+                biasSbar = np.dot(OSprobV, biasSvec[n])
+                om2bar = np.dot(OSprobV, np.dot(om2[n], OSprobV.T))  # OS x OS
+                etaSbar = np.dot(pinv2(om2bar), biasSbar)
+                dDss = np.dot(np.dot(OSouter, etaSbar), biasSbar) / self.N
+                D0ss[n] += dDss
+                D0sv[n] -= dDss
+                biasSvec[n] -= np.dot(om2[n], np.dot(OSprobV.T, etaSbar))
+        return D0ss, D0sv, D0vv, D2vv, delta_om, om2, biasSvec, biasVvec, biasVvec_om2
+
+    @staticmethod
+    def _largeom2(G1, om2_slice, omega2escape):
+        """
+        Green function block and omega2 pseudoinverse for the "large" omega2 treatment, where
+        the omega2 contributions are (nearly) infinite compared with the other rates. Used by
+        _Lijstack() for a single entry.
+
+        :param G1[Nom2, Nom2]: Green function (with omega1) restricted to the omega2 vector stars
+        :param om2_slice[Nom2, Nom2]: omega2 rate matrix restricted to the omega2 vector stars
+        :param omega2escape[NVstars, Nomega2]: escape rate elements for omega2 jumps
+        :return Greplace[Nom2, Nom2]: replacement block of the Green function
+        :return om2_inv[Nom2, Nom2]: pseudoinverse of om2_slice
+        """
+        nom2 = len(om2_slice)
+        om2eig, om2vec = np.linalg.eigh(om2_slice)
+        G1rot = np.dot(om2vec.T, np.dot(G1, om2vec))  # rotated matrix
+        # eigenvalues are sorted in ascending order, and omega2 is negative definite
+        # om2min = -np.min(omega2escape)  # this is the smallest that any nonzero eigenvalue can be
+        om2min = -0.5*np.min(omega2escape[omega2escape > 0])
+        nnull = next((n for n in range(nom2) if om2eig[n] > om2min), nom2)  # 0:nnull == not in nullspace
+        # general update (g^-1 + w)^-1:
+        G2rot = solve(np.eye(nom2) + G1rot * om2eig[np.newaxis, :], G1rot)
+        om2rot = np.diag(om2eig[0:nnull])
+        # in the non-null subspace, replace with (g^-1+w)^-1-w^-1 = -(w+wgw)^-1:
+        G2rot[0:nnull, 0:nnull] = -solve(om2rot + np.dot(om2rot, np.dot(G1rot[0:nnull, 0:nnull], om2rot)),
+                                         np.eye(nnull), assume_a='sym')
+        Greplace = np.dot(om2vec, np.dot(G2rot, om2vec.T))  # transform back
+        # pseudoinverse from our eigendecomposition (same cutoff as np.linalg.pinv):
+        om2eiginv = np.zeros(nom2)
+        nonnull = np.abs(om2eig) > 1e-15 * np.max(np.abs(om2eig))
+        om2eiginv[nonnull] = 1. / om2eig[nonnull]
+        om2_inv = np.dot(om2vec * om2eiginv[np.newaxis, :], om2vec.T)
+        return Greplace, om2_inv
+
+    def _GFvalues(self, vTK):
+        """
+        Return the GF values, bare vacancy diffusivity and bias correction for a given vacancy
+        thermodynamics / kinetics. Looks first in our own (in-memory) cache, then in the
+        persistent cache (if set); only if both miss do we evaluate with the GF calculator.
+
+        :param vTK: vacancyThermoKinetics
+        :return GF[NGFstars]: Green function values for each star in GFstarset
+        :return L0vv[3, 3]: bare vacancy diffusivity
+        :return etav[N, 3]: vacancy bias correction
+        """
+        GF = self.GFvalues.get(vTK)
+        if GF is not None:
+            self.GFvalues.move_to_end(vTK)  # most recently used
+            instrument.timer.count('VacancyMediated.GFvalues', 'hit')
+            return GF, self.Lvvvalues[vTK], self.etavvalues[vTK]
+        instrument.timer.count('VacancyMediated.GFvalues', 'miss')
+        values = None
+        if self.GFcache is not None:
+            values = self.GFcache.get(self.GFcachekey(), vTK)
+            instrument.timer.count('GFcacheHDF5', 'miss' if values is None else 'hit')
+        if values is None:
+            # calculate, and store in persistent cache (if we have one):
+            self.GFcalc.SetRates(**(vTK._asdict()))
+            L0vv = self.GFcalc.Diffusivity()
+            etav = self.GFcalc.biascorrection()
+            PSlist = [self.GFstarset.states[s[0]] for s in self.GFstarset.stars]
+            GF = self.GFcalc.GFbatch([PS.i for PS in PSlist], [PS.j for PS in PSlist],
+                                     [PS.dx for PS in PSlist])
+            values = GF, L0vv, etav
+            if self.GFcache is not None:
+                self.GFcache.put(self.GFcachekey(), vTK, *values)
+        GF, L0vv, etav = values
+        # store in dictionary for cache, and remove least recently used if we're over GFcachemax:
+        self.GFvalues[vTK] = GF.copy()
+        self.Lvvvalues[vTK] = L0vv
+        self.etavvalues[vTK] = etav
+        if self.GFcachemax is not None:
+            while len(self.GFvalues) > self.GFcachemax:
+                vTKold, _ = self.GFvalues.popitem(last=False)
+                self.Lvvvalues.pop(vTKold, None), self.etavvalues.pop(vTKold, None)
+        return GF, L0vv, etav
+
+    def Lij(self, bFV, bFS, bFSV, bFT0, bFT1, bFT2, large_om2=1e8, lowrank_om2=True):
         """
         Calculates the transport coefficients: L0vv, Lss, Lsv, L1vv from the scaled free energies.
         The Green function entries are calculated from the omega0 info. As this is the most
         time-consuming part of the calculation, we cache these values with a dictionary
-        and hash function.
+        and hash function. This is the single-entry case of Lijbatch().
 
         :param bFV[NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
         :param bFS[NWyckoff]: beta*eneS - ln(preS) (relative to minimum value)
@@ -1423,183 +1961,210 @@ class VacancyMediated(object):
         :param bFT1[Nomega1]: beta*eneT1 - ln(preT1) (relative to minimum value of bFV + bFS)
         :param bFT2[Nomega2]: beta*eneT2 - ln(preT2) (relative to minimum value of bFV + bFS)
         :param large_om2: threshold for changing treatment of omega2 contributions (default: 10^8)
+        :param lowrank_om2: update the Green function for omega2 with a low-rank update on only the
+            vector stars with omega2 contributions, instead of a second full solve (default: True)
         :return Lvv[3, 3]: vacancy-vacancy; needs to be multiplied by cv/kBT
         :return Lss[3, 3]: solute-solute; needs to be multiplied by cv*cs/kBT
         :return Lsv[3, 3]: solute-vacancy; needs to be multiplied by cv*cs/kBT
         :return Lvv1[3, 3]: vacancy-vacancy correction due to solute; needs to be multiplied by cv*cs/kBT
         """
-        # 1. bare vacancy diffusivity and Green's function
-        vTK = vacancyThermoKinetics(pre=np.ones_like(bFV), betaene=bFV,
-                                    preT=np.ones_like(bFT0), betaeneT=bFT0)
-        GF = self.GFvalues.get(vTK)
-        L0vv = self.Lvvvalues.get(vTK)
-        etav = self.etavvalues.get(vTK)
-        if GF is None:
-            # calculate, and store in dictionary for cache:
-            self.GFcalc.SetRates(**(vTK._asdict()))
-            L0vv = self.GFcalc.Diffusivity()
-            etav = self.GFcalc.biascorrection()
-            GF = np.array([self.GFcalc(PS.i, PS.j, PS.dx)
-                           for PS in
-                           [self.GFstarset.states[s[0]] for s in self.GFstarset.stars]])
-            self.GFvalues[vTK] = GF.copy()
-            self.Lvvvalues[vTK] = L0vv
-            self.etavvalues[vTK] = etav
+        bFstack = (np.asarray(bF, dtype=float)[np.newaxis, :] for bF in (bFV, bFS, bFSV, bFT0, bFT1, bFT2))
+        return tuple(L[0] for L in self._Lijstack('VacancyMediated.Lij', *bFstack,
+                                                  large_om2=large_om2, lowrank_om2=lowrank_om2))
+
+    @staticmethod
+    def preene2betafreebatch(kT, preV, eneV, preS, eneS, preSV, eneSV,
+                             preT0, eneT0, preT1, eneT1, preT2, eneT2, **ignoredextraarguments):
+        """
+        Array version of preene2betafree(): takes a list of temperatures and returns stacks
+        of :math:`\\beta F` values, where the first index runs over the temperatures. The
+        output is meant to be passed directly to Lijbatch():
+        ``Lijbatch(*preene2betafreebatch(kTlist, **data_dict))``
+
+        :param kT[NT]: list of temperatures times Boltzmann's constant kB
+        :param preV: prefactor for vacancy formation (prod of inverse vibrational frequencies)
+        :param eneV: vacancy formation energy
+        :param preS: prefactor for solute formation (prod of inverse vibrational frequencies)
+        :param eneS: solute formation energy
+        :param preSV: excess prefactor for solute-vacancy binding
+        :param eneSV: solute-vacancy binding energy
+        :param preT0: prefactor for vacancy transition state
+        :param eneT0: energy for vacancy transition state (relative to eneV)
+        :param preT1: prefactor for vacancy swing transition state
+        :param eneT1: energy for vacancy swing transition state (relative to eneV + eneS + eneSV)
+        :param preT2: prefactor for vacancy exchange transition state
+        :param eneT2: energy for vacancy exchange transition state (relative to eneV + eneS + eneSV)
+        :return bFV[NT, NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
+        :return bFS[NT, NWyckoff]: beta*eneS - ln(preS) (relative to minimum value)
+        :return bFSV[NT, Nthermo]: beta*eneSV - ln(preSV) (excess)
+        :return bFT0[NT, Nomega0]: beta*eneT0 - ln(preT0) (relative to minimum value of bFV)
+        :return bFT1[NT, Nomega1]: beta*eneT1 - ln(preT1) (relative to minimum value of bFV + bFS)
+        :return bFT2[NT, Nomega2]: beta*eneT2 - ln(preT2) (relative to minimum value of bFV + bFS)
+        """
+        beta = 1 / np.array(kT, dtype=float).reshape(-1, 1)
+        bFV = beta * np.asarray(eneV) - np.log(preV)
+        bFS = beta * np.asarray(eneS) - np.log(preS)
+        bFSV = beta * np.asarray(eneSV) - np.log(preSV)
+        bFT0 = beta * np.asarray(eneT0) - np.log(preT0)
+        bFT1 = beta * np.asarray(eneT1) - np.log(preT1)
+        bFT2 = beta * np.asarray(eneT2) - np.log(preT2)
+
+        bFVmin = np.min(bFV, axis=1, keepdims=True)
+        bFSmin = np.min(bFS, axis=1, keepdims=True)
+        bFV -= bFVmin
+        bFS -= bFSmin
+        bFT0 -= bFVmin
+        bFT1 -= bFVmin + bFSmin
+        bFT2 -= bFVmin + bFSmin
+        return bFV, bFS, bFSV, bFT0, bFT1, bFT2
+
+    def Lijbatch(self, bFV, bFS, bFSV, bFT0, bFT1, bFT2, large_om2=1e8, lowrank_om2=True):
+        """
+        Calculates the transport coefficients L0vv, Lss, Lsv, L1vv for a stack of scaled free
+        energies (e.g., the output of preene2betafreebatch() for a list of temperatures).
+        Equivalent to calling Lij() for each entry, but the probabilities, rates, and rate
+        matrices are constructed as arrays with the first index running over the stack. The
+        Green function updates reuse one LU factorization per entry, as in Lij(), and the Green
+        function values themselves are still evaluated (and cached) one entry at a time.
+
+        :param bFV[NT, NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
+        :param bFS[NT, NWyckoff]: beta*eneS - ln(preS) (relative to minimum value)
+        :param bFSV[NT, Nthermo]: beta*eneSV - ln(preSV) (excess)
+        :param bFT0[NT, Nomega0]: beta*eneT0 - ln(preT0) (relative to minimum value of bFV)
+        :param bFT1[NT, Nomega1]: beta*eneT1 - ln(preT1) (relative to minimum value of bFV + bFS)
+        :param bFT2[NT, Nomega2]: beta*eneT2 - ln(preT2) (relative to minimum value of bFV + bFS)
+        :param large_om2: threshold for changing treatment of omega2 contributions (default: 10^8)
+        :param lowrank_om2: update the Green function for omega2 with a low-rank update on only the
+            vector stars with omega2 contributions, instead of a second full solve (default: True)
+        :return Lvv[NT, 3, 3]: vacancy-vacancy; needs to be multiplied by cv/kBT
+        :return Lss[NT, 3, 3]: solute-solute; needs to be multiplied by cv*cs/kBT
+        :return Lsv[NT, 3, 3]: solute-vacancy; needs to be multiplied by cv*cs/kBT
+        :return Lvv1[NT, 3, 3]: vacancy-vacancy correction due to solute; needs to be multiplied by cv*cs/kBT
+        """
+        bFstack = (np.atleast_2d(np.asarray(bF, dtype=float)) for bF in (bFV, bFS, bFSV, bFT0, bFT1, bFT2))
+        return self._Lijstack('VacancyMediated.Lijbatch', *bFstack,
+                              large_om2=large_om2, lowrank_om2=lowrank_om2)
+
+    def _Lijstack(self, clockname, bFV, bFS, bFSV, bFT0, bFT1, bFT2, large_om2, lowrank_om2):
+        """
+        Transport coefficients for a stack of scaled free energies; the work behind both Lij()
+        and Lijbatch(). The first index of every input and output runs over the stack.
+
+        :param clockname: name of the instrument phase to time the steps under
+        :param bFV[NT, NWyckoff]: beta*eneV - ln(preV) (relative to minimum value)
+        :param bFS[NT, NWyckoff]: beta*eneS - ln(preS) (relative to minimum value)
+        :param bFSV[NT, Nthermo]: beta*eneSV - ln(preSV) (excess)
+        :param bFT0[NT, Nomega0]: beta*eneT0 - ln(preT0) (relative to minimum value of bFV)
+        :param bFT1[NT, Nomega1]: beta*eneT1 - ln(preT1) (relative to minimum value of bFV + bFS)
+        :param bFT2[NT, Nomega2]: beta*eneT2 - ln(preT2) (relative to minimum value of bFV + bFS)
+        :param large_om2: threshold for changing treatment of omega2 contributions
+        :param lowrank_om2: update the Green function for omega2 with a low-rank update
+        :return Lvv[NT, 3, 3]: vacancy-vacancy; needs to be multiplied by cv/kBT
+        :return Lss[NT, 3, 3]: solute-solute; needs to be multiplied by cv*cs/kBT
+        :return Lsv[NT, 3, 3]: solute-vacancy; needs to be multiplied by cv*cs/kBT
+        :return Lvv1[NT, 3, 3]: vacancy-vacancy correction due to solute; needs to be multiplied by cv*cs/kBT
+        """
+        NT, Nv = bFV.shape[0], self.vkinetic.Nvstars
+        clock = instrument.timer.stopwatch(clockname)
+        # 1. bare vacancy diffusivity and Green's function: one at a time, through the cache
+        GF = np.zeros((NT, len(self.GFstarset.stars)))
+        L0vv = np.zeros((NT, self.dim, self.dim))
+        etav = np.zeros((NT, self.N, self.dim))
+        for n in range(NT):
+            vTK = vacancyThermoKinetics(pre=np.ones_like(bFV[n]), betaene=bFV[n],
+                                        preT=np.ones_like(bFT0[n]), betaeneT=bFT0[n])
+            GF[n], L0vv[n], etav[n] = self._GFvalues(vTK)
+        clock.split('1.GF')
 
         # 2. set up probabilities for solute-vacancy configurations
-        probVsites = np.array([np.exp(min(bFV) - bFV[wi]) for wi in self.invmap])
-        probVsites *= self.N / np.sum(probVsites)  # normalize
-        probV = np.array([probVsites[sites[0]] for sites in self.sitelist])  # Wyckoff positions
-        probVsqrt = np.array([np.sqrt(probV[self.kin2vacancy[starindex]])
-                              for starindex in self.vstar2kin])
-        probSsites = np.array([np.exp(min(bFS) - bFS[wi]) for wi in self.invmap])
-        probSsites *= self.N / np.sum(probSsites)  # normalize
-        probS = np.array([probSsites[sites[0]] for sites in self.sitelist])  # Wyckoff positions
-        bFSVkin = np.array([bFS[s] + bFV[v] for (s, v) in self.kineticsvWyckoff])  # NOT EXCESS: total
-        prob = np.array([probS[s] * probV[v] for (s, v) in self.kineticsvWyckoff])
-        for tindex, kindex in enumerate(self.thermo2kin):
-            bFSVkin[kindex] += bFSV[tindex]
-            prob[kindex] *= np.exp(-bFSV[tindex])
-        # zero out probability of any origin states... not clear this is really needed
-        for kindex, s in enumerate(self.kinetic.stars):
-            if self.kinetic.states[s[0]].iszero():
-                prob[kindex] = 0
+        probV, probVsqrt, prob, bFSVkin = self._probabilities(bFV, bFS, bFSV)
+        clock.split('2.probabilities')
 
         # 3. set up symmetric rates: omega0, omega1, omega2
         #    and escape rates omega0escape, omega1escape, omega2escape
         omega0, omega1, omega2, omega0escape, omega1escape, omega2escape = \
             self._symmetricandescaperates(bFV, bFSVkin, bFT0, bFT1, bFT2)
+        clock.split('3.rates')
 
         # 4. expand out: D0ss, D0vv, domega1, domega2, bias1, bias2
-        # Note: we handle the equivalent of om1_om0 for omega2 (om2_om0) differently. Those
-        # jumps correspond to the vacancy *landing* on the solute site; the "origin states"
-        # are treated below--they only need to be considered *if* there is broken symmetry, such
-        # that we have a non-empty VectorBasis in our *unit cell* (NVB > 0)
-        # 4a. Bare diffusivities
-        symmprobV0 = np.array([np.sqrt(probV[i] * probV[f]) for i,f in self.omega0vacancyWyckoff])
-        symmprobSV1 = np.array([np.sqrt(prob[i] * prob[f]) for i,f in self.om1_SP])
-        symmprobSV2 = np.array([np.sqrt(prob[i] * prob[f]) for i,f in self.om2_SP])
-        D0ss = np.dot(self.Dom2, omega2 * symmprobSV2) / self.N
-        D0sv = -D0ss
-        D0vv = (np.dot(self.Dom1, omega1 * symmprobSV1) -
-                np.dot(self.Dom1_om0 + self.Dom2_om0, omega0 * symmprobV0)) / self.N
-        D2vv = D0ss.copy()
-
-        # 4b. Bias vectors (before correction) and rate matrices
-        biasSvec = np.zeros(self.vkinetic.Nvstars)
-        biasVvec = np.zeros(self.vkinetic.Nvstars)  # now, does *not* include -biasSvec
-        om2 = np.dot(self.om2expansion, omega2)
-        delta_om = np.dot(self.om1expansion, omega1) - np.dot(self.om1_om0, omega0) \
-                   - np.dot(self.om2_om0, omega0)
-        for sv, starindex in enumerate(self.vstar2kin):
-            svvacindex = self.kin2vacancy[starindex]  # vacancy
-            delta_om[sv, sv] += np.dot(self.om1escape[sv, :], omega1escape[sv, :]) - \
-                                np.dot(self.om1_om0escape[sv, :], omega0escape[svvacindex, :]) - \
-                                np.dot(self.om2_om0escape[sv, :], omega0escape[svvacindex, :])
-            om2[sv, sv] += np.dot(self.om2escape[sv, :], omega2escape[sv, :])
-            # note: our solute bias is negative of the contribution to the vacancy, and also the
-            # reference value is 0
-            biasSvec[sv] = -np.dot(self.om2bias[sv, :], omega2escape[sv, :]) * np.sqrt(prob[starindex])
-            # removed the om2 contribution--will be added back in later. Separation necessary for large_om2 case
-            biasVvec[sv] = np.dot(self.om1bias[sv, :], omega1escape[sv, :]) * np.sqrt(prob[starindex]) - \
-                           np.dot(self.om1_b0[sv, :], omega0escape[svvacindex, :]) * probVsqrt[sv] - \
-                           np.dot(self.om2_b0[sv, :], omega0escape[svvacindex, :]) * probVsqrt[sv]
-            # - biasSvec[sv]
-        biasVvec_om2 = -biasSvec
-
-        # 4c. origin state corrections for solute: (corrections for vacancy appear below)
-        # these corrections are due to the null space for the vacancy without solute
+        D0ss, D0sv, D0vv, D2vv, delta_om, om2, biasSvec, biasVvec, biasVvec_om2 = \
+            self._expansions(probV, probVsqrt, prob, omega0, omega1, omega2,
+                             omega0escape, omega1escape, omega2escape)
+        clock.split('4.expansions')
+
+        # 5. compute Green function: first with omega1, G = (1 + G0*delta_om)^-1 G0;
+        #    we keep the LU factorization for each entry, and only solve for what we need
+        G0 = self.GFexpansion.dotstack(GF)
+        LU1 = [lu_factor(np.eye(Nv) + np.dot(G0[n], delta_om[n])) for n in range(NT)]
+        # then with omega2, which only has non-zero contributions for some vector stars (by default,
+        # a low-rank update of G); the block of G for those vector stars decides how omega2 is treated
+        om2_sv_indices = self.om2expansion.nonzeroindices()
+        om2_slice = om2[:, om2_sv_indices, :][:, :, om2_sv_indices]
+        G1 = np.array([lu_solve(LU1[n], G0[n][:, om2_sv_indices])[om2_sv_indices, :] for n in range(NT)])
+        large = np.any(np.abs(np.matmul(G1, om2_slice).reshape(NT, -1)) > large_om2, axis=1)
+        G = np.empty_like(G0)
+        for n in range(NT):
+            if lowrank_om2 or large[n]:
+                # update the omega1 G (reusing our factorization) with omega2
+                G[n] = lu_solve(LU1[n], G0[n])
+                if lowrank_om2:
+                    G[n] = lowrankGFupdate(G[n], om2_sv_indices, om2_slice[n])
+                else:
+                    G[n] = lu_solve(lu_factor(np.eye(Nv) + np.dot(G[n], om2[n])), G[n])
+            else:
+                # "small" omega2: as G = (1 + G0*delta_om)^-1 G0,
+                # (1 + G*om2)^-1 G = (1 + G0*(delta_om + om2))^-1 G0, which only needs one more factorization
+                G[n] = lu_solve(lu_factor(np.eye(Nv) + np.dot(G0[n], delta_om[n] + om2[n])), G0[n])
         if len(self.OSindices) > 0:
-            # need to multiply by sqrt(probV) first
-            OSprobV = self.OSfolddown*probVsqrt  # proper null space projection
-            biasSbar = np.dot(OSprobV, biasSvec)
-            om2bar = np.dot(OSprobV, np.dot(om2, OSprobV.T))  # OS x OS
-            etaSbar = np.dot(pinv2(om2bar), biasSbar)
-            dDss = np.dot(np.dot(self.vkinetic.outer[:, :, self.OSindices, :, ][:, :, :, self.OSindices],
-                                 etaSbar), biasSbar) / self.N
-            D0ss += dDss
-            D0sv -= dDss
-            biasSvec -= np.dot(om2, np.dot(OSprobV.T, etaSbar))
-
-        # 5. compute Green function:
-        G0 = np.dot(self.GFexpansion, GF)
-        # Note: we first do this *just* with omega1, then ... with omega2, depending on how it behaves
-        G = np.dot(np.linalg.inv(np.eye(self.vkinetic.Nvstars) + np.dot(G0, delta_om)), G0)
-        # Now: to identify the omega2 contributions, we need to find all of the sv indices with a
-        # non-zero contribution to om2bias. Hand been, where np.any(self.om2bias[sv,:] != 0)
-        # Now, where np.any(self.om2expansion[sv,:,:] != 0)  --should we put into generatematrices?
-        om2_sv_indices = [n for n in range(len(self.om2expansion)) if not np.allclose(self.om2expansion[n], 0)]
-        # looks weird, but this is how we pull out a block in G corresponding to the indices in our list:
-        G1 = G[om2_sv_indices, :][:, om2_sv_indices]
-        om2_slice = om2[om2_sv_indices, :][:, om2_sv_indices]
-        gdom2 = np.dot(G1, om2_slice)
-        if np.any(np.abs(gdom2) > large_om2):
-            nom2 = len(om2_sv_indices)
-            om2eig, om2vec = np.linalg.eigh(om2_slice)
-            G1rot = np.dot(om2vec.T, np.dot(G1, om2vec))  # rotated matrix
-            # eigenvalues are sorted in ascending order, and omega2 is negative definite
-            # om2min = -np.min(omega2escape)  # this is the smallest that any nonzero eigenvalue can be
-            om2min = -0.5*min(om for omlist in omega2escape for om in omlist if om>0)
-            nnull = next((n for n in range(nom2) if om2eig[n] > om2min), nom2)  # 0:nnull == not in nullspace
-            # general update (g^-1 + w)^-1:
-            G2rot = np.dot(np.linalg.inv(np.eye(nom2) + np.dot(G1rot, np.diag(om2eig))), G1rot)
-            om2rot = np.diag(om2eig[0:nnull])
-            # in the non-null subspace, replace with (g^-1+w)^-1-w^-1 = -(w+wgw)^-1:
-            G2rot[0:nnull, 0:nnull] = -np.linalg.inv(om2rot + np.dot(om2rot,
-                                                                     np.dot(G1rot[0:nnull,0:nnull],
-                                                                            om2rot)))
-            Greplace = np.dot(om2vec, np.dot(G2rot, om2vec.T))  # transform back
-            om2_inv = np.linalg.pinv(om2_slice)  # only used here for testing purposes...
-            # update with omega2, and then put in change due to omega2
-            G = np.dot(np.linalg.inv(np.eye(self.vkinetic.Nvstars) + np.dot(G, om2)), G)
-            Gfull = G.copy()
-            for ni, i in enumerate(om2_sv_indices):
-                for nj, j in enumerate(om2_sv_indices):
-                    G[i, j] = Greplace[ni, nj]
-
-            bV, bV2, bS, = biasVvec[om2_sv_indices], biasVvec_om2[om2_sv_indices], biasSvec[om2_sv_indices]
-            om2_outer = self.vkinetic.outer[:, :, om2_sv_indices, :][:, :, :, om2_sv_indices]
-            D0ss_correct = np.dot(np.dot(om2_outer, bS), np.dot(om2_inv, bS)) / self.N
-            D0ss = np.zeros_like(D0ss)  # exact cancellation of bare term
-            D0sv = np.dot(np.dot(om2_outer, bV), np.dot(om2_inv, bS)) / self.N
-            D2vv = (np.dot(np.dot(om2_outer, bV), np.dot(om2_inv, bV)) +
-                    2 * np.dot(np.dot(om2_outer, bV2), np.dot(om2_inv, bV))) / self.N
-        else:
-            # update with omega2 ("small" omega2):
-            G = np.dot(np.linalg.inv(np.eye(self.vkinetic.Nvstars) + np.dot(G, om2)), G)
-            Gfull = G
+            # origin state correction (6c) uses G before any "large" omega2 block replacement:
+            dom = delta_om + om2  # sum of the terms
+            dgd = -dom + np.matmul(dom, np.matmul(G, dom))  # delta_g = g0*dgd*g0
+        if np.any(large):
+            om2_block = np.ix_(om2_sv_indices, om2_sv_indices)
+            om2_outer = self.vstarouter.block(om2_sv_indices)
+        for n in np.nonzero(large)[0]:
+            # "large" omega2: replace the omega2 block, and the bare omega2 contributions
+            Greplace, om2_inv = self._largeom2(G1[n], om2_slice[n], omega2escape[n])
+            G[n][om2_block] = Greplace
+            bV, bV2, bS = biasVvec[n, om2_sv_indices], biasVvec_om2[n, om2_sv_indices], \
+                          biasSvec[n, om2_sv_indices]
+            D0ss[n] = 0  # exact cancellation of bare term
+            D0sv[n] = np.dot(np.dot(om2_outer, bV), np.dot(om2_inv, bS)) / self.N
+            D2vv[n] = (np.dot(np.dot(om2_outer, bV), np.dot(om2_inv, bV)) +
+                       2 * np.dot(np.dot(om2_outer, bV2), np.dot(om2_inv, bV))) / self.N
+        clock.split('5.Green')
 
         # 6. Compute bias contributions to Onsager coefficients
         # 6a. add in the om2 contribution to biasVvec:
         biasVvec += biasVvec_om2
 
         # 6b. GF pieces:
-        etaVvec, etaSvec = np.dot(G, biasVvec), np.dot(G, biasSvec)
-        outer_etaVvec, outer_etaSvec = np.dot(self.vkinetic.outer, etaVvec), np.dot(self.vkinetic.outer, etaSvec)
-
-        L1ss = np.dot(outer_etaSvec, biasSvec) / self.N
-        L1sv = np.dot(outer_etaSvec, biasVvec) / self.N
-        L1vv = np.dot(outer_etaVvec, biasVvec) / self.N
+        etaVvec, etaSvec = np.einsum('tab,tb->ta', G, biasVvec), np.einsum('tab,tb->ta', G, biasSvec)
+        outer_etaVvec = self.vstarouter.dotstack(etaVvec)
+        outer_etaSvec = self.vstarouter.dotstack(etaSvec)
+        L1ss = np.einsum('txya,ta->txy', outer_etaSvec, biasSvec) / self.N
+        L1sv = np.einsum('txya,ta->txy', outer_etaSvec, biasVvec) / self.N
+        L1vv = np.einsum('txya,ta->txy', outer_etaVvec, biasVvec) / self.N
 
         # 6c. origin state corrections for vacancy:
         if len(self.OSindices) > 0:
-            etaV0 = -np.tensordot(self.OS_VB, etav, axes=((1, 2), (0, 1))) * np.sqrt(self.N)
-            outer_etaV0 = np.dot(self.vkinetic.outer[:, :, self.OSindices, :][:, :, :, self.OSindices], etaV0)
-            dom = delta_om + om2  # sum of the terms
-            # dgd = -dom + np.dot(dom, np.dot(G, dom))  # delta_g = g0*dgd*g0
-            dgd = -dom + np.dot(dom, np.dot(Gfull, dom))  # delta_g = g0*dgd*g0
-            G0db = np.dot(G0, biasVvec)  # G0*db
+            etaV0 = -np.einsum('oid,tid->to', self.OS_VB, etav) * np.sqrt(self.N)
+            outer_etaV0 = np.einsum('xyab,tb->txya', self.vstarouter.block(self.OSindices), etaV0)
+            G0db = np.einsum('tab,tb->ta', G0, biasVvec)  # G0*db
+            dgdG0db = np.einsum('tab,tb->ta', dgd, G0db)
+            dgdOS = np.matmul(np.matmul(self.OSVfolddown, dgd), self.OSVfolddown.T)
             # 2 eta0*db + 2 eta0*dgd*G0*db + eta0*dgd*eta0  (domega = delta_om + om2)
             # - etaV0*biasV0 (correction due to removing states)
-            L1vv += np.dot(outer_etaV0,
-                           2 * np.dot(self.OSVfolddown, biasVvec)
-                           + 2 * np.dot(self.OSVfolddown, np.dot(dgd, G0db))
-                           + np.dot(np.dot(self.OSVfolddown, np.dot(dgd, self.OSVfolddown.T)), etaV0)
-                           - biasVvec[self.OSindices]
-                           ) / self.N
+            L1vv += np.einsum('txya,ta->txy', outer_etaV0,
+                              2 * np.dot(biasVvec, self.OSVfolddown.T)
+                              + 2 * np.dot(dgdG0db, self.OSVfolddown.T)
+                              + np.einsum('tab,tb->ta', dgdOS, etaV0)
+                              - biasVvec[:, self.OSindices]
+                              ) / self.N
+        clock.split('6.bias')
+        clock.stop()
 
         return L0vv, D0ss + L1ss, D0sv + L1sv, D0vv + D2vv + L1vv
 
-
 crystal.yaml.add_representer(vacancyThermoKinetics, vacancyThermoKinetics.vacancyThermoKinetics_representer)
 crystal.yaml.add_constructor(VACANCYTHERMOKINETICS_YAMLTAG, vacancyThermoKinetics.vacancyThermoKinetics_constructor)
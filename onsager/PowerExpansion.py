@@ -193,6 +193,30 @@ class Taylor3D(object):
                 directmult[p0, p1] = cls.pow2ind[nsum[0], nsum[1], nsum[2]]
         return directmult
 
+    @classmethod
+    def makeproductindex(cls):
+        """
+        Gather / scatter indexing for products of expansions (used by coeffproductcoeff)
+
+        :return productindex[almax][blmax]: tuple of (pa, pb, pc, start); pa[P] and pb[P] are the power
+            indices for all P products of powers, sorted by the power they add into; pc[Nc] are the
+            distinct target powers, and products start[n]:start[n+1] add into power pc[n]
+        """
+        productindex = []
+        for almax in range(cls.Lmax + 1):
+            productindex.append([])
+            for blmax in range(cls.Lmax + 1):
+                Nc = cls.powlrange[min(almax + blmax, cls.Lmax)]
+                pa, pb = np.meshgrid(np.arange(cls.powlrange[almax]), np.arange(cls.powlrange[blmax]),
+                                     indexing='ij')
+                pa, pb = pa.flatten(), pb.flatten()
+                # products beyond Lmax have directmult == -1: as an index, that is the last power
+                target = cls.directmult[pa, pb] % Nc
+                order = np.argsort(target, kind='stable')
+                pc, start = np.unique(target[order], return_index=True)
+                productindex[almax].append((pa[order], pb[order], pc, start))
+        return productindex
+
     @classmethod
     def powexp(cls, u, normalize=True):
         """
@@ -224,6 +248,29 @@ class Taylor3D(object):
         else:
             return upow
 
+    @classmethod
+    def powexparray(cls, u, normalize=True):
+        """
+        Array version of powexp(): given vectors u, (normalize them and) return the power expansion
+        of each. Works for any dimension, as it is built from ind2pow.
+
+        :param u[M, 3]: vectors to apply
+        :param normalize: do we normalize u first?
+        :return upow[M, Npower]: ux uy uz products of powers for each vector
+        :return umagn[M]: magnitude of each u (if normalized)
+        """
+        u0 = np.array(u, dtype=float)
+        umagn = np.sqrt(np.sum(u0 * u0, axis=1))
+        small = umagn < 1e-8
+        umagn[small] = 0.
+        u0[small] = 0.  # leaves only the 0th power
+        if normalize: u0[~small] /= umagn[~small, np.newaxis]
+        upow = np.prod(u0[:, np.newaxis, :] ** cls.ind2pow[np.newaxis, :, :], axis=2)
+        if normalize:
+            return upow, umagn
+        else:
+            return upow
+
     @classmethod
     def makepowercoeff(cls):
         """
@@ -363,6 +410,7 @@ class Taylor3D(object):
         cls.powYlm = cls.makepowYlm()
         cls.Lproj = cls.makeLprojections()
         cls.directmult = cls.makedirectmult()
+        cls.productindex = cls.makeproductindex()
         cls.powercoeff = cls.makepowercoeff()
         cls.HDF5str = 'coeff.{}.{}'  # needed for addhdf5()
         cls.__internallist__ = ('pow2ind', 'ind2pow', 'Ylm2ind', 'ind2Ylm',
@@ -550,10 +598,23 @@ class Taylor3D(object):
         function value. Otherwise, we return a dictionary mapping (n,l) tuple pairs into
         values, and leave it at that.
 
-        :param u: three vector to evaluate; may (or may not) be normalized
+        If u is an array of vectors, u[M, 3], then everything is evaluated for all M vectors at
+        once; the functions in fnu are called with the array umagn[M], and the values (or the
+        values in the dictionary) have M as their first index.
+
+        :param u: three vector to evaluate; may (or may not) be normalized; or array u[M, 3]
         :param fnu: dictionary of (n,l): value or function pairs.
         :return value or dictionary: depending on fnu; default is dictionary
         """
+        if np.ndim(u) > 1:
+            u0, umagn = self.powexparray(u)
+            if fnu is not None:
+                fval = [fnu[(n, l)](umagn) if callable(fnu[(n, l)]) else fnu[(n, l)]
+                        for (n, l, coeff) in self.coefflist]
+                return sum(np.reshape(np.broadcast_to(fv, umagn.shape), umagn.shape + (1,) * (coeff.ndim - 1)) *
+                           np.tensordot(u0[:, :self.powlrange[l]], coeff, axes=1)
+                           for fv, (n, l, coeff) in zip(fval, self.coefflist))
+            return {(n, l): np.tensordot(u0[:, :self.powlrange[l]], coeff, axes=1) for n, l, coeff in self.coefflist}
         u0, umagn = self.powexp(u)
         if fnu is not None:
             fval = [fnu[(n, l)](umagn) if callable(fnu[(n, l)]) else fnu[(n, l)]
@@ -859,14 +920,18 @@ class Taylor3D(object):
                 if clmax > cls.Lmax:
                     # in theory... we should warn the user here
                     clmax = cls.Lmax
-                # construct the expansion
-                cpow = np.zeros((cls.powlrange[clmax],) + cshape, dtype=complex)
-                for pa in range(cls.powlrange[almax]):
-                    for pb in range(cls.powlrange[blmax]):
-                        if scalarmult:
-                            cpow[cls.directmult[pa, pb]] += apow[pa] * bpow[pb]
-                        else:
-                            cpow[cls.directmult[pa, pb]] += np.tensordot(apow[pa], bpow[pb], axes=1)
+                # construct the expansion: gather all products of powers, then scatter into cpow
+                pa, pb, pc, start = cls.productindex[almax][blmax]
+                if scalarmult:
+                    apa, bpb = apow[pa], bpow[pb]
+                    prod = apa.reshape(apa.shape + (1,) * (bpb.ndim - apa.ndim)) * \
+                           bpb.reshape(bpb.shape + (1,) * (apa.ndim - bpb.ndim))
+                else:
+                    prod = np.matmul(apow[pa].reshape((len(pa), -1, ashape[-1])),
+                                     bpow[pb].reshape((len(pb), bshape[1], -1)))
+                cpow = np.zeros((cls.powlrange[clmax], prod[0].size), dtype=complex)
+                cpow[pc] = np.add.reduceat(prod.reshape((len(pa), -1)), start, axis=0)
+                cpow = cpow.reshape((cls.powlrange[clmax],) + cshape)
                 # now add it into the list
                 matched = False
                 for coeffindex, cmatch in enumerate(c):
@@ -1390,6 +1455,7 @@ class Taylor2D(Taylor3D):
         cls.powFC = cls.makepowFC()
         cls.Lproj = cls.makeLprojections()
         cls.directmult = cls.makedirectmult()
+        cls.productindex = cls.makeproductindex()
         cls.powercoeff = cls.makepowercoeff()
         cls.HDF5str = 'coeff.{}.{}'  # needed for addhdf5()
         cls.__internallist__ = ('pow2ind', 'ind2pow', 'FC2ind', 'ind2FC',
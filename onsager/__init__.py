@@ -1,3 +1,3 @@
 __all__ = [ "crystal", "crystalStars", "supercell",
             "GFcalc", "OnsagerCalc", "PowerExpansion",
-            "automator"]
+            "automator", "instrument", "cachestore"]
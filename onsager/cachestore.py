@@ -0,0 +1,119 @@
+"""
+Cache store module
+
+Keyed store of arrays in an HDF5 file that separate processes can share; used by the persistent
+caches (GFcacheHDF5 in OnsagerCalc, SymmetryCacheHDF5 in crystal). Each entry is a dictionary
+of arrays, stored as a group under its key. h5py is only imported when the file is accessed,
+and file locking uses fcntl where it is available.
+"""
+
+__author__ = 'Dallas R. Trinkle'
+
+import os, time, contextlib
+try:
+    import fcntl
+except ImportError:  # no advisory file locks (e.g., Windows): stores run unlocked
+    fcntl = None
+
+
+class HDF5CacheStore(object):
+    """
+    Entries (dictionaries of arrays) in an HDF5 file, keyed by hex digest strings. Readers share
+    a lock and writers hold an exclusive lock (on filename + '.lock'), and the file is only open
+    for the duration of each access; without fcntl there is no locking. Once there are more than
+    maxentries, the oldest entries (by time of insertion) are removed; the keys and insertion
+    times are kept in an index in the file, in insertion order, so that eviction does not need
+    to visit the other entries.
+    """
+    INDEXNAME = '_index'
+    KEYLENGTH = 40  # length of a hex SHA1 digest
+
+    def __init__(self, filename, maxentries):
+        """
+        Create (or open) a store.
+
+        :param filename: name of HDF5 file to store entries
+        :param maxentries: maximum number of entries to keep; oldest entries are evicted first
+        """
+        if maxentries < 1: raise ValueError('maxentries ({}) must be >0'.format(maxentries))
+        self.filename = filename
+        self.lockname = filename + '.lock'
+        self.maxentries = maxentries
+
+    @contextlib.contextmanager
+    def _lock(self, exclusive):
+        """Hold a (shared or exclusive) lock on our lockfile; no locking without fcntl"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lockname, 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def __len__(self):
+        import h5py
+        with self._lock(exclusive=False):
+            if not os.path.exists(self.filename): return 0
+            with h5py.File(self.filename, 'r') as f:
+                return len(f[self.INDEXNAME]['key']) if self.INDEXNAME in f else 0
+
+    def get(self, key):
+        """
+        Return a stored entry, or None if not present.
+
+        :param key: hex digest string
+        :return values: dictionary of arrays, or None
+        """
+        import h5py
+        with self._lock(exclusive=False):
+            if not os.path.exists(self.filename): return None
+            with h5py.File(self.filename, 'r') as f:
+                if key not in f: return None
+                return {name: value[()] for name, value in f[key].items()}
+
+    def put(self, key, values, replace=False):
+        """
+        Store an entry; evicts the oldest entries if we have more than maxentries. An entry that
+        is already present is left alone, unless replace is set.
+
+        :param key: hex digest string
+        :param values: dictionary of arrays
+        :param replace: replace an existing entry with the same key?
+        """
+        import h5py
+        if len(key) > self.KEYLENGTH: raise ValueError('key {} is longer than {}'.format(key, self.KEYLENGTH))
+        with self._lock(exclusive=True):
+            with h5py.File(self.filename, 'a') as f:
+                if self.INDEXNAME not in f:
+                    index = f.create_group(self.INDEXNAME)
+                    index.create_dataset('key', (0,), dtype='S{}'.format(self.KEYLENGTH), maxshape=(None,))
+                    index.create_dataset('time', (0,), dtype=float, maxshape=(None,))
+                index = f[self.INDEXNAME]
+                keys, times = index['key'], index['time']
+                if key in f:
+                    if not replace: return
+                    # remove from the file and the index, and add back in as a new entry
+                    del f[key]
+                    keep = keys[()] != key.encode('ascii')
+                    keylist, timelist = keys[()][keep], times[()][keep]
+                    keys.resize((len(keylist),))
+                    times.resize((len(timelist),))
+                    if len(keylist) > 0: keys[:], times[:] = keylist, timelist
+                group = f.create_group(key)
+                for name, value in values.items():
+                    group[name] = value
+                Nentries = len(keys) + 1
+                keys.resize((Nentries,))
+                times.resize((Nentries,))
+                keys[-1], times[-1] = key.encode('ascii'), time.time()
+                Nevict = Nentries - self.maxentries
+                if Nevict > 0:
+                    # index is in insertion order: the oldest entries are at the front
+                    for k in keys[:Nevict]:
+                        del f[k.decode('ascii')]
+                    keys[:self.maxentries], times[:self.maxentries] = keys[Nevict:], times[Nevict:]
+                    keys.resize((self.maxentries,))
+                    times.resize((self.maxentries,))
@@ -12,16 +12,23 @@ __author__ = 'Dallas R. Trinkle'
 
 import numpy as np
 import collections, copy, itertools
+import hashlib, contextlib
 from numbers import Number
 from math import gcd
 import yaml  # use crystal.yaml to call--may need to change in the future
 from functools import reduce
+from onsager import instrument
+from onsager import cachestore
 
 # YAML tags:
 # interfaces are either at the bottom, or staticmethods in the corresponding object
 NDARRAY_YAMLTAG = '!numpy.ndarray'
 GROUPOP_YAMLTAG = '!GroupOp'
 
+# relative slack for the array screens in Crystal.jumpnetwork() that are followed by an exact
+# check: covers the rounding differences between array and scalar evaluations of a distance
+SCREEN_SLACK = 1e-8
+
 
 def gcdlist(lis):
     """Returns the GCD of a list of integers"""
@@ -48,6 +55,47 @@ def inhalf(vec):
     return vec - np.floor(vec + 0.5)
 
 
+def positionhash(atomlist, threshold=1e-8):
+    """
+    Hash table of positions in the unit cell, on a grid of cells much larger than threshold,
+    for fast matching of positions (see positionmatches).
+
+    :param atomlist: list of array[3] of positions (unit coord)
+    :param threshold: threshold for matching positions
+    :return Ngrid: number of grid cells along each direction
+    :return table: dictionary of tuple(cell): list of indices into atomlist
+    """
+    Ngrid = max(1, int(0.01 / threshold))
+    table = {}
+    if len(atomlist) == 0: return Ngrid, table
+    cells = np.floor((np.array(atomlist) % 1) * Ngrid).astype(int) % Ngrid
+    for j, cell in enumerate(cells.tolist()):
+        table.setdefault(tuple(cell), []).append(j)
+    return Ngrid, table
+
+
+def positionmatches(poshash, vec, threshold=1e-8):
+    """
+    Candidate indices for positions that may match vec (mod 1) to within threshold, from
+    the grid cell containing vec and any neighboring cells within threshold.
+
+    :param poshash: (Ngrid, table) from positionhash
+    :param vec: array[3] position (unit coord)
+    :param threshold: threshold for matching positions
+    :return indices: sorted list of candidate indices into atomlist
+    """
+    Ngrid, table = poshash
+    x = (vec % 1) * Ngrid
+    cell = np.floor(x)
+    dx, eps = x - cell, threshold * Ngrid
+    cellchoices = [(c - 1, c) if d < eps else ((c, c + 1) if d > 1 - eps else (c,))
+                   for c, d in zip(cell.astype(int).tolist(), dx.tolist())]
+    if all(len(c) == 1 for c in cellchoices):
+        return table.get(tuple(c[0] % Ngrid for c in cellchoices), [])
+    return sorted(j for cells in itertools.product(*cellchoices)
+                  for j in table.get(tuple(c % Ngrid for c in cells), []))
+
+
 def maptranslation(oldpos, newpos, oldspins=None, newspins=None, threshold=1e-8):
     """
     Given a list of transformed positions, identify if there's a translation vector
@@ -60,6 +108,9 @@ def maptranslation(oldpos, newpos, oldspins=None, newspins=None, threshold=1e-8)
     If old/newspins are given then ONLY mappings that maintain spin are considered.
     This means that a loop is needed to consider possible spin phase factors.
 
+    Each translated position is only compared with the old positions in its neighborhood,
+    using a hash table of the old positions, so each trial translation is O(N).
+
     :param oldpos: list of list of array[3]
     :param newpos: list of list of array[3], same layout as oldpos
     :param oldspins: (optional) list of list of numbers/arrays
@@ -99,21 +150,25 @@ def maptranslation(oldpos, newpos, oldspins=None, newspins=None, threshold=1e-8)
             maxlen = len(ulist)
             atomindex = i
     ru0 = newpos[atomindex][0]
+    oldhash = [positionhash(atomlist0, threshold) for atomlist0 in oldpos]
     for ub in oldpos[atomindex]:
         trans = inhalf(ub - ru0)
         foundmap = True
         # now check against all the others, and construct the mapping
         indexmap = []
-        for atomlist0, spinlist0, atomlist1, spinlist1 in zip(oldpos, oldspins, newpos, newspins):
+        for atomlist0, spinlist0, atomlist1, spinlist1, poshash in zip(oldpos, oldspins, newpos, newspins, oldhash):
             # work through the "new" positions
             if not foundmap: break
             maplist = []
             for rua, sp1 in zip(atomlist1, spinlist1):
-                for j, uj, sp0 in zip(itertools.count(), atomlist0, spinlist0):
+                for j in positionmatches(poshash, rua + trans, threshold):
+                    uj, sp0 = atomlist0[j], spinlist0[j]
                     if not np.allclose(sp0, sp1, atol=threshold): continue  # only allow maps that have same spin
                     if np.allclose(inhalf(uj - rua - trans), 0, atol=threshold):
                         maplist.append(j)
                         break
+                else:
+                    break  # no match for this atom: not a valid translation
             if len(maplist) != len(atomlist0):
                 foundmap = False
             else:
@@ -173,6 +228,13 @@ class GroupOp(collections.namedtuple('GroupOp', 'rot trans cartrot indexmap')):
                 'cartrot': self.cartrot,
                 'indexmap': self.indexmap}
 
+    def sortkey(self):
+        """
+        Key for sorting group operations into a canonical order; sets of group operations are
+        constructed in this order, so that their iteration order depends only on their contents.
+        """
+        return self.rot.flatten().tolist(), self.indexmap, np.round(self.trans, 8).tolist()
+
     def __eq__(self, other):
         """Test for equality--we use numpy.isclose for comparison, since that's what we usually care about"""
         return isinstance(other, self.__class__) and \
@@ -548,6 +610,101 @@ def FourthRankIsotropic(F):
     return average, shear
 
 
+def groupops2arrays(Glist):
+    """
+    Convert a list of group operations into arrays, for storage.
+
+    :param Glist: list of GroupOps
+    :return rot: int_array[NG][3][3] of rotations
+    :return trans: array[NG][3] of translations
+    :return cartrot: array[NG][3][3] of cartesian rotations
+    :return indexmap: int_array[NG][N] of atom mappings, flattened over chemistries
+    """
+    return np.array([g.rot for g in Glist], dtype=np.int64), np.array([g.trans for g in Glist]), \
+           np.array([g.cartrot for g in Glist]), \
+           np.array([[i for imap in g.indexmap for i in imap] for g in Glist], dtype=np.int64)
+
+
+def arrays2groupops(rot, trans, cartrot, indexmap, chemcount):
+    """
+    Convert arrays back into a list of group operations; inverse of groupops2arrays.
+
+    :param rot: int_array[NG][3][3] of rotations
+    :param trans: array[NG][3] of translations
+    :param cartrot: array[NG][3][3] of cartesian rotations
+    :param indexmap: int_array[NG][N] of atom mappings, flattened over chemistries
+    :param chemcount: list of number of atoms of each chemistry
+    :return Glist: list of GroupOps
+    """
+    offsets = np.cumsum([0] + list(chemcount))
+    return [GroupOp(r, t, cr, tuple(tuple(imap[n0:n1]) for n0, n1 in zip(offsets[:-1], offsets[1:])))
+            for r, t, cr, imap in zip(rot, trans, cartrot, indexmap.tolist())]
+
+
+class SymmetryCacheHDF5(object):
+    """
+    Persistent store of the symmetry analysis of crystals (reduced lattice and basis, BZ, space
+    group, point groups, Wyckoff sets) in an HDF5 file, so that repeated construction of the same
+    crystal---in the same or separate processes---skips the analysis. Entries are keyed by
+    Crystal.symmetrykey(). Passed to the Crystal constructor (symmcache=...), or used for all
+    crystals constructed inside a symmetrycache() block. Kept in a cachestore.HDF5CacheStore,
+    which handles the locking and the eviction of the oldest entries once there are more than
+    maxentries.
+    """
+
+    def __init__(self, filename, maxentries=1024):
+        """
+        Create (or open) a persistent symmetry cache.
+
+        :param filename: name of HDF5 file to store cache
+        :param maxentries: maximum number of entries to keep; oldest entries are evicted first
+        """
+        self.store = cachestore.HDF5CacheStore(filename, maxentries)
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, key):
+        """
+        Return cached symmetry data, or None if not present.
+
+        :param key: key identifying the crystal (see Crystal.symmetrykey())
+        :return symmdata: dictionary of arrays (see Crystal.symmetrydata()), or None
+        """
+        return self.store.get(key)
+
+    def put(self, key, symmdata, replace=False):
+        """
+        Store symmetry data in the cache; evicts the oldest entries if we have more than maxentries.
+
+        :param key: key identifying the crystal (see Crystal.symmetrykey())
+        :param symmdata: dictionary of arrays (see Crystal.symmetrydata())
+        :param replace: replace an existing entry (e.g., one that failed validation)?
+        """
+        self.store.put(key, symmdata, replace=replace)
+
+
+# persistent symmetry cache for crystals constructed inside a symmetrycache() block
+_symmcache = None
+
+
+@contextlib.contextmanager
+def symmetrycache(symmcache):
+    """
+    Use a persistent symmetry cache (such as SymmetryCacheHDF5) for every crystal constructed
+    inside the block that is not passed one explicitly, such as those made with Crystal.HCP()
+    or Crystal.fromdict(). The previous setting is restored on exit.
+
+    :param symmcache: object with get(key) and put(key, symmdata, replace) methods; None for no cache
+    """
+    global _symmcache
+    previous, _symmcache = _symmcache, symmcache
+    try:
+        yield symmcache
+    finally:
+        _symmcache = previous
+
+
 # TODO: Add the ability to explicitly specify "metastable" states
 # that should be considered the same chemistry, but not subject to reduction
 class Crystal(object):
@@ -559,10 +716,13 @@ class Crystal(object):
 
     Specified by a lattice (3 vectors), a basis (list of lists of positions in direct coordinates).
     Can also name the elements (chemistry), and specify spin degrees of freedom.
+
+    The symmetry analysis can be stored in, and reused from, a persistent cache (see
+    SymmetryCacheHDF5 and symmetrycache()).
     """
 
     def __init__(self, lattice, basis, chemistry=None, spins=None,
-                 NOSYM=False, noreduce=False, threshold=1e-8):
+                 NOSYM=False, noreduce=False, threshold=1e-8, symmcache=None):
         """
         Initialization; starts off with the lattice vector definition and the
         basis vectors. While it does not explicitly store the specific chemical
@@ -582,6 +742,8 @@ class Crystal(object):
         :param NOSYM: turn off all symmetry finding (except identity)
         :param noreduce: do not attempt to reduce the atomic basis
         :param threshold: threshold for symmetry equivalence (stored in the class)
+        :param symmcache: (optional) persistent symmetry cache, such as SymmetryCacheHDF5; if None,
+            the cache of an enclosing symmetrycache() block, if any
         """
         # Do some basic type checking and "formatting"
         self.lattice = None
@@ -615,8 +777,21 @@ class Crystal(object):
         else:
             self.spins = None
         self.threshold = threshold
-        if not noreduce: self.reduce()  # clean up basis as needed
-        self.minlattice()  # clean up lattice vectors as needed
+        if symmcache is None: symmcache = _symmcache
+        symmkey = None if symmcache is None else self.symmetrykey(NOSYM, noreduce)
+        symmdata = None if symmkey is None else symmcache.get(symmkey)
+        replace = symmdata is not None and not self.checksymmetrydata(symmdata)
+        if replace:
+            # not consistent with this crystal: redo the analysis, and replace the entry
+            instrument.timer.count('SymmetryCacheHDF5', 'invalid')
+            symmdata = None
+        if symmkey is not None:
+            instrument.timer.count('SymmetryCacheHDF5', 'miss' if symmdata is None else 'hit')
+        if symmdata is not None:
+            self.loadsymmetrydata(symmdata)
+        else:
+            if not noreduce: self.reduce()  # clean up basis as needed
+            self.minlattice()  # clean up lattice vectors as needed
         self.invlatt = np.linalg.inv(self.lattice)
         # this lets us, in a flat list, enumerate over indices of atoms as needed
         self.atomindices = [(atomtype, atomindex)
@@ -631,6 +806,7 @@ class Crystal(object):
         self.volume, self.metric = self.calcmetric()
         self.reciplatt = 2. * np.pi * self.invlatt.T
         self.BZvol = abs(float(np.linalg.det(self.reciplatt)))
+        if symmdata is not None: return
         self.BZG = self.genBZG()
         self.center()  # should do before gengroup so that inversion is centered at origin
         if NOSYM:
@@ -639,6 +815,121 @@ class Crystal(object):
             self.G = self.gengroup()  # do before genpoint
         self.pointG = self.genpoint()
         self.Wyckoff = self.genWyckoffsets()
+        if symmkey is not None: symmcache.put(symmkey, self.symmetrydata(), replace=replace)
+
+    def symmetrykey(self, NOSYM=False, noreduce=False):
+        """
+        Canonical key identifying the symmetry analysis of the (unreduced) crystal in a persistent
+        cache: built from the lattice, basis, and spins (rounded to 12 decimals), threshold, and
+        the NOSYM and noreduce flags. Chemistry names do not change the symmetry analysis.
+
+        :param NOSYM: turn off all symmetry finding (except identity)
+        :param noreduce: do not attempt to reduce the atomic basis
+        :return key: hex digest string
+        """
+        canonical = lambda a: (np.round(np.array(a, dtype=complex), 12) + 0).tolist()
+        keystr = 'Crystal.symmetry|{}|{!r}|{}|{}|{}|'.format(self.dim, self.threshold, NOSYM, noreduce,
+                                                            canonical(self.lattice))
+        keystr += '|'.join('{}'.format(canonical(atomlist)) for atomlist in self.basis)
+        if self.spins is not None:
+            keystr += '|spins|' + '|'.join('{}'.format([canonical(s) for s in spinlist])
+                                           for spinlist in self.spins)
+        return hashlib.sha1(keystr.encode('utf-8')).hexdigest()
+
+    def symmetrydata(self):
+        """
+        The symmetry analysis as a dictionary of arrays, for storage in a persistent cache:
+        lattice, basis, spins and threshold after reduction, BZG, space group, point groups,
+        and Wyckoff sets.
+
+        :return symmdata: dictionary of arrays
+        """
+        symmdata = {'lattice': self.lattice, 'threshold': self.threshold, 'BZG': self.BZG,
+                    'chemcount': np.array([len(atomlist) for atomlist in self.basis], dtype=np.int64),
+                    'basis': np.array([u for atomlist in self.basis for u in atomlist]).reshape(-1, self.dim)}
+        if self.spins is not None:
+            symmdata['spins'] = np.array([s for spinlist in self.spins for s in spinlist])
+        Glist = list(self.G)
+        for name, value in zip(('G_rot', 'G_trans', 'G_cartrot', 'G_indexmap'), groupops2arrays(Glist)):
+            symmdata[name] = value
+        pointGlist = [(n, g) for n, (c, i) in enumerate(self.atomindices) for g in self.pointG[c][i]]
+        symmdata['pointG_site'] = np.array([n for n, g in pointGlist], dtype=np.int64)
+        for name, value in zip(('pointG_rot', 'pointG_trans', 'pointG_cartrot', 'pointG_indexmap'),
+                               groupops2arrays([g for n, g in pointGlist])):
+            symmdata[name] = value
+        Wyckoff = np.zeros(self.N, dtype=np.int64)
+        for w, wset in enumerate(self.Wyckoff):
+            for ind in wset:
+                Wyckoff[self.atomindices.index(ind)] = w
+        symmdata['Wyckoff'] = Wyckoff
+        return symmdata
+
+    def checksymmetrydata(self, symmdata):
+        """
+        Check that symmetry data (e.g., from a persistent cache) is consistent with this crystal,
+        before it replaces the symmetry analysis: all of the arrays are present with shapes that
+        match our dimension and number of atoms, the threshold and spins match, the reduced cell
+        has the same volume per atom, and the group operations are rotations.
+
+        :param symmdata: dictionary of arrays (see symmetrydata())
+        :return valid: True if consistent
+        """
+        dim, N0 = self.dim, sum(len(atomlist) for atomlist in self.basis)
+        try:
+            chemcount = symmdata['chemcount']
+            N = int(np.sum(chemcount))
+            if symmdata['lattice'].shape != (dim, dim) or symmdata['basis'].shape != (N, dim): return False
+            if symmdata['BZG'].ndim != 2 or symmdata['BZG'].shape[1] != dim: return False
+            if len(chemcount) != len(self.basis) or np.any(chemcount < 1): return False
+            if float(symmdata['threshold']) != self.threshold: return False
+            if ('spins' in symmdata) != (self.spins is not None): return False
+            # reduction of the basis keeps the volume per atom
+            if not np.isclose(abs(np.linalg.det(symmdata['lattice'])) / N,
+                              abs(np.linalg.det(self.lattice)) / N0): return False
+            for group in ('G', 'pointG'):
+                rot, trans, cartrot, indexmap = (symmdata[group + name]
+                                                 for name in ('_rot', '_trans', '_cartrot', '_indexmap'))
+                NG = len(rot)
+                if rot.shape != (NG, dim, dim) or cartrot.shape != (NG, dim, dim): return False
+                if trans.shape != (NG, dim) or indexmap.shape != (NG, N): return False
+                if NG > 0 and (np.min(indexmap) < 0 or np.max(indexmap) >= np.max(chemcount)): return False
+                if not np.allclose(np.matmul(cartrot, np.transpose(cartrot, (0, 2, 1))), np.eye(dim)):
+                    return False
+            if len(symmdata['G_rot']) == 0: return False
+            if symmdata['pointG_site'].shape != (len(symmdata['pointG_rot']),): return False
+            if symmdata['Wyckoff'].shape != (N,): return False
+        except (KeyError, AttributeError, TypeError, ValueError, IndexError):
+            return False
+        return True
+
+    def loadsymmetrydata(self, symmdata):
+        """
+        Set the symmetry analysis from a dictionary of arrays; inverse of symmetrydata().
+        Only sets those quantities, not anything derived from them (such as invlatt).
+
+        :param symmdata: dictionary of arrays
+        """
+        chemcount = symmdata['chemcount'].tolist()
+        offsets = np.cumsum([0] + chemcount)
+        self.lattice, self.threshold, self.BZG = symmdata['lattice'], float(symmdata['threshold']), symmdata['BZG']
+        self.basis = [list(symmdata['basis'][n0:n1]) for n0, n1 in zip(offsets[:-1], offsets[1:])]
+        if 'spins' in symmdata:
+            spins = symmdata['spins']
+            spins = list(spins) if spins.ndim > 1 else spins.tolist()
+            self.spins = [spins[n0:n1] for n0, n1 in zip(offsets[:-1], offsets[1:])]
+        self.G = frozenset(sorted(arrays2groupops(symmdata['G_rot'], symmdata['G_trans'], symmdata['G_cartrot'],
+                                                  symmdata['G_indexmap'], chemcount), key=GroupOp.sortkey))
+        pointGlist = arrays2groupops(symmdata['pointG_rot'], symmdata['pointG_trans'], symmdata['pointG_cartrot'],
+                                     symmdata['pointG_indexmap'], chemcount)
+        atomindices = [(c, i) for c, count in enumerate(chemcount) for i in range(count)]
+        pointG = [[] for n in atomindices]
+        for n, g in zip(symmdata['pointG_site'].tolist(), pointGlist):
+            pointG[n].append(g)
+        self.pointG = [[frozenset(sorted(pointG[n0 + i], key=GroupOp.sortkey)) for i in range(count)]
+                       for n0, count in zip(offsets[:-1], chemcount)]
+        Wyckoff = symmdata['Wyckoff'].tolist()
+        self.Wyckoff = frozenset(frozenset(ind for ind, w0 in zip(atomindices, Wyckoff) if w0 == w)
+                                 for w in set(Wyckoff))
 
     def __repr__(self):
         """String representation of crystal (lattice + basis)"""
@@ -1047,7 +1338,7 @@ class Crystal(object):
                                                 trans,
                                                 cartrot,
                                                 indexmap))
-        return frozenset(groupops)
+        return frozenset(sorted(groupops, key=GroupOp.sortkey))
 
     def strain(self, eps):
         """
@@ -1262,9 +1553,10 @@ class Crystal(object):
         if self.N == 1:
             return [[self.G]]
         origin = np.zeros(self.dim, dtype=int)
-        return [[frozenset([g - self.g_pos(g, origin, (atomtypeindex, atomindex))[0]
-                            for g in self.G
-                            if g.indexmap[atomtypeindex][atomindex] == atomindex])
+        return [[frozenset(sorted([g - self.g_pos(g, origin, (atomtypeindex, atomindex))[0]
+                                   for g in self.G
+                                   if g.indexmap[atomtypeindex][atomindex] == atomindex],
+                                  key=GroupOp.sortkey))
                  for atomindex in range(len(atomlist))]
                 for atomtypeindex, atomlist in enumerate(self.basis)]
 
@@ -1415,45 +1707,58 @@ class Crystal(object):
         but by equivalence of transition state, not symmetry. Now updated with closest-distance
         parameter.
 
+        Transitions are identified by integer keys (i, j, R) for the jump from i in unit cell 0
+        to j in unit cell R, and expanded by all of the group operations at once; candidate
+        atoms for collisions are found with a KD-tree.
+
         :param chem: index corresponding to the chemistry to consider
         :param cutoff: distance cutoff
         :param closestdistance: closest distance allowed in transition (can be a list)
         :return jumpnetwork: list of symmetry-unique transitions; each is a list of tuples:
           ``((i,j), dx)`` corresponding to jump from :math:`i \\to j` with vector :math:`\mathbf{\delta x}`
         """
-
-        # should we consider changing the lists to tuples? Not sure if there's any efficiency gain
-        def inlist(tup, dx, lis):
-            """Determines if (i,j), dx is in our list"""
-            # a little confusing: run through all transition tuples, see if we find our example
-            return any(tup == ij and self.__isclose__(dx, v) for translist in lis for ij, v in translist)
-
+        from scipy import spatial  # KD-tree for collision detection
         r2 = cutoff * cutoff
         nmax = [int(np.round(np.sqrt(r2/self.metric[i, i]))) + 1
                 for i in range(self.dim)]
         nranges = [range(-n, n+1) for n in nmax]
         supervect = [np.array(ntup) for ntup in itertools.product(*nranges)]
-        lis = []
+        superarray = np.array(supervect)
         center = np.zeros(self.dim, dtype=int)
+        # group operations applied to sites of our chemistry: site i in cell R goes to
+        # site indexmap[g, i] in cell rot[g].R + shift[g, i]
+        Glist = list(self.G)
+        basis = np.array(self.basis[chem])
+        rot = np.array([g.rot for g in Glist])
+        indexmap = np.array([g.indexmap[chem] for g in Glist])
+        shift = np.array([np.round(np.dot(basis, g.rot.T) + g.trans - basis[imap]).astype(int)
+                          for g, imap in zip(Glist, indexmap)])
+        lis = []
+        found = set()  # (i, j, R) keys of every transition in lis
         for i, u0 in enumerate(self.basis[chem]):
             for j, u1 in enumerate(self.basis[chem]):
                 du = u1 - u0
-                for n in supervect:
+                # screen with some slack, then check exactly as each transition is considered
+                dx2array = np.sum(np.dot(superarray + du, self.lattice.T) ** 2, axis=1)
+                for nind in np.where((dx2array > 0) & (dx2array < r2 * (1 + SCREEN_SLACK)))[0]:
+                    n = supervect[nind]
                     dx = self.unit2cart(n, du)
                     if np.dot(dx, dx) > 0 and np.dot(dx, dx) < r2:
                         # we have a valid transition; first check that we haven't already looked at it
-                        if not inlist((i, j), dx, lis):
-                            trans = []
-                            for g in self.G:
-                                # rotate through all combinations of i->j using space group symmetry
-                                R1, ind1 = self.g_pos(g, center, (chem, i))
-                                R2, ind2 = self.g_pos(g, n, (chem, j))
-                                tup = (ind1[1], ind2[1])
-                                dx = self.pos2cart(R2, ind2) - self.pos2cart(R1, ind1)
-                                if not any(tup == ij and self.__isclose__(dx, v) for ij, v in trans):
-                                    trans.append((tup, dx))
-                                    trans.append(((tup[1], tup[0]), -dx))
-                            lis.append(trans)
+                        if (i, j) + tuple(n) in found: continue
+                        trans = []
+                        # rotate through all combinations of i->j using space group symmetry
+                        ind1, ind2 = indexmap[:, i], indexmap[:, j]
+                        R1, R2 = shift[:, i], np.dot(rot, n) + shift[:, j]
+                        for g, key in enumerate(zip(ind1.tolist(), ind2.tolist(), (R2 - R1).tolist())):
+                            tup, R = (key[0], key[1]), tuple(key[2])
+                            if tup + R in found: continue
+                            dx = self.pos2cart(R2[g], (chem, tup[1])) - self.pos2cart(R1[g], (chem, tup[0]))
+                            trans.append((tup, dx))
+                            trans.append(((tup[1], tup[0]), -dx))
+                            found.add(tup + R)
+                            found.add((tup[1], tup[0]) + tuple(-r for r in R))
+                        lis.append(trans)
         # now for collision detection:
         if type(closestdistance) is list:
             # quick sanity check to make sure we don't include collision detection on
@@ -1466,26 +1771,35 @@ class Crystal(object):
                 # skip the negative distances; we still check 0 because straight line paths
                 # through sites should (probably) still be excluded
                 continue
-            for u0 in self.basis[c]:
-                for n in supervect:
-                    # check each transition in the list (we need to do list(lis) because
-                    # we will modify lis in place with remove's, and its dangerous to pull
-                    # off as we iterate through:
-                    # for trans in lis.copy():
-                    for ntrans in range(len(lis)-1,-1,-1):
-                        trans = lis[ntrans]
-                        t = trans[0]  # representative transition
-                        dx = t[1]
-                        # take our starting point relative to the first item in the tuple
-                        xRa = self.unit2cart(n, u0 - self.basis[chem][t[0][0]])
-                        xRa2 = np.dot(xRa, xRa)
-                        xRa_dx = np.dot(xRa, dx)
-                        dx2 = np.dot(dx, dx)
-                        if 0 <= xRa_dx <= dx2:
-                            d2 = (xRa2 * dx2 - xRa_dx * xRa_dx) / dx2
-                            if np.isclose(d2, mindist2) or d2 < mindist2:
-                                # lis.remove(trans)
-                                lis.pop(ntrans)
+            # all of the atoms of chemistry c that we check (u0 in cell n), in a KD-tree; the candidates
+            # for a transition are those within reach of its midpoint, which are then checked exactly
+            atoms = [(u0, n) for u0 in self.basis[c] for n in supervect]
+            tree = spatial.cKDTree(np.dot(np.array([n + u0 for u0, n in atoms]), self.lattice.T))
+            # tolerances for the exact check (np.isclose defaults); an atom that it flags is within
+            # reach of the path, and so within 0.5*|dx| + reach of the midpoint
+            rtol, atol = 1e-5, 1e-8
+            reach = np.sqrt(mindist2 * (1 + rtol) + atol)
+            # check each transition in the list (we need to work backwards because
+            # we will modify lis in place with pop's, and its dangerous to pull
+            # off as we iterate through):
+            for ntrans in range(len(lis)-1,-1,-1):
+                trans = lis[ntrans]
+                t = trans[0]  # representative transition
+                dx = t[1]
+                dx2 = np.dot(dx, dx)
+                midpoint = self.unit2cart(center, self.basis[chem][t[0][0]]) + 0.5 * dx
+                radius = (0.5 * np.sqrt(dx2) + reach) * (1 + SCREEN_SLACK)
+                for a in sorted(tree.query_ball_point(midpoint, radius)):
+                    u0, n = atoms[a]
+                    # take our starting point relative to the first item in the tuple
+                    xRa = self.unit2cart(n, u0 - self.basis[chem][t[0][0]])
+                    xRa2 = np.dot(xRa, xRa)
+                    xRa_dx = np.dot(xRa, dx)
+                    if 0 <= xRa_dx <= dx2:
+                        d2 = (xRa2 * dx2 - xRa_dx * xRa_dx) / dx2
+                        if np.isclose(d2, mindist2, rtol=rtol, atol=atol) or d2 < mindist2:
+                            lis.pop(ntrans)
+                            break
         lis.sort(key=lambda entry: min(i + j + 1e-3 * np.dot(dx, dx) for (i, j), dx in entry))
         return lis
 
@@ -1517,47 +1831,173 @@ class Crystal(object):
                        for l in [list(s) for s in self.Wyckoff]  # converts to list of lists
                        if l[0][0] == chem])  # select only those with correct chemistry
 
-    def fullkptmesh(self, Nmesh):
+    def fullkptmesh(self, Nmesh, returnindices=False):
         """
         Creates a k-point mesh of density given by Nmesh; does not symmetrize but does put the
         k-points inside the BZ. Does not return any *weights* as every point is equally weighted.
 
         :param Nmesh: mesh divisions Nmesh[0] x Nmesh[1] x Nmesh[2]
+        :param returnindices: also return the integer mesh coordinates (for reducekptmesh)?
         :return kpt: array[Nkpt][3] of kpoints
+        :return meshindices: int_array[Nkpt][3] (only if returnindices) integer coordinates of
+            the kpoints: kpt = reciplatt . meshindices / Ndiv
+        :return Ndiv: (only if returnindices) common divisor of the mesh coordinates
         """
         Nkpt = np.product(Nmesh)
         if Nkpt == 0: return
-        # dN = np.array([1 / x for x in Nmesh])
-        # # use a list comprehension to iterate and build:
-        # kptfull = np.array([np.dot(self.reciplatt, (n0 * dN[0], n1 * dN[1], n2 * dN[2]))
-        #                     for n0 in range(-Nmesh[0] // 2 + 1, Nmesh[0] // 2 + 1)
-        #                     for n1 in range(-Nmesh[1] // 2 + 1, Nmesh[1] // 2 + 1)
-        #                     for n2 in range(-Nmesh[2] // 2 + 1, Nmesh[2] // 2 + 1)])
-        kdiv = [np.linspace(1/2,-1/2,Nm,endpoint=False) for Nm in Nmesh]
-        kptfull = np.array([np.dot(self.reciplatt, ktup) for ktup in itertools.product(*kdiv)])
-        # run through list to ensure that all k-points are inside the BZ
-        Gmin = min(np.dot(G, G) for G in self.BZG)
-        for k in kptfull:
-            if np.dot(k, k) >= Gmin:
-                for G in self.BZG:
-                    if np.dot(k, G) > np.dot(G, G):
-                        k -= 2. * G
-        return kptfull
-
-    def reducekptmesh(self, kptfull, threshold=None):
+        kpt, meshindices, Ndiv = self._kptmeshpoints(Nmesh, 0, Nkpt)
+        if returnindices: return kpt, meshindices, Ndiv
+        return kpt
+
+    def fullkptmeshchunks(self, Nmesh, Nchunk=65536, returnindices=False):
+        """
+        Generator version of fullkptmesh: yields the same k-points, in the same order, in
+        chunks of (at most) Nchunk points, so that very dense meshes need not be stored.
+
+        :param Nmesh: mesh divisions Nmesh[0] x Nmesh[1] x Nmesh[2]
+        :param Nchunk: maximum number of k-points in each chunk
+        :param returnindices: also yield the integer mesh coordinates (for reducekptmesh)?
+        :return kpt: array[Nchunk][3] of kpoints
+        :return meshindices: int_array[Nchunk][3] (only if returnindices) integer coordinates
+        :return Ndiv: (only if returnindices) common divisor of the mesh coordinates
+        """
+        Nkpt = int(np.product(Nmesh))
+        for start in range(0, Nkpt, Nchunk):
+            chunk = self._kptmeshpoints(Nmesh, start, min(start + Nchunk, Nkpt))
+            yield chunk if returnindices else chunk[0]
+
+    def _kptmeshpoints(self, Nmesh, start, stop):
+        """
+        Points start..stop-1 of the full k-point mesh, folded into the BZ; the mesh is
+        constructed and folded in integer coordinates, so folding is exact.
+
+        :param Nmesh: mesh divisions Nmesh[0] x Nmesh[1] x Nmesh[2]
+        :param start: first point
+        :param stop: last point + 1
+        :return kpt: array[stop-start][3] of kpoints
+        :return meshindices: int_array[stop-start][3] integer coordinates
+        :return Ndiv: common divisor of the mesh coordinates
+        """
+        Nmesh = np.array(Nmesh, dtype=int)
+        Ndiv = reduce(lambda a, b: a * b // gcd(a, b), [2 * N for N in Nmesh])  # lcm
+        # mesh coordinates 1/2 - j/N along each reciprocal lattice vector (in units of 1/Ndiv),
+        # in the same order as itertools.product
+        j = np.array(np.unravel_index(np.arange(start, stop), Nmesh)).T
+        meshindices = Ndiv // 2 - j * (Ndiv // Nmesh)
+        # fold into the BZ: reflect through the most violated BZ plane until no point is outside
+        G2 = np.round(np.dot(2 * self.BZG, self.lattice) * (Ndiv / (2 * np.pi))).astype(int)
+        GG = np.sum(self.BZG ** 2, axis=1)
+        kpt = np.dot(meshindices, self.reciplatt.T) / Ndiv
+        outside = np.arange(len(kpt))
+        while len(outside) > 0:
+            excess = np.dot(kpt[outside], self.BZG.T) - GG
+            fold = np.max(excess, axis=1) > self.threshold
+            outside = outside[fold]
+            meshindices[outside] -= G2[np.argmax(excess[fold], axis=1)]
+            kpt[outside] = np.dot(meshindices[outside], self.reciplatt.T) / Ndiv
+        return kpt, meshindices, Ndiv
+
+    def kptmeshindices(self, kptfull, threshold=None):
+        """
+        Integer coordinates of k-points on a regular mesh: kpt = reciplatt . meshindex / Ndiv,
+        for a common integer Ndiv. Ndiv is found from the number of distinct (fractional)
+        coordinates along each reciprocal lattice vector.
+
+        :param kptfull: array[Nkpt][3] of kpoints
+        :param threshold: threshold for equality of coordinates
+        :return meshindices: int_array[Nkpt][3] of integer coordinates; None if not on a mesh
+        :return Ndiv: common divisor of the mesh coordinates; 0 if not on a mesh
+        """
+        eps = self.threshold if threshold is None else threshold
+        frac = np.dot(kptfull, self.lattice) / (2 * np.pi)  # coordinates in units of reciplatt
+        Nbin = int(round(1 / eps))
+        Ndiv = 1
+        for f in frac.T:
+            Nf = len(np.unique(np.round((f % 1) * Nbin).astype(np.int64) % Nbin))
+            Ndiv *= 2 * Nf // gcd(Ndiv, 2 * Nf)  # lcm; factor of 2 for meshes offset by half a step
+        meshindices = np.round(frac * Ndiv)
+        if not np.all(np.abs(meshindices - frac * Ndiv) < eps * Ndiv):
+            return None, 0
+        return meshindices.astype(int), Ndiv
+
+    def reducekptmesh(self, kptfull, threshold=None, meshindices=None, returnindex=False):
         """
         Takes a fully expanded mesh, and reduces it by symmetry. Assumes every point is
         equally weighted. We would need a different (more complicated) algorithm if not true...
+        Points on a regular mesh are reduced using their integer mesh coordinates, on which
+        each group operation acts as an integer matrix: every point is labeled by the smallest
+        key of its images, and each orbit is represented by its first point in order of |k|^2
+        (points with the same |k|^2, to within threshold, are kept in their order in kptfull).
+        Any other list of points is reduced by direct comparison of the symmetry images.
 
         :param kptfull: array[Nkpt][3] of kpoints
         :param threshold: threshold for symmetry equality
+        :param meshindices: int_array[Nkpt][3] of integer coordinates of kptfull, in units of
+            reciplatt divided by a common integer (see kptmeshindices); determined if not given
+        :param returnindex: also return the index of the reduced point for each of kptfull?
         :return kptsymm: array[Nsymm][3] of kpoints
         :return weight: array[Nsymm] of weights (integrates to 1)
+        :return index: int_array[Nkpt] (only if returnindex) kptfull[n] is equivalent to kptsymm[index[n]]
         """
         eps = self.threshold if threshold is None else threshold
-        kptlist = list(kptfull)
-        Nkpt = len(kptlist)
-        kptlist.sort(key=lambda k: np.vdot(k, k))
+        kptfull = np.asarray(kptfull)
+        Nkpt = len(kptfull)
+        if meshindices is None:
+            meshindices, Ndiv = self.kptmeshindices(kptfull, eps)
+        if meshindices is None:
+            kptsym, wsym, index = self._reducekptlist(kptfull, eps)
+        else:
+            kptsym, wsym, index = self._reducekptindices(kptfull, np.asarray(meshindices), eps)
+        if returnindex: return kptsym, wsym, index
+        return kptsym, wsym
+
+    def _reducekptindices(self, kptfull, meshindices, eps):
+        """
+        Symmetry reduction of k-points using integer mesh coordinates; see reducekptmesh.
+
+        :param kptfull: array[Nkpt][3] of kpoints
+        :param meshindices: int_array[Nkpt][3] of integer coordinates of kptfull
+        :param eps: threshold for equality of |k|^2
+        :return kptsymm: array[Nsymm][3] of kpoints
+        :return weight: array[Nsymm] of weights
+        :return index: int_array[Nkpt] of index into kptsymm for each kpoint
+        """
+        Nkpt = len(kptfull)
+        # each operation as an integer matrix acting on reciprocal lattice coordinates
+        introts = [np.round(np.dot(self.lattice.T, np.dot(g.cartrot, self.invlatt.T))).astype(int)
+                   for g in self.G]
+        base = 2 * max(np.max(np.sum(np.abs(M), axis=1)) for M in introts) * \
+               np.max(np.abs(meshindices)) + 1
+        encode = base ** np.arange(self.dim, dtype=np.int64)
+        keys = None
+        for M in introts:
+            gkeys = np.dot(np.dot(meshindices, M.T) + base // 2, encode)
+            keys = gkeys if keys is None else np.minimum(keys, gkeys)
+        # stable sort in shells of |k|^2; each orbit is then represented by its first member
+        k2shell = np.round(np.einsum('ij,ij->i', kptfull, kptfull) / eps).astype(np.int64)
+        order = np.argsort(k2shell, kind='mergesort')
+        orbitkeys, first, inverse, counts = np.unique(keys[order], return_index=True,
+                                                      return_inverse=True, return_counts=True)
+        orbitorder = np.argsort(first)
+        rank = np.empty(len(orbitkeys), dtype=int)
+        rank[orbitorder] = np.arange(len(orbitkeys))
+        index = np.empty(Nkpt, dtype=int)
+        index[order] = rank[inverse]
+        return kptfull[order[first[orbitorder]]].copy(), counts[orbitorder] / Nkpt, index
+
+    def _reducekptlist(self, kptfull, eps):
+        """
+        Symmetry reduction of k-points by direct comparison in shells of |k|^2; see reducekptmesh.
+
+        :param kptfull: array[Nkpt][3] of kpoints
+        :param eps: threshold for symmetry equality
+        :return kptsymm: array[Nsymm][3] of kpoints
+        :return weight: array[Nsymm] of weights
+        :return index: int_array[Nkpt] of index into kptsymm for each kpoint
+        """
+        Nkpt = len(kptfull)
+        order = sorted(range(Nkpt), key=lambda n: np.vdot(kptfull[n], kptfull[n]))
+        kptlist = [kptfull[n] for n in order]
         k2_indices = []
         k2old = np.vdot(kptlist[0], kptlist[0])
         for i, k2 in enumerate([np.vdot(k, k) for k in kptlist]):
@@ -1568,30 +2008,33 @@ class Crystal(object):
         # k2_indices now contains a list of indices with the same magnitudes
         kptsym = []
         wsym = []  # unscaled at this point
+        index = np.zeros(Nkpt, dtype=int)
         kmin = 0
         basewt = 1 / Nkpt
         for kmax in k2_indices:
             complist = []
             symmcomplist = []
             wtlist = []
-            for k in kptlist[kmin:kmax]:
+            for n, k in zip(order[kmin:kmax], kptlist[kmin:kmax]):
                 match = False
                 for i, symmcomp in enumerate(symmcomplist):
                     # if any(np.allclose(k, gk, rtol=0, atol=threshold) for gk in symmcomp):
                     if any(np.all(abs(k - gk) < eps) for gk in symmcomp):
                         # update weight, kick out
                         wtlist[i] += basewt
+                        index[n] = len(kptsym) + i
                         match = True
-                        continue
+                        break
                 if not match:
                     # new symmetry point!
+                    index[n] = len(kptsym) + len(complist)
                     complist.append(k)
                     symmcomplist.append([self.g_direc(g, k) for g in self.G])
                     wtlist.append(basewt)
             kptsym += complist
             wsym += wtlist
             kmin = kmax
-        return np.array(kptsym), np.array(wsym)
+        return np.array(kptsym), np.array(wsym), index
 
 
 # YAML interfaces for types outside of this module
@@ -26,7 +26,10 @@ import numpy as np
 import collections
 import copy
 import itertools
+import warnings
+import scipy.sparse
 from onsager import crystal
+from onsager import instrument
 
 # YAML tags
 PAIRSTATE_YAMLTAG = '!PairState'
@@ -214,7 +217,67 @@ def array2PSlist(ij, R, dx):
     :param dx: float[N][3]
     :return PSlist: list of pair states
     """
-    return [PairState(i=ij0[0], j=ij0[1], R=R0, dx=dx0) for ij0, R0, dx0 in zip(ij, R, dx)]
+    return [PairState(i=i, j=j, R=R0, dx=dx0) for (i, j), R0, dx0 in zip(np.asarray(ij).tolist(), R, dx)]
+
+
+# array ("structure of arrays") versions of pair state operations
+def PSarraykeys(ij, R, Nbasis, Rmax):
+    """
+    Packs each pair state (i, j, R) into a single integer key, for vectorized hashing and lookup.
+    Keys are unique for 0 <= i, j < Nbasis and abs(R) <= Rmax, and can only be compared between
+    keys with the same Nbasis and Rmax.
+
+    :param ij: int_array[N][2] = (i,j)
+    :param R: int[N][dim]
+    :param Nbasis: number of sites in the basis
+    :param Rmax: largest (absolute) component of R to encode
+    :return keys: int64[N]; -1 for pair states outside of the encoded range
+    """
+    ij, R = np.asarray(ij, dtype=np.int64), np.asarray(R, dtype=np.int64)
+    keys = ij[:, 0] * Nbasis + ij[:, 1]
+    for d in range(R.shape[1]):
+        keys = keys * (2 * Rmax + 1) + (R[:, d] + Rmax)
+    inrange = np.all((ij >= 0) & (ij < Nbasis), axis=1) & np.all(np.abs(R) <= Rmax, axis=1)
+    return np.where(inrange, keys, -1)
+
+
+def PSarrayadd(ij1, R1, dx1, ij2, R2, dx2):
+    """
+    All of the sums s1 + s2 of pair states from two lists (as arrays) where the endpoints match, s1.j == s2.i;
+    equivalent to PairState.__add__.
+
+    :param ij1, R1, dx1: arrays for first list of pair states
+    :param ij2, R2, dx2: arrays for second list of pair states
+    :return ij, R, dx: arrays of pair states s1 + s2
+    """
+    n1, n2 = np.nonzero(ij1[:, 1][:, np.newaxis] == ij2[:, 0][np.newaxis, :])
+    return np.column_stack((ij1[n1, 0], ij2[n2, 1])), R1[n1] + R2[n2], dx1[n1] + dx2[n2]
+
+
+def PSarrayxor(ij1, R1, dx1, ij2, R2, dx2):
+    """
+    All of the endpoint subtractions s1 ^ s2 of pair states from two lists (as arrays) where the initial
+    states match, s1.i == s2.i; equivalent to PairState.__xor__.
+
+    :param ij1, R1, dx1: arrays for first list of pair states
+    :param ij2, R2, dx2: arrays for second list of pair states
+    :return ij, R, dx: arrays of pair states s1 ^ s2
+    """
+    n1, n2 = np.nonzero(ij1[:, 0][:, np.newaxis] == ij2[:, 0][np.newaxis, :])
+    return np.column_stack((ij2[n2, 1], ij1[n1, 1])), R1[n1] - R2[n2], dx1[n1] - dx2[n2]
+
+
+def PSarrayunique(keys, *arrays):
+    """
+    Removes duplicate pair states (same key), keeping the first occurrence.
+
+    :param keys: int64[N] keys of pair states
+    :param arrays: arrays for pair states (ij, R, dx, ...)
+    :return keys: int64[Nunique] unique keys, sorted
+    :return arrays: arrays for the unique pair states
+    """
+    keys, first = np.unique(keys, return_index=True)
+    return (keys,) + tuple(a[first] for a in arrays)
 
 
 def doublelist2flatlistindex(listlist):
@@ -248,6 +311,101 @@ def flatlistindex2doublelist(flatlist, indexarray):
     return listlist
 
 
+def raggedindex(starts, counts):
+    """
+    Index for concatenated ranges, starts[n]:starts[n]+counts[n]; useful to expand entries of
+    compressed (CSR-style) index tables.
+
+    :param starts: int_array[N] start of each range
+    :param counts: int_array[N] length of each range
+    :return n: int_array[sum(counts)] which range each entry belongs to
+    :return index: int_array[sum(counts)] index of each entry
+    """
+    n = np.repeat(np.arange(len(counts)), counts)
+    return n, starts[n] + np.arange(len(n)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def jumpnetwork2arrays(jumpnetwork, jumptype, dim=3):
+    """
+    Flatten a jumpnetwork (of state indices) into arrays of jumps
+
+    :param jumpnetwork: list of lists of (IS, FS), dx tuples
+    :param jumptype: jump type for each list in jumpnetwork
+    :param dim: dimensionality of dx
+    :return k: int_array[Njumps] index of the list in jumpnetwork
+    :return jt: int_array[Njumps] jump type
+    :return IS: int_array[Njumps] initial state
+    :return FS: int_array[Njumps] final state
+    :return dx: array[Njumps, dim] displacement
+    """
+    k = np.array([k for k, jumplist in enumerate(jumpnetwork) for jump in jumplist], dtype=int)
+    jt = np.array(jumptype, dtype=int)[k] if len(k) > 0 else k
+    IS = np.array([IS for jumplist in jumpnetwork for (IS, FS), dx in jumplist], dtype=int)
+    FS = np.array([FS for jumplist in jumpnetwork for (IS, FS), dx in jumplist], dtype=int)
+    dx = np.array([dx for jumplist in jumpnetwork for ISFS, dx in jumplist]).reshape((len(k), dim))
+    return k, jt, IS, FS, dx
+
+
+def PSorbitkeys(crys, chem, PSlist):
+    """
+    Canonical key for the symmetry orbit of each pair state: two pair states are related by a
+    group operation of the crystal if and only if they have the same key. Applies all of the group
+    operations at once to arrays of (i, j, R), using the integer rotations and index maps (equivalent
+    to PairState.g), and takes the smallest integer encoding of the images.
+
+    :param crys: crystal
+    :param chem: chemical index
+    :param PSlist: list of pair states
+    :return keys: list of (integer) keys
+    """
+    if len(PSlist) == 0: return []
+    ij, R, dx = PSlist2array(PSlist)
+    return PSarrayorbitkeys(crys, chem, ij, R).tolist()
+
+
+def PSarrayg(crys, chem, ij, R):
+    """
+    Apply every group operation in crys.G (in iteration order) to pair states as arrays; equivalent to
+    PairState.g, using the integer rotations and index maps.
+
+    :param crys: crystal
+    :param chem: chemical index
+    :param ij: int_array[N][2] = (i,j)
+    :param R: int[N][dim]
+    :return gij: int_array[NG][N][2] = (gi, gj) for each group operation
+    :return gR: int[NG][N][dim]
+    """
+    basis = np.array(crys.basis[chem])
+    rot = np.array([g.rot for g in crys.G])
+    indexmap = np.array([g.indexmap[chem] for g in crys.G])
+    # lattice vector shift of each basis site under each group operation (as in Crystal.g_pos)
+    delu = np.round(np.einsum('gab,nb->gna', rot, basis) + np.array([g.trans for g in crys.G])[:, np.newaxis, :]
+                    - basis[indexmap]).astype(int)
+    gij = np.stack((indexmap[:, ij[:, 0]], indexmap[:, ij[:, 1]]), axis=-1)
+    gR = np.einsum('gab,nb->gna', rot, R) + delu[:, ij[:, 1]] - delu[:, ij[:, 0]]
+    return gij, gR
+
+
+def PSarrayorbitkeys(crys, chem, ij, R):
+    """
+    Canonical key for the symmetry orbit of each pair state, for pair states as arrays; see PSorbitkeys.
+
+    :param crys: crystal
+    :param chem: chemical index
+    :param ij: int_array[N][2] = (i,j)
+    :param R: int[N][dim]
+    :return keys: int64[N] keys
+    """
+    if len(ij) == 0: return np.zeros(0, dtype=np.int64)
+    gij, gR = PSarrayg(crys, chem, ij, R)
+    # encode each image (gi, gj, gR) as a single integer, and take the minimum over the group
+    Rmax = np.max(np.abs(gR))
+    keys = gij[:, :, 0] * len(crys.basis[chem]) + gij[:, :, 1]
+    for d in range(gR.shape[-1]):
+        keys = keys * (2 * Rmax + 1) + (gR[:, :, d] + Rmax)
+    return np.min(keys, axis=0)
+
+
 class StarSet(object):
     """
     A class to construct crystal stars, and be able to efficiently index.
@@ -277,11 +435,13 @@ class StarSet(object):
         """
         # jumpnetwork_index: list of lists of indices into jumplist; matches structure of jumpnetwork
         # jumplist: list of jumps, as pair states (i=initial state, j=final state)
-        # states: list of pair states, out to Nshells
+        # states_ij[Nstates,2], states_R[Nstates,dim], states_dx[Nstates,dim]: pair states, out to Nshells
+        # states: list of pair states (PairState view of the arrays)
         # Nstates: size of list
         # stars: list of lists of indices into states; each list are states equivalent by symmetry
         # Nstars: size of list
         # index[Nstates]: index of star that state belongs to
+        # statekeys[Nstates], keysort, keyindex: packed integer keys to look up states (generateindex)
 
         # empty StarSet
         if all(x is None for x in (jumpnetwork, crys, chem)): return
@@ -300,7 +460,7 @@ class StarSet(object):
                 self.jumplist.append(PS)
         self.crys = crys
         self.chem = chem
-        self.generate(Nshells, originstates)
+        self.generate(Nshells, originstates=originstates)
 
     def __str__(self):
         """Human readable version"""
@@ -323,72 +483,107 @@ class StarSet(object):
         """
         if Nshells == getattr(self, 'Nshells', -1): return
         self.Nshells = Nshells
+        clock = instrument.timer.stopwatch('StarSet.generate')
+        Nbasis, dim = len(self.crys.basis[self.chem]), self.crys.dim
+        statelist = []
         if Nshells > 0:
-            stateset = set(self.jumplist)
-        else:
-            stateset = set([])
-        lastshell = stateset.copy()
+            jump_ij, jump_R, jump_dx = PSlist2array(self.jumplist)
+            Rmax = Nshells * int(np.max(np.abs(jump_R)))
+            lastshell = (jump_ij, jump_R, jump_dx)
+            statelist.append(lastshell)
         if originstates:
-            for i in range(len(self.crys.basis[self.chem])):
-                stateset.add(PairState.zero(i, self.crys.dim))
+            statelist.append((np.column_stack((np.arange(Nbasis), np.arange(Nbasis))),
+                              np.zeros((Nbasis, dim), dtype=int), np.zeros((Nbasis, dim))))
         for i in range(Nshells - 1):
-            # add all NNvect to last shell produced, always excluding 0
-            # lastshell = [v1+v2 for v1 in lastshell for v2 in self.NNvect if not all(abs(v1 + v2) < threshold)]
-            nextshell = set([])
-            for s1 in lastshell:
-                for s2 in self.jumplist:
-                    # this try/except structure lets us attempt addition and kick out if not possible
-                    try:
-                        s = s1 + s2
-                    except:
-                        continue
-                    if not s.iszero():
-                        nextshell.add(s)
-                        stateset.add(s)
-            lastshell = nextshell
+            # add all jumps to last shell produced, always excluding 0
+            ij, R, dx = PSarrayadd(*(lastshell + (jump_ij, jump_R, jump_dx)))
+            nonzero = np.logical_not((ij[:, 0] == ij[:, 1]) & np.all(R == 0, axis=1))
+            ij, R, dx = ij[nonzero], R[nonzero], dx[nonzero]
+            lastshell = PSarrayunique(PSarraykeys(ij, R, Nbasis, Rmax), ij, R, dx)[1:]
+            statelist.append(lastshell)
+        clock.split('shells')
         # now to sort our set of vectors (easiest by magnitude, and then reduce down:
-        self.states = sorted([s for s in stateset], key=PairState.sortkey)
-        self.Nstates = len(self.states)
+        if len(statelist) > 0:
+            ij, R, dx = (np.concatenate(a) for a in zip(*statelist))
+            keys, ij, R, dx = PSarrayunique(PSarraykeys(ij, R, Nbasis, Rmax if Nshells > 0 else 0), ij, R, dx)
+            order = np.lexsort((keys, np.sum(dx * dx, axis=1)))
+            self.setstates(ij[order], R[order], dx[order])
+        else:
+            self.setstates(np.zeros((0, 2), dtype=int), np.zeros((0, dim), dtype=int), np.zeros((0, dim)))
+        clock.split('sort')
         if self.Nstates > 0:
-            x2_indices = []
-            x2old = np.dot(self.states[0].dx, self.states[0].dx)
-            for i, x2 in enumerate([np.dot(st.dx, st.dx) for st in self.states]):
-                if x2 > (x2old + threshold):
-                    x2_indices.append(i)
-                    x2old = x2
-            x2_indices.append(len(self.states))
-            # x2_indices now contains a list of indices with the same magnitudes
             self.stars = []
-            xmin = 0
-            for xmax in x2_indices:
-                complist_stars = []  # for finding unique stars
-                symmstate_list = []  # list of sets corresponding to those stars...
-                for xi in range(xmin, xmax):
-                    x = self.states[xi]
-                    # is this a new rep. for a unique star?
-                    match = False
-                    for i, gs in enumerate(symmstate_list):
-                        if x in gs:
-                            # update star
-                            complist_stars[i].append(xi)
-                            match = True
-                            continue
-                    if not match:
-                        # new symmetry point!
-                        complist_stars.append([xi])
-                        symmstate_list.append(set([x.g(self.crys, self.chem, g) for g in self.crys.G]))
-                self.stars += complist_stars
-                xmin = xmax
+            self.addstars(0, threshold)
         else:
             self.stars = [[]]
         self.Nstars = len(self.stars)
+        clock.split('stars')
         # generate index: which star is each state a member of?
+        self.generateindex()
+        clock.split('index')
+        clock.stop()
+
+    def setstates(self, ij, R, dx):
+        """
+        Set the states from arrays (the "structure of arrays" representation); also constructs the
+        list of PairStates, states.
+
+        :param ij: int_array[N][2] = (i,j)
+        :param R: int[N][dim]
+        :param dx: float[N][dim]
+        """
+        self.states_ij, self.states_R, self.states_dx = ij, R, dx
+        self.states = array2PSlist(ij, R, dx)
+        self.Nstates = len(self.states)
+
+    def addstars(self, Nold=0, threshold=1e-8):
+        """
+        Groups states[Nold:] (sorted by magnitude) into stars, which are appended to stars.
+        States are only compared within a shell of the same magnitude, and belong to the
+        same star if they have the same symmetry orbit key (PSorbitkeys); the stars are in order of
+        their first state.
+
+        :param Nold: index of the first state to group
+        :param threshold: threshold for determining equality of magnitudes
+        """
+        starindex, x2old = {}, None
+        x2list = np.sum(self.states_dx[Nold:] ** 2, axis=1).tolist()
+        keys = PSarrayorbitkeys(self.crys, self.chem, self.states_ij[Nold:], self.states_R[Nold:]).tolist()
+        for xi, x2, key in zip(range(Nold, self.Nstates), x2list, keys):
+            if x2old is None or x2 > (x2old + threshold):
+                # new shell
+                starindex, x2old = {}, x2
+            si = starindex.get(key)
+            if si is None:
+                # new symmetry point!
+                starindex[key] = len(self.stars)
+                self.stars.append([xi])
+            else:
+                self.stars[si].append(xi)
+
+    def generateindex(self):
+        """
+        Generate index (which star each state belongs to), and the keys (PSarraykeys) used to look up
+        states: statekeys[Nstates] in the order of states, keysort to sort them, and keyindex to map a
+        key back to the index of the state.
+        """
         self.index = np.zeros(self.Nstates, dtype=int)
-        self.indexdict = {}
         for si, star in enumerate(self.stars):
-            for xi in star:
-                self.index[xi] = si
-                self.indexdict[self.states[xi]] = (xi, si)
+            self.index[star] = si
+        self.Rmax = int(np.max(np.abs(self.states_R))) if self.Nstates > 0 else 0
+        self.statekeys = PSarraykeys(self.states_ij, self.states_R, len(self.crys.basis[self.chem]), self.Rmax)
+        self.keysort = np.argsort(self.statekeys)
+        self.keyindex = dict(zip(self.statekeys.tolist(), range(self.Nstates)))
+
+    def statekey(self, PS):
+        """Key (PSarraykeys) for a single pair state PS; None if PS cannot be in our states"""
+        Nbasis = len(self.crys.basis[self.chem])
+        if not (0 <= PS.i < Nbasis and 0 <= PS.j < Nbasis) or len(PS.R) != self.crys.dim: return None
+        key, Rrange = PS.i * Nbasis + PS.j, 2 * self.Rmax + 1
+        for R in PS.R:
+            if abs(R) > self.Rmax: return None
+            key = key * Rrange + int(R) + self.Rmax
+        return key
 
     def addhdf5(self, HDF5group):
         """
@@ -411,9 +606,9 @@ class StarSet(object):
         for j, jlist in enumerate(self.jumpnetwork_index):
             for i in jlist: jumplistinvmap[i] = j
         HDF5group['jumplist_invmap'] = jumplistinvmap
-        # convert states into arrays to store:
+        # states are already stored as arrays:
         HDF5group['states_ij'], HDF5group['states_R'], HDF5group['states_dx'] = \
-            PSlist2array(self.states)
+            self.states_ij, self.states_R, self.states_dx
         HDF5group['states_index'] = self.index
 
     @classmethod
@@ -435,18 +630,16 @@ class StarSet(object):
         SSet.jumpnetwork_index = [[] for n in range(HDF5group['jumplist_Nunique'].value)]
         for i, jump in enumerate(HDF5group['jumplist_invmap'].value):
             SSet.jumpnetwork_index[jump].append(i)
-        SSet.states = array2PSlist(HDF5group['states_ij'].value,
-                                   HDF5group['states_R'].value,
-                                   HDF5group['states_dx'].value)
-        SSet.Nstates = len(SSet.states)
-        SSet.index = HDF5group['states_index'].value
-        # construct the states, and the index dictionary:
-        SSet.Nstars = max(SSet.index) + 1
+        SSet.setstates(HDF5group['states_ij'].value,
+                       HDF5group['states_R'].value,
+                       HDF5group['states_dx'].value)
+        index = HDF5group['states_index'].value
+        # construct the stars, and the index:
+        SSet.Nstars = max(index) + 1
         SSet.stars = [[] for n in range(SSet.Nstars)]
-        SSet.indexdict = {}
-        for xi, si in enumerate(SSet.index):
+        for xi, si in enumerate(index):
             SSet.stars[si].append(xi)
-            SSet.indexdict[SSet.states[xi]] = (xi, si)
+        SSet.generateindex()
         return SSet
 
     def copy(self, empty=False):
@@ -457,17 +650,25 @@ class StarSet(object):
         newStarSet.crys = self.crys
         newStarSet.chem = self.chem
         if not empty:
-            newStarSet.Nshells = self.Nshells
-            newStarSet.stars = copy.deepcopy(self.stars)
-            newStarSet.states = self.states.copy()
-            newStarSet.Nstars = self.Nstars
-            newStarSet.Nstates = self.Nstates
-            newStarSet.index = self.index.copy()
-            newStarSet.indexdict = self.indexdict.copy()
+            newStarSet.copystates(self)
         else:
             newStarSet.generate(0)
         return newStarSet
 
+    def copystates(self, other):
+        """Copy the shells, states, stars, and index from another StarSet"""
+        self.Nshells = other.Nshells
+        self.stars = copy.deepcopy(other.stars)
+        self.states_ij, self.states_R, self.states_dx = \
+            other.states_ij.copy(), other.states_R.copy(), other.states_dx.copy()
+        self.states = other.states.copy()
+        self.Nstars = other.Nstars
+        self.Nstates = other.Nstates
+        self.index = other.index.copy()
+        self.Rmax = other.Rmax
+        self.statekeys, self.keysort = other.statekeys.copy(), other.keysort.copy()
+        self.keyindex = other.keyindex.copy()
+
     # removed combine; all it does is generate(s1.Nshells + s2.Nshells) with lots of checks...
     # replaced with (more efficient?) __add__ and __iadd__.
 
@@ -489,94 +690,88 @@ class StarSet(object):
         if self.chem != other.chem: return ArithmeticError('Cannot add different chemistry index')
         if other.Nshells < 1: return self
         if self.Nshells < 1:
-            self.Nshells = other.Nshells
-            self.stars = copy.deepcopy(other.stars)
-            self.states = other.states.copy()
-            self.Nstars = other.Nstars
-            self.Nstates = other.Nstates
-            self.index = other.index.copy()
-            self.indexdict = other.indexdict.copy()
+            self.copystates(other)
             return self
         self.Nshells += other.Nshells
         Nold = self.Nstates
-        oldstateset = set(self.states)
-        newstateset = set([])
-        for s1 in self.states[:Nold]:
-            for s2 in other.states:
-                # this try/except structure lets us attempt addition and kick out if not possible
-                try:
-                    s = s1 + s2
-                except:
-                    continue
-                if not s.iszero() and not s in oldstateset: newstateset.add(s)
+        Nbasis, Rmax = len(self.crys.basis[self.chem]), self.Rmax + other.Rmax
+        ij, R, dx = PSarrayadd(self.states_ij, self.states_R, self.states_dx,
+                               other.states_ij, other.states_R, other.states_dx)
+        keys = PSarraykeys(ij, R, Nbasis, Rmax)
+        new = np.logical_not((ij[:, 0] == ij[:, 1]) & np.all(R == 0, axis=1)) & \
+              np.logical_not(np.isin(keys, PSarraykeys(self.states_ij, self.states_R, Nbasis, Rmax)))
+        keys, ij, R, dx = PSarrayunique(keys[new], ij[new], R[new], dx[new])
         # now to sort our set of vectors (easiest by magnitude, and then reduce down:
-        self.states += sorted([s for s in newstateset], key=PairState.sortkey)
-        Nnew = len(self.states)
-        x2_indices = []
-        x2old = np.dot(self.states[Nold].dx, self.states[Nold].dx)
-        for i in range(Nold, Nnew):
-            x2 = np.dot(self.states[i].dx, self.states[i].dx)
-            if x2 > (x2old + threshold):
-                x2_indices.append(i)
-                x2old = x2
-        x2_indices.append(Nnew)
-        # x2_indices now contains a list of indices with the same magnitudes
-        xmin = Nold
-        for xmax in x2_indices:
-            complist_stars = []  # for finding unique stars
-            symmstate_list = []  # list of sets corresponding to those stars...
-            for xi in range(xmin, xmax):
-                x = self.states[xi]
-                # is this a new rep. for a unique star?
-                match = False
-                for i, gs in enumerate(symmstate_list):
-                    if x in gs:
-                        # update star
-                        complist_stars[i].append(xi)
-                        match = True
-                        continue
-                if not match:
-                    # new symmetry point!
-                    complist_stars.append([xi])
-                    symmstate_list.append(set([x.g(self.crys, self.chem, g) for g in self.crys.G]))
-            self.stars += complist_stars
-            xmin = xmax
-        self.Nstates = Nnew
+        order = np.lexsort((keys, np.sum(dx * dx, axis=1)))
+        self.setstates(np.concatenate((self.states_ij, ij[order])),
+                       np.concatenate((self.states_R, R[order])),
+                       np.concatenate((self.states_dx, dx[order])))
+        self.addstars(Nold, threshold)
+        self.Nstars = len(self.stars)
         # generate new index entries: which star is each state a member of?
-        self.index = np.pad(self.index, (0, Nnew - Nold), mode='constant')
-        Nold = self.Nstars
-        Nnew = len(self.stars)
-        for si in range(Nold, Nnew):
-            star = self.stars[si]
-            for xi in star:
-                self.index[xi] = si
-                self.indexdict[self.states[xi]] = (xi, si)
-        self.Nstars = Nnew
+        self.generateindex()
         return self
 
+    @property
+    def indexdict(self):
+        """
+        Deprecated: dictionary mapping each PairState to (state index, star index); use
+        stateindex() and starindex() instead. Built on first access from the state keys, and
+        rebuilt only if the states change.
+        """
+        warnings.warn('StarSet.indexdict is deprecated; use stateindex() and starindex()',
+                      DeprecationWarning, stacklevel=2)
+        cached = getattr(self, '_indexdict', None)
+        if cached is None or cached[0] is not self.statekeys:
+            indexdict = {self.states[xi]: (xi, int(self.index[xi])) for xi in self.keyindex.values()}
+            self._indexdict = cached = (self.statekeys, indexdict)
+        return cached[1]
+
     def __contains__(self, PS):
         """Return true if PS is in the star"""
-        return PS in self.indexdict
+        return self.stateindex(PS) is not None
 
     # replaces pointindex:
     def stateindex(self, PS):
-        """Return the index of pair state PS; None if not found"""
-        try:
-            return self.indexdict[PS][0]
-        except:
-            return None
+        """
+        Return the index of pair state PS; None if not found. Also takes a tuple of arrays
+        (ij[N,2], R[N,dim]) of pair states, and returns an int array[N] of indices, with -1 if not found.
+        """
+        if isinstance(PS, PairState):
+            return self.keyindex.get(self.statekey(PS))
+        ij, R = PS
+        keys = PSarraykeys(ij, R, len(self.crys.basis[self.chem]), self.Rmax)
+        if self.Nstates == 0: return np.full(len(keys), -1, dtype=int)
+        pos = self.keysort[np.minimum(np.searchsorted(self.statekeys, keys, sorter=self.keysort),
+                                      self.Nstates - 1)]
+        return np.where((keys >= 0) & (self.statekeys[pos] == keys), pos, -1)
 
     def starindex(self, PS):
-        """Return the index for the star to which pair state PS belongs; None if not found"""
-        try:
-            return self.indexdict[PS][1]
-        except:
-            return None
+        """
+        Return the index for the star to which pair state PS belongs; None if not found. Also takes a tuple
+        of arrays (ij[N,2], R[N,dim]) of pair states, and returns an int array[N] of indices, with -1 if not found.
+        """
+        xi = self.stateindex(PS)
+        if xi is None: return None
+        if isinstance(PS, PairState): return self.index[xi]
+        found = xi >= 0
+        si = np.full(len(xi), -1, dtype=int)
+        si[found] = self.index[xi[found]]
+        return si
 
     def symmatch(self, PS1, PS2):
         """True if there exists a group operation that makes PS1 == PS2."""
         return any(PS1 == PS2.g(self.crys, self.chem, g) for g in self.crys.G)
 
+    def stategroupindex(self):
+        """
+        Index of the image of each state under each group operation (in the order of crys.G).
+
+        :return gstateindex: int_array[NG, Nstates]; -1 if the image is not one of our states
+        """
+        gij, gR = PSarrayg(self.crys, self.chem, self.states_ij, self.states_R)
+        return self.stateindex((gij.reshape(-1, 2), gR.reshape(-1, self.crys.dim))).reshape(gij.shape[:2])
+
     # replaces DoubleStarSet
     def jumpnetwork_omega1(self):
         """
@@ -595,22 +790,23 @@ class StarSet(object):
         jumpnetwork = []
         jumptype = []
         starpair = []
+        jumpset = set()  # (i, f) pairs of every jump already in jumpnetwork
+        gstateindex = self.stategroupindex()
+        nonzero = np.logical_not((self.states_ij[:, 0] == self.states_ij[:, 1]) & np.all(self.states_R == 0, axis=1))
         for jt, jumpindices in enumerate(self.jumpnetwork_index):
             for jump in [self.jumplist[j] for j in jumpindices]:
-                for i, PSi in enumerate(self.states):
-                    if PSi.iszero(): continue
-                    # attempt to add...
-                    try:
-                        PSf = PSi + jump
-                    except:
-                        continue
-                    if PSf.iszero(): continue
-                    f = self.stateindex(PSf)
-                    if f is None: continue  # outside our StarSet
+                # every (nonzero) PSi where PSf = PSi + jump is defined; keep the nonzero PSf in our StarSet
+                ilist = np.nonzero(nonzero & (self.states_ij[:, 1] == jump.i))[0]
+                fij = np.column_stack((self.states_ij[ilist, 0], np.full(len(ilist), jump.j, dtype=int)))
+                fR = self.states_R[ilist] + jump.R
+                flist = self.stateindex((fij, fR))
+                keep = (flist >= 0) & ((fij[:, 0] != fij[:, 1]) | np.any(fR != 0, axis=1))
+                for i, f in zip(ilist[keep].tolist(), flist[keep].tolist()):
                     # see if we've already generated this jump (works since all of our states are distinct)
-                    if any(any(i == i0 and f == f0 for (i0, f0), dx in jlist) for jlist in jumpnetwork): continue
-                    dx = PSf.dx - PSi.dx
-                    jumpnetwork.append(self.symmequivjumplist(i, f, dx))
+                    if (i, f) in jumpset: continue
+                    dx = (self.states_dx[i] + jump.dx) - self.states_dx[i]
+                    jumpnetwork.append(self.symmequivjumplist(i, f, dx, gstateindex))
+                    jumpset.update(ij for ij, dx in jumpnetwork[-1])
                     jumptype.append(jt)
                     starpair.append((self.index[i], self.index[f]))
         return jumpnetwork, jumptype, starpair
@@ -632,45 +828,54 @@ class StarSet(object):
         jumpnetwork = []
         jumptype = []
         starpair = []
+        jumpset = set()  # (i, f) pairs of every jump already in jumpnetwork
+        gstateindex = self.stategroupindex()
+        nonzero = np.logical_not((self.states_ij[:, 0] == self.states_ij[:, 1]) & np.all(self.states_R == 0, axis=1))
         for jt, jumpindices in enumerate(self.jumpnetwork_index):
             for jump in [self.jumplist[j] for j in jumpindices]:
-                for i, PSi in enumerate(self.states):
-                    if PSi.iszero(): continue
-                    # attempt to add...
-                    try:
-                        PSf = PSi + jump
-                    except:
-                        continue
-                    if not PSf.iszero(): continue
-                    f = self.stateindex(-PSi)  # exchange
+                # every (nonzero) PSi where PSi + jump is zero; the final state is -PSi (exchange)
+                ilist = np.nonzero(nonzero & (self.states_ij[:, 1] == jump.i) & (self.states_ij[:, 0] == jump.j) &
+                                   np.all(self.states_R + jump.R == 0, axis=1))[0]
+                flist = self.stateindex((self.states_ij[ilist, ::-1], -self.states_R[ilist]))
+                for i, f in zip(ilist.tolist(), flist.tolist()):
+                    if f < 0: continue  # outside our StarSet
                     # see if we've already generated this jump (works since all of our states are distinct)
-                    if any(any(i == i0 and f == f0 for (i0, f0), dx in jlist) for jlist in jumpnetwork): continue
-                    dx = -PSi.dx  # the vacancy jumps into the solute position (exchange)
-                    jumpnetwork.append(self.symmequivjumplist(i, f, dx))
+                    if (i, f) in jumpset: continue
+                    dx = -self.states_dx[i]  # the vacancy jumps into the solute position (exchange)
+                    jumpnetwork.append(self.symmequivjumplist(i, f, dx, gstateindex))
+                    jumpset.update(ij for ij, dx in jumpnetwork[-1])
                     jumptype.append(jt)
                     starpair.append((self.index[i], self.index[f]))
         return jumpnetwork, jumptype, starpair
 
-    def symmequivjumplist(self, i, f, dx):
+    def symmequivjumplist(self, i, f, dx, gstateindex=None):
         """
         Returns a list of tuples of symmetry equivalent jumps
 
         :param i: index of initial state
         :param f: index of final state
         :param dx: displacement vector
+        :param gstateindex: (optional) output of stategroupindex(), if already computed
         :return symmjumplist: list of tuples of ((gi, gf), gdx) for every group op
         """
-        PSi = self.states[i]
-        PSf = self.states[f]
+        if gstateindex is None:
+            gij, gR = PSarrayg(self.crys, self.chem, self.states_ij[[i, f]], self.states_R[[i, f]])
+            gstateindex = np.full((len(gij), self.Nstates), -1, dtype=int)
+            gstateindex[:, [i, f]] = self.stateindex((gij.reshape(-1, 2),
+                                                      gR.reshape(-1, self.crys.dim))).reshape(gij.shape[:2])
         symmjumplist = [((i, f), dx)]
         if i != f: symmjumplist.append(((f, i), -dx))  # i should not equal f... but in case we allow 0 as a jump
-        for g in self.crys.G:
-            gi, gf, gdx = self.stateindex(PSi.g(self.crys, self.chem, g)), \
-                          self.stateindex(PSf.g(self.crys, self.chem, g)), \
-                          self.crys.g_direc(g, dx)
-            if not any(gi == i0 and gf == f0 for (i0, f0), dx in symmjumplist):
+        symmjumpset = set(ij for ij, dx in symmjumplist)
+        for g, gi, gf in zip(self.crys.G, gstateindex[:, i].tolist(), gstateindex[:, f].tolist()):
+            if gi < 0: gi = None
+            if gf < 0: gf = None
+            if (gi, gf) not in symmjumpset:
+                gdx = self.crys.g_direc(g, dx)
                 symmjumplist.append(((gi, gf), gdx))
-                if gi != gf: symmjumplist.append(((gf, gi), -gdx))
+                symmjumpset.add((gi, gf))
+                if gi != gf:
+                    symmjumplist.append(((gf, gi), -gdx))
+                    symmjumpset.add((gf, gi))
         return symmjumplist
 
     def diffgenerate(self, S1, S2, threshold=1e-8):
@@ -684,68 +889,188 @@ class StarSet(object):
         """
         if S1.Nshells < 1 or S2.Nshells < 1: raise ValueError('Need to initialize stars')
         self.Nshells = S1.Nshells + S2.Nshells  # an estimate...
-        stateset = set([])
-        # self.states = []
-        for s1 in S1.states:
-            for s2 in S2.states:
-                # this try/except structure lets us attempt addition and kick out if not possible
-                try:
-                    s = s2 ^ s1  # points from vacancy state of s1 to vacancy state of s2
-                except:
-                    continue
-                stateset.add(s)
+        Nbasis, Rmax = len(self.crys.basis[self.chem]), S1.Rmax + S2.Rmax
+        # points from vacancy state of s1 to vacancy state of s2; done in blocks of S1 to limit memory
+        statelist = []
+        Nblock = max(1, 2 ** 20 // max(1, S2.Nstates))
+        for n in range(0, S1.Nstates, Nblock):
+            ij, R, dx = PSarrayxor(S2.states_ij, S2.states_R, S2.states_dx,
+                                   S1.states_ij[n:n + Nblock], S1.states_R[n:n + Nblock], S1.states_dx[n:n + Nblock])
+            statelist.append(PSarrayunique(PSarraykeys(ij, R, Nbasis, Rmax), ij, R, dx))
+        keys, ij, R, dx = PSarrayunique(*(np.concatenate(a) for a in zip(*statelist)))
         # now to sort our set of vectors (easiest by magnitude, and then reduce down:
-        self.states = sorted([s for s in stateset], key=PairState.sortkey)
-        self.Nstates = len(self.states)
+        order = np.lexsort((keys, np.sum(dx * dx, axis=1)))
+        self.setstates(ij[order], R[order], dx[order])
         if self.Nstates > 0:
-            x2_indices = []
-            x2old = np.dot(self.states[0].dx, self.states[0].dx)
-            for i, x2 in enumerate([np.dot(st.dx, st.dx) for st in self.states]):
-                if x2 > (x2old + threshold):
-                    x2_indices.append(i)
-                    x2old = x2
-            x2_indices.append(len(self.states))
-            # x2_indices now contains a list of indices with the same magnitudes
             self.stars = []
-            xmin = 0
-            for xmax in x2_indices:
-                complist_stars = []  # for finding unique stars
-                symmstate_list = []  # list of sets corresponding to those stars...
-                for xi in range(xmin, xmax):
-                    x = self.states[xi]
-                    # is this a new rep. for a unique star?
-                    match = False
-                    for i, gs in enumerate(symmstate_list):
-                        if x in gs:
-                            # update star
-                            complist_stars[i].append(xi)
-                            match = True
-                            continue
-                    if not match:
-                        # new symmetry point!
-                        complist_stars.append([xi])
-                        symmstate_list.append(set([x.g(self.crys, self.chem, g) for g in self.crys.G]))
-                self.stars += complist_stars
-                xmin = xmax
+            self.addstars(0, threshold)
         else:
             self.stars = [[]]
         self.Nstars = len(self.stars)
         # generate index: which star is each state a member of?
-        self.index = np.zeros(self.Nstates, dtype=int)
-        self.indexdict = {}
-        for si, star in enumerate(self.stars):
-            for xi in star:
-                self.index[xi] = si
-                self.indexdict[self.states[xi]] = (xi, si)
+        self.generateindex()
 
 
 def zeroclean(x, threshold=1e-8):
     """Modify x in place, return 0 if x is below a threshold; useful for "symmetrizing" our expansions"""
-    for v in np.nditer(x, op_flags=['readwrite']):
-        if abs(v) < threshold: v[...] = 0
+    x[np.abs(x) < threshold] = 0
     return x
 
 
+def sumentries(shape, entries, sparse=False, threshold=1e-8):
+    """
+    Sum a list of (index, values) entries into an array of zeros, in order, as np.add.at does;
+    cleaned with zeroclean.
+
+    :param shape: shape of array
+    :param entries: list of (index, values) where index is a tuple of int_array[N], one for
+        each axis, and values is array[N]
+    :param sparse: return a SparseArray instead of a dense array?
+    :param threshold: sums with abs value below threshold are set to 0
+    :return array: array[shape], or SparseArray
+    """
+    if sparse:
+        index = tuple(np.concatenate([index[n] for index, values in entries] + [np.zeros(0, dtype=int)])
+                      for n in range(len(shape)))
+        values = np.concatenate([values for index, values in entries] + [np.zeros(0)])
+        return SparseArray.fromentries(shape, index, values, threshold)
+    array = np.zeros(shape)
+    for index, values in entries:
+        np.add.at(array, index, values)
+    return zeroclean(array, threshold)
+
+
+class SparseArray(object):
+    """
+    Sparse storage of an array that is mostly zero, such as the GF and rate expansions
+    (array[Nsv, Nsv, K]) or the outer products of vector stars (array[dim, dim, Nsv, Nsv],
+    which is block diagonal by star). Stored as a CSR matrix with one row for each combination
+    of leading indices and one column for each value of the last index, so that memory and
+    products over the last index scale with the number of non-zero entries.
+    """
+
+    def __init__(self, array=None):
+        """
+        Sparse version of a dense array.
+
+        :param array: array to store; if None, we return an empty object to be filled in
+        """
+        if array is None: return
+        array = np.asarray(array, dtype=float)
+        self.shape = array.shape
+        self.csr = scipy.sparse.csr_matrix(array.reshape((-1, self.shape[-1])))
+
+    @classmethod
+    def fromentries(cls, shape, index, values, threshold=1e-8):
+        """
+        Sparse array from a list of entries; repeated indices are summed in order.
+
+        :param shape: shape of the (dense) array
+        :param index: tuple of int_array[N], one for each axis
+        :param values: array[N] of values
+        :param threshold: sums with abs value below threshold are dropped (as in zeroclean)
+        :return SparseArray: new sparse array
+        """
+        sparse = cls()
+        sparse.shape = tuple(shape)
+        Nrows, Ncols = int(np.prod(shape[:-1], dtype=int)), shape[-1]
+        rows = np.ravel_multi_index(tuple(index[:-1]), shape[:-1]).astype(np.int64)
+        keys, inverse = np.unique(rows * Ncols + index[-1], return_inverse=True)
+        data = np.zeros(len(keys))
+        np.add.at(data, inverse, values)  # sums in the order given
+        keep = np.abs(data) >= threshold
+        keys, data = keys[keep], data[keep]
+        sparse.csr = scipy.sparse.csr_matrix((data, keys % max(Ncols, 1),
+                                              np.searchsorted(keys // max(Ncols, 1), np.arange(Nrows + 1))),
+                                             shape=(Nrows, Ncols))
+        return sparse
+
+    @property
+    def nnz(self):
+        """Number of stored (non-zero) entries"""
+        return self.csr.nnz
+
+    def toarray(self):
+        """
+        :return array: dense version of our array
+        """
+        return self.csr.toarray().reshape(self.shape)
+
+    def dot(self, v):
+        """
+        Product over the last index, the same as np.dot(array, v).
+
+        :param v: array[K] or array[K, M]
+        :return product: array[...] or array[..., M]
+        """
+        return self.csr.dot(v).reshape(self.shape[:-1] + np.shape(v)[1:])
+
+    def dotstack(self, w):
+        """
+        Product over the last index with a stack of vectors, the same as
+        np.tensordot(w, array, axes=(1, array.ndim - 1)).
+
+        :param w: array[N, K]
+        :return product: array[N, ...]
+        """
+        return np.moveaxis(self.dot(np.transpose(w)), -1, 0)
+
+    def block(self, indices):
+        """
+        Dense block of the array for a list of indices in the last two axes; for example, with
+        outer products, the same as outer[:, :, indices, :][:, :, :, indices].
+
+        :param indices: list of indices
+        :return block: array[..., Nindices, Nindices]
+        """
+        indices = np.asarray(indices, dtype=int)
+        rows = np.arange(int(np.prod(self.shape[:-1], dtype=int))).reshape(self.shape[:-1])[..., indices]
+        return self.csr[rows.flatten(), :][:, indices].toarray().reshape(rows.shape + (len(indices),))
+
+    def nonzeroindices(self, atol=1e-8):
+        """
+        Indices of the first axis for which the array is not (close to) zero; for example, with
+        the omega2 expansion, the vector stars with omega2 contributions.
+
+        :param atol: absolute tolerance for zero
+        :return indices: int_array of indices
+        """
+        rows = np.repeat(np.arange(self.csr.shape[0]), np.diff(self.csr.indptr))
+        return np.unique(rows[np.abs(self.csr.data) > atol] // int(np.prod(self.shape[1:-1], dtype=int)))
+
+    def addhdf5(self, HDF5group):
+        """
+        Adds an HDF5 representation of object into an HDF5group (needs to already exist).
+
+        Example: if f is an open HDF5, then SparseArray.addhdf5(f.create_group('GFexpansion')) will
+          (1) create the group named 'GFexpansion', and then (2) put the SparseArray
+          representation in that group.
+
+        :param HDF5group: HDF5 group
+        """
+        HDF5group.attrs['type'] = self.__class__.__name__
+        HDF5group['shape'] = np.array(self.shape, dtype=int)
+        for name, value in (('data', self.csr.data), ('indices', self.csr.indices), ('indptr', self.csr.indptr)):
+            HDF5group.create_dataset(name, data=value, compression='gzip', shuffle=True)
+
+    @classmethod
+    def loadhdf5(cls, HDF5obj):
+        """
+        Creates a new SparseArray from an HDF5 group; a dense array dataset is also accepted.
+
+        :param HDF5obj: HDF5 group (or dataset)
+        :return SparseArray: new SparseArray object
+        """
+        if HDF5obj.attrs.get('type') != cls.__name__:
+            return cls(HDF5obj.value)
+        sparse = cls()
+        sparse.shape = tuple(HDF5obj['shape'].value)
+        sparse.csr = scipy.sparse.csr_matrix((HDF5obj['data'].value, HDF5obj['indices'].value,
+                                              HDF5obj['indptr'].value),
+                                             shape=(int(np.prod(sparse.shape[:-1], dtype=int)), sparse.shape[-1]))
+        return sparse
+
+
 class VectorStarSet(object):
     """
     A class to construct vector star sets, and be able to efficiently index.
@@ -762,9 +1087,12 @@ class VectorStarSet(object):
         # vecpos: list of "positions" (state indices) for each vector star (list of lists)
         # vecvec: list of vectors for each vector star (list of lists of vectors)
         # Nvstars: number of vector stars
+        # incidence: cached stateincidence() table
 
         self.starset = None
         self.Nvstars = 0
+        self.incidence = None
+        self._outer = None
         if starset is not None:
             if starset.Nshells > 0:
                 self.generate(starset)
@@ -778,6 +1106,8 @@ class VectorStarSet(object):
         if starset.Nshells == 0: return
         if starset == self.starset: return
         self.starset = starset
+        self.incidence = None
+        self._outer = None
         dim = starset.crys.dim
         self.vecpos = []
         self.vecvec = []
@@ -871,23 +1201,37 @@ class VectorStarSet(object):
                                     break
                         self.vecvec.append(veclist)
         self.Nvstars = len(self.vecpos)
-        self.outer = self.generateouter()
+        self.sparseouter = self.generateouter()
 
     def generateouter(self):
         """
-        Generate our outer products for our star-vectors.
+        Generate our outer products for our star-vectors, directly in sparse form: only pairs
+        of vector-stars built on the same star (that is, sharing states) have a non-zero outer
+        product, so we sum over the pairs of incidence entries for each state.
 
-        :return outer: array [3, 3, Nvstars, Nvstars]
+        :return sparseouter: SparseArray [3, 3, Nvstars, Nvstars]
             outer[:, :, i, j] is the 3x3 tensor outer product for two vector-stars vs[i] and vs[j]
         """
-        # dim = len(self.vecvec[0][0])
         dim = self.starset.crys.dim
-        outer = np.zeros((dim, dim, self.Nvstars, self.Nvstars))
-        for i, sR0, sv0 in zip(itertools.count(), self.vecpos, self.vecvec):
-            for j, sR1, sv1 in zip(itertools.count(), self.vecpos, self.vecvec):
-                if sR0[0] == sR1[0]:
-                    outer[:, :, i, j] = sum([np.outer(v0, v1) for v0, v1 in zip(sv0, sv1)])
-        return zeroclean(outer)
+        ptr, vstar, vvec = self.stateincidence()
+        states = np.arange(self.starset.Nstates)
+        n, a, b = self.incidencepairs(states, states)
+        Npairs = len(n)
+        x, y = (np.broadcast_to(xy[np.newaxis, :, :], (Npairs, dim, dim)).flatten()
+                for xy in np.meshgrid(np.arange(dim), np.arange(dim), indexing='ij'))
+        i, j = (np.repeat(vstar[ab], dim * dim) for ab in (a, b))
+        values = (vvec[a][:, :, np.newaxis] * vvec[b][:, np.newaxis, :]).flatten()
+        return SparseArray.fromentries((dim, dim, self.Nvstars, self.Nvstars), (x, y, i, j), values)
+
+    @property
+    def outer(self):
+        """
+        Dense outer products of our star-vectors, array [3, 3, Nvstars, Nvstars]; made from
+        sparseouter on first use.
+        """
+        if self._outer is None:
+            self._outer = self.sparseouter.toarray()
+        return self._outer
 
     def addhdf5(self, HDF5group):
         """
@@ -903,7 +1247,7 @@ class VectorStarSet(object):
         HDF5group['Nvstars'] = self.Nvstars
         HDF5group['vecposlist'], HDF5group['vecposindex'] = doublelist2flatlistindex(self.vecpos)
         HDF5group['vecveclist'], HDF5group['vecvecindex'] = doublelist2flatlistindex(self.vecvec)
-        HDF5group['outer'] = self.outer
+        self.sparseouter.addhdf5(HDF5group.create_group('outer'))
 
     @classmethod
     def loadhdf5(cls, SSet, HDF5group):
@@ -921,14 +1265,15 @@ class VectorStarSet(object):
                                                 HDF5group['vecposindex'].value)
         VSSet.vecvec = flatlistindex2doublelist(HDF5group['vecveclist'].value,
                                                 HDF5group['vecvecindex'].value)
-        VSSet.outer = HDF5group['outer'].value
+        VSSet.sparseouter = SparseArray.loadhdf5(HDF5group['outer'])
         return VSSet
 
-    def GFexpansion(self):
+    def GFexpansion(self, sparse=False):
         """
         Construct the GF matrix expansion in terms of the star vectors, and indexed
         to GFstarset.
 
+        :param sparse: (optional) return GFexpansion as a SparseArray? (default=False)
         :return GFexpansion: array[Nsv, Nsv, NGFstars]
             the GF matrix[i, j] = sum(GFexpansion[i, j, k] * GF(starGF[k]))
         :return GFstarset: starSet corresponding to the GF
@@ -937,26 +1282,101 @@ class VectorStarSet(object):
             return None
         GFstarset = self.starset.copy(empty=True)
         GFstarset.diffgenerate(self.starset, self.starset)
-        GFexpansion = np.zeros((self.Nvstars, self.Nvstars, GFstarset.Nstars))
-        for i in range(self.Nvstars):
-            for si, vi in zip(self.vecpos[i], self.vecvec[i]):
-                for j in range(i, self.Nvstars):
-                    for sj, vj in zip(self.vecpos[j], self.vecvec[j]):
-                        try:
-                            ds = self.starset.states[sj] ^ self.starset.states[si]
-                        except:
-                            continue
-                        k = GFstarset.starindex(ds)
-                        if k is None: raise ArithmeticError('GF star not large enough to include {}?'.format(ds))
-                        GFexpansion[i, j, k] += np.dot(vi, vj)
+        shape = (self.Nvstars, self.Nvstars, GFstarset.Nstars)
+        states_ij, states_R, Nstates = self.starset.states_ij, self.starset.states_R, self.starset.Nstates
+        # flatten our vector stars: vector star index, state index, and vector for each entry
+        vstar, vstate, vvec = self.flatvectors()
+        vinit = states_ij[vstate, 0]
+        # all pairs of entries (a, b) for vector stars i <= j and the same initial state, in blocks of a
+        Nentries = len(vstar)
+        Nblock = max(1, 2 ** 22 // Nentries)
+        GFentries = []
+        for a0 in range(0, Nentries, Nblock):
+            a, b = np.nonzero((vstar[a0:a0 + Nblock, np.newaxis] <= vstar[np.newaxis, :]) &
+                              (vinit[a0:a0 + Nblock, np.newaxis] == vinit[np.newaxis, :]))
+            a += a0
+            # GF star for each distinct pair of states (si, sj) in the block: ds = states[sj] ^ states[si]
+            pairkeys, pairinv = np.unique(vstate[a] * Nstates + vstate[b], return_inverse=True)
+            si, sj = pairkeys // Nstates, pairkeys % Nstates
+            k = GFstarset.starindex((np.column_stack((states_ij[si, 1], states_ij[sj, 1])),
+                                     states_R[sj] - states_R[si]))[pairinv]
+            if np.any(k < 0):
+                n = np.argmax(k < 0)
+                raise ArithmeticError('GF star not large enough to include {}?'.format(
+                    self.starset.states[vstate[b[n]]] ^ self.starset.states[vstate[a[n]]]))
+            GFentries.append(((vstar[a], vstar[b], k), np.sum(vvec[a] * vvec[b], axis=1)))
+        if sparse:
+            # symmetrize: the transposed entries, summed in the same order
+            GFentries += [((j[i < j], i[i < j], k[i < j]), vv[i < j]) for (i, j, k), vv in GFentries]
+            return sumentries(shape, GFentries, sparse=True), GFstarset
+        # np.add.at accumulates in order, same as looping over i, si, j, sj
+        GFexpansion = np.zeros(shape)
+        for index, vv in GFentries:
+            np.add.at(GFexpansion, index, vv)
         # symmetrize
-        for i in range(self.Nvstars):
-            for j in range(0, i):
-                GFexpansion[i, j, :] = GFexpansion[j, i, :]
+        i, j = np.tril_indices(self.Nvstars, -1)
+        GFexpansion[i, j, :] = GFexpansion[j, i, :]
         # cleanup on return:
         return zeroclean(GFexpansion), GFstarset
 
-    def rateexpansions(self, jumpnetwork, jumptype, omega2=False):
+    def flatvectors(self):
+        """
+        Flattened arrays of our vector stars, in order of vector star and then state.
+
+        :return vstar: int_array[Nentries] index of vector star
+        :return vstate: int_array[Nentries] index of state
+        :return vvec: array[Nentries, dim] vector
+        """
+        vstar = np.array([i for i, vpos in enumerate(self.vecpos) for s in vpos], dtype=int)
+        vstate = np.array([s for vpos in self.vecpos for s in vpos], dtype=int)
+        vvec = np.array([v for vvec in self.vecvec for v in vvec]).reshape((len(vstar), self.starset.crys.dim))
+        return vstar, vstate, vvec
+
+    def stateincidence(self):
+        """
+        Incidence table of the states in our vector stars: for each state, the (vector star, vector)
+        entries that include it, in order of vector star. Computed once and cached, so that the
+        expansions can be regenerated (e.g., after pruning a jumpnetwork) without recomputing it.
+
+        :return ptr: int_array[Nstates+1]; the entries for state s are ptr[s]:ptr[s+1]
+        :return vstar: int_array[Nentries] index of vector star for each entry
+        :return vvec: array[Nentries, dim] vector for each entry
+        """
+        if self.incidence is None:
+            vstar, vstate, vvec = self.flatvectors()
+            order = np.argsort(vstate, kind='mergesort')
+            ptr = np.searchsorted(vstate[order], np.arange(self.starset.Nstates + 1))
+            self.incidence = ptr, vstar[order], vvec[order]
+        return self.incidence
+
+    def incidencepairs(self, IS, FS):
+        """
+        All pairs of incidence entries for states IS[n] and FS[n], in order of n, then entry for IS,
+        then entry for FS.
+
+        :param IS: int_array[N] initial states
+        :param FS: int_array[N] final states
+        :return n: int_array[Npairs] index into IS and FS
+        :return a: int_array[Npairs] incidence entry for IS[n]
+        :return b: int_array[Npairs] incidence entry for FS[n]
+        """
+        ptr = self.stateincidence()[0]
+        n, a = raggedindex(ptr[IS], ptr[IS + 1] - ptr[IS])
+        m, b = raggedindex(ptr[FS[n]], ptr[FS[n] + 1] - ptr[FS[n]])
+        return n[m], a[m], b
+
+    def originstateindex(self, IS):
+        """
+        Index of the origin state (PairState.zero) at the solute position of each state in IS
+
+        :param IS: int_array[N] states
+        :return OS: int_array[N] index of origin state; -1 if not in our starset
+        """
+        i = self.starset.states_ij[IS, 0]
+        return self.starset.stateindex((np.column_stack((i, i)),
+                                        np.zeros((len(i), self.starset.crys.dim), dtype=int)))
+
+    def rateexpansions(self, jumpnetwork, jumptype, omega2=False, sparse=False):
         """
         Construct the omega0 and omega1 matrix expansions in terms of the jumpnetwork;
         includes the escape terms separately. The escape terms are tricky because they have
@@ -974,6 +1394,7 @@ class VectorStarSet(object):
         :param jumptype: specific omega0 jump type that the jump corresponds to
         :param omega2: (optional) are we dealing with the omega2 list, so we need to remove
             origin states? (default=False)
+        :param sparse: (optional) return rate0expansion and rate1expansion as SparseArrays? (default=False)
         :return rate0expansion: array[Nsv, Nsv, Njump_omega0]
             the omega0 matrix[i, j] = sum(rate0expansion[i, j, k] * omega0[k]); *IF* NVB>0
             we "hijack" this and use it for [NVB, Nsv, Njump_omega0], as we're doing an omega2
@@ -986,37 +1407,35 @@ class VectorStarSet(object):
             the escape contributions: omega1[i,i] += sum(rate1escape[i,k]*omega1[k]*probfactor(PS[k]))
         """
         if self.Nvstars == 0: return None
-        rate0expansion = np.zeros((self.Nvstars, self.Nvstars, len(self.starset.jumpnetwork_index)))
-        rate1expansion = np.zeros((self.Nvstars, self.Nvstars, len(jumpnetwork)))
+        rate0entries, rate1entries = [], []
         rate0escape = np.zeros((self.Nvstars, len(self.starset.jumpnetwork_index)))
         rate1escape = np.zeros((self.Nvstars, len(jumpnetwork)))
-        for k, jumplist, jt in zip(itertools.count(), jumpnetwork, jumptype):
-            for (IS, FS), dx in jumplist:
-                for i in range(self.Nvstars):
-                    for Ri, vi in zip(self.vecpos[i], self.vecvec[i]):
-                        if Ri == IS:
-                            rate0escape[i, jt] -= np.dot(vi, vi)
-                            rate1escape[i, k] -= np.dot(vi, vi)
-                            # for j in range(i+1):
-                            for j in range(self.Nvstars):
-                                for Rj, vj in zip(self.vecpos[j], self.vecvec[j]):
-                                    if Rj == FS:
-                                        if not omega2: rate0expansion[i, j, jt] += np.dot(vi, vj)
-                                        rate1expansion[i, j, k] += np.dot(vi, vj)
-                            if omega2:
-                                # find the "origin state" corresponding to the solute; "remove" those rates
-                                OSindex = self.starset.stateindex(PairState.zero(self.starset.states[IS].i,
-                                                                                 self.starset.crys.dim))
-                                if OSindex is not None:
-                                    for j in range(self.Nvstars):
-                                        for Rj, vj in zip(self.vecpos[j], self.vecvec[j]):
-                                            if Rj == OSindex:
-                                                rate0expansion[i, j, jt] += np.dot(vi, vj)
-                                                rate0expansion[j, i, jt] += np.dot(vi, vj)
-                                                rate0escape[j, jt] -= np.dot(vj, vj)
+        k, jt, IS, FS, dx = jumpnetwork2arrays(jumpnetwork, jumptype, self.starset.crys.dim)
+        ptr, vstar, vvec = self.stateincidence()
+        # escapes: every vector star entry for IS
+        n, a = raggedindex(ptr[IS], ptr[IS + 1] - ptr[IS])
+        vv = np.sum(vvec[a] * vvec[a], axis=1)
+        np.add.at(rate0escape, (vstar[a], jt[n]), -vv)
+        np.add.at(rate1escape, (vstar[a], k[n]), -vv)
+        # transitions: every pair of vector star entries for IS and FS
+        n, a, b = self.incidencepairs(IS, FS)
+        vv = np.sum(vvec[a] * vvec[b], axis=1)
+        if not omega2: rate0entries.append(((vstar[a], vstar[b], jt[n]), vv))
+        rate1entries.append(((vstar[a], vstar[b], k[n]), vv))
+        if omega2:
+            # find the "origin state" corresponding to the solute; "remove" those rates
+            OS = self.originstateindex(IS)
+            jumps = np.nonzero(OS >= 0)[0]
+            n, a, b = self.incidencepairs(IS[jumps], OS[jumps])
+            vv = np.sum(vvec[a] * vvec[b], axis=1)
+            rate0entries.append(((vstar[a], vstar[b], jt[jumps[n]]), vv))
+            rate0entries.append(((vstar[b], vstar[a], jt[jumps[n]]), vv))
+            np.add.at(rate0escape, (vstar[b], jt[jumps[n]]), -np.sum(vvec[b] * vvec[b], axis=1))
         # cleanup on return
-        return zeroclean(rate0expansion), zeroclean(rate0escape), \
-               zeroclean(rate1expansion), zeroclean(rate1escape)
+        return sumentries((self.Nvstars, self.Nvstars, len(self.starset.jumpnetwork_index)), rate0entries,
+                          sparse), zeroclean(rate0escape), \
+               sumentries((self.Nvstars, self.Nvstars, len(jumpnetwork)), rate1entries, sparse), \
+               zeroclean(rate1escape)
 
     def biasexpansions(self, jumpnetwork, jumptype, omega2=False):
         """
@@ -1047,26 +1466,26 @@ class VectorStarSet(object):
         if self.Nvstars == 0: return None
         bias0expansion = np.zeros((self.Nvstars, len(self.starset.jumpnetwork_index)))
         bias1expansion = np.zeros((self.Nvstars, len(jumpnetwork)))
-
-        for k, jumplist, jt in zip(itertools.count(), jumpnetwork, jumptype):
-            for (IS, FS), dx in jumplist:
-                # run through the star-vectors; just use first as representative
-                for i, svR, svv in zip(itertools.count(), self.vecpos, self.vecvec):
-                    if svR[0] == IS:
-                        geom_bias = np.dot(svv[0], dx) * len(svR)
-                        bias1expansion[i, k] += geom_bias
-                        bias0expansion[i, jt] += geom_bias
-                if omega2:
-                    # find the "origin state" corresponding to the solute; incorporate the change in bias
-                    OSindex = self.starset.stateindex(PairState.zero(self.starset.states[IS].i,
-                                                                     self.starset.crys.dim))
-                    if OSindex is not None:
-                        for j in range(self.Nvstars):
-                            for Rj, vj in zip(self.vecpos[j], self.vecvec[j]):
-                                if Rj == OSindex:
-                                    geom_bias = -np.dot(vj, dx)
-                                    bias1expansion[j, k] += geom_bias  # do we need this??
-                                    bias0expansion[j, jt] += geom_bias
+        k, jt, IS, FS, dx = jumpnetwork2arrays(jumpnetwork, jumptype, self.starset.crys.dim)
+        # run through the star-vectors; just use first as representative
+        firststate = np.array([svR[0] for svR in self.vecpos], dtype=int)
+        order = np.argsort(firststate, kind='mergesort')
+        ptr = np.searchsorted(firststate[order], np.arange(self.starset.Nstates + 1))
+        n, a = raggedindex(ptr[IS], ptr[IS + 1] - ptr[IS])
+        i = order[a]
+        geom_bias = np.sum(np.array([svv[0] for svv in self.vecvec])[i] * dx[n], axis=1) * \
+                    np.array([len(svR) for svR in self.vecpos])[i]
+        np.add.at(bias1expansion, (i, k[n]), geom_bias)
+        np.add.at(bias0expansion, (i, jt[n]), geom_bias)
+        if omega2:
+            # find the "origin state" corresponding to the solute; incorporate the change in bias
+            ptr, vstar, vvec = self.stateincidence()
+            OS = self.originstateindex(IS)
+            jumps = np.nonzero(OS >= 0)[0]
+            n, b = raggedindex(ptr[OS[jumps]], ptr[OS[jumps] + 1] - ptr[OS[jumps]])
+            geom_bias = -np.sum(vvec[b] * dx[jumps[n]], axis=1)
+            np.add.at(bias1expansion, (vstar[b], k[jumps[n]]), geom_bias)  # do we need this??
+            np.add.at(bias0expansion, (vstar[b], jt[jumps[n]]), geom_bias)
 
         # cleanup on return
         return zeroclean(bias0expansion), zeroclean(bias1expansion)
@@ -1101,10 +1520,11 @@ class VectorStarSet(object):
         dim = self.starset.crys.dim
         D0expansion = np.zeros((dim, dim, len(self.starset.jumpnetwork_index)))
         D1expansion = np.zeros((dim, dim, len(jumpnetwork)))
-        for k, jt, jumplist in zip(itertools.count(), jumptype, jumpnetwork):
-            d0 = sum(0.5 * np.outer(dx, dx) for ISFS, dx in jumplist)  # we don't need initial/final state
-            D0expansion[:, :, jt] += d0
-            D1expansion[:, :, k] += d0
+        k, jt, IS, FS, dx = jumpnetwork2arrays(jumpnetwork, jumptype, dim)
+        d0 = np.zeros((len(jumpnetwork), dim, dim))
+        np.add.at(d0, k, 0.5 * dx[:, :, np.newaxis] * dx[:, np.newaxis, :])  # we don't need initial/final state
+        np.add.at(D0expansion.T, np.array(jumptype, dtype=int), d0.transpose((0, 2, 1)))
+        D1expansion += d0.T
         # cleanup on return
         return zeroclean(D0expansion), zeroclean(D1expansion)
 
@@ -0,0 +1,166 @@
+"""
+Instrument module
+
+Opt-in timing of the "hot paths" in the calculators: wall time and number of calls for named
+phases (e.g., the numbered steps in VacancyMediated.Lij() or GFCrystalcalc.SetRates()), and
+counts of events such as cache hits and misses. Disabled by default; when disabled, each
+instrumented phase costs a single attribute check.
+
+Example::
+
+    from onsager import instrument
+    with instrument.recording() as timer:
+        diffuser = OnsagerCalc.VacancyMediated(crys, chem, sitelist, jumpnetwork, Nthermo)
+        Lvv, Lss, Lsv, L1vv = diffuser.Lij(*diffuser.preene2betafree(kT, **thermodict))
+    print(timer.tojson(indent=2))
+
+Phases are named hierarchically, as "Class.method/step"; the timings for the steps in a method
+add up to (roughly) the total time recorded for "Class.method".
+"""
+
+__author__ = 'Dallas R. Trinkle'
+
+import time, json, contextlib, collections
+
+
+class _NullStopwatch(object):
+    """Stopwatch that does nothing; returned when timing is disabled"""
+    __slots__ = ()
+
+    def split(self, step):
+        pass
+
+    def stop(self):
+        pass
+
+
+_nullstopwatch = _NullStopwatch()
+
+
+class Stopwatch(object):
+    """
+    Times successive steps in a single call of a method: each split() records the time since
+    the previous split (or start) as the step, and stop() records the total for the method.
+    """
+    __slots__ = ('timer', 'name', 'start', 'last')
+
+    def __init__(self, timer, name):
+        self.timer, self.name = timer, name
+        self.start = self.last = time.perf_counter()
+
+    def split(self, step):
+        """
+        Record the time since the last split as phase "name/step".
+
+        :param step: name of the step that just finished
+        """
+        now = time.perf_counter()
+        self.timer.add(self.name + '/' + step, now - self.last)
+        self.last = now
+
+    def stop(self):
+        """Record the total time since start as phase "name"."""
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class PhaseTimer(object):
+    """
+    Accumulates wall time and call counts for named phases, and counts for named events.
+    Nothing is recorded unless enabled is True.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """Clear all of the recorded timings and counts."""
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    def add(self, name, elapsed):
+        """
+        Add one call of a phase.
+
+        :param name: name of phase
+        :param elapsed: wall time (in seconds)
+        """
+        record = self.phases.get(name)
+        if record is None:
+            self.phases[name] = record = {'calls': 0, 'time': 0.}
+        record['calls'] += 1
+        record['time'] += elapsed
+
+    def stopwatch(self, name):
+        """
+        Start timing a call of a method.
+
+        :param name: name of the phase (method); steps are recorded as "name/step"
+        :return stopwatch: object with split(step) and stop() methods; does nothing if not enabled
+        """
+        if not self.enabled: return _nullstopwatch
+        return Stopwatch(self, name)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager to time a block of code as a phase.
+
+        :param name: name of phase
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def count(self, name, event):
+        """
+        Count an event (such as 'hit' or 'miss' for a cache).
+
+        :param name: name of counter
+        :param event: name of event
+        """
+        if not self.enabled: return
+        counter = self.counters.get(name)
+        if counter is None:
+            self.counters[name] = counter = collections.OrderedDict()
+        counter[event] = counter.get(event, 0) + 1
+
+    def asdict(self):
+        """
+        Return the recorded values.
+
+        :return dict: {'phases': {name: {'calls': int, 'time': float}}, 'counters': {name: {event: int}}}
+        """
+        return {'phases': {name: dict(record) for name, record in self.phases.items()},
+                'counters': {name: dict(counter) for name, counter in self.counters.items()}}
+
+    def tojson(self, **kwargs):
+        """
+        Return the recorded values as a JSON string; keyword arguments are passed to json.dumps.
+        """
+        return json.dumps(self.asdict(), **kwargs)
+
+
+# the timer used by all of the instrumented code
+timer = PhaseTimer()
+
+
+@contextlib.contextmanager
+def recording(reset=True):
+    """
+    Context manager to enable timing with the module timer; restores the previous state on exit.
+
+    :param reset: clear any previously recorded values first?
+    :return timer: module PhaseTimer
+    """
+    if reset: timer.reset()
+    enabled, timer.enabled = timer.enabled, True
+    try:
+        yield timer
+    finally:
+        timer.enabled = enabled
@@ -232,4 +232,34 @@ class GreenFuncCrystalTests(unittest.TestCase):
                     if i>=6: dxmap = -dx  # inversion
                     else: dxmap = dx
                     self.assertAlmostEqual(GF(i,j,dx), GF2(i%6,j%6,dxmap),
-                                           msg='Does not match single network? {},{}'.format(i,j))
\ No newline at end of file
+                                           msg='Does not match single network? {},{}'.format(i,j))
+
+    def testGFbatch(self):
+        """Test that batch evaluation matches individual evaluations"""
+        HCP = crystal.Crystal.HCP(1., np.sqrt(8 / 3))
+        HCP_sitelist = HCP.sitelist(0)
+        HCP_jumpnetwork = HCP.jumpnetwork(0, 1.01)
+        HCP_GF = GFcalc.GFCrystalcalc(HCP, 0, HCP_sitelist, HCP_jumpnetwork, Nmax=4)
+        HCP_GF.SetRates([1], [0], [1, 3], [0, 0])
+        ijlist = [(i, j) for i in range(2) for j in range(2)]
+        targets = [(i, j, HCP.pos2cart(np.array(R), (0, j)) - HCP.pos2cart(np.zeros(3), (0, i)))
+                   for (i, j) in ijlist for R in ((0, 0, 0), (1, 0, 0), (1, -1, 1), (2, 1, 0))]
+        glist = np.array([HCP_GF(i, j, dx) for i, j, dx in targets])
+        ilist, jlist, dxlist = [t[0] for t in targets], [t[1] for t in targets], [t[2] for t in targets]
+        self.assertTrue(np.allclose(glist, HCP_GF.GFbatch(ilist, jlist, dxlist), rtol=1e-12))
+        # force the phase matrix to be split into chunks:
+        HCP_GF.GFbatchsize = 3 * HCP_GF.NG * HCP_GF.Nkpt
+        self.assertTrue(np.allclose(glist, HCP_GF.GFbatch(ilist, jlist, dxlist), rtol=1e-12))
+        self.assertEqual(len(HCP_GF.GFbatch([], [], [])), 0)
+
+    def testSetRatesThreads(self):
+        """Test that splitting the k-point inversion over threads gives the same GF"""
+        HCP = crystal.Crystal.HCP(1., np.sqrt(8 / 3))
+        HCP_GF = GFcalc.GFCrystalcalc(HCP, 0, HCP.sitelist(0), HCP.jumpnetwork(0, 1.01), Nmax=4)
+        HCP_GF.SetRates([1], [0], [1, 3], [0, 0])
+        gsc_ijq = HCP_GF.gsc_ijq.copy()
+        for Nthreads in (2, 3):
+            HCP_GF.Nthreads = Nthreads
+            HCP_GF.SetRates([1], [0], [1, 3], [0, 0])
+            self.assertTrue(np.allclose(gsc_ijq, HCP_GF.gsc_ijq, rtol=1e-12, atol=1e-14),
+                            msg='Threaded inversion does not match with {} threads?'.format(Nthreads))
@@ -5,6 +5,7 @@ Unit tests for HDF5 parsing; runs tests in multiple libraries
 __author__ = 'Dallas R. Trinkle'
 
 import unittest
+import os, tempfile
 import numpy as np
 import h5py
 import onsager.crystal as crystal
@@ -88,6 +89,22 @@ class HDF5ParsingTests(unittest.TestCase):
         for lis1, lis1copy in zip(l2, l2copy):
             self.assertEqual(lis1, lis1copy)
 
+    def testSparseArray(self):
+        """Test whether we can write and read an HDF5 group containing a SparseArray"""
+        array = np.zeros((4, 5, 6))
+        array[0, 1, 2], array[3, 4, 5], array[2, 0, 0] = 1., -2., 0.5
+        sparse = stars.SparseArray(array)
+        sparse.addhdf5(self.f.create_group('sparse'))
+        sparsecopy = stars.SparseArray.loadhdf5(self.f['sparse'])
+        self.assertEqual(sparse.shape, sparsecopy.shape)
+        self.assertEqual(sparsecopy.nnz, 3)
+        self.assertTrue(np.all(array == sparsecopy.toarray()))
+        for name in ('data', 'indices', 'indptr'):
+            self.assertEqual(self.f['sparse'][name].compression, 'gzip')
+        # we can also read a dense array
+        self.f['dense'] = array
+        self.assertTrue(np.all(array == stars.SparseArray.loadhdf5(self.f['dense']).toarray()))
+
     def testStarSet(self):
         """Test whether we can write and read an HDF5 group containing a StarSet"""
         HCP = crystal.Crystal.HCP(1., np.sqrt(8/3))
@@ -134,6 +151,41 @@ class HDF5ParsingTests(unittest.TestCase):
         for k,v in zip(dict1copy.keys(), dict1copy.values()):
             self.assertTrue(np.all(dict1[k] == v))
 
+    def testvTKcanonical(self):
+        """Test that equivalent vTK (shifted energies, prefactors folded in, roundoff) are equal keys"""
+        vTK = OnsagerCalc.vacancyThermoKinetics(pre=np.ones(2), betaene=np.array([0., 0.5]),
+                                                preT=np.ones(4), betaeneT=np.array([1., 1.5, 2., 2.5]))
+        vTKshift = OnsagerCalc.vacancyThermoKinetics(pre=2.*np.ones(2), betaene=np.array([3., 3.5]) + np.log(2.),
+                                                     preT=np.ones(4)*np.exp(0.1),
+                                                     betaeneT=np.array([4., 4.5, 5., 5.5]) + 0.1)
+        vTKround = OnsagerCalc.vacancyThermoKinetics(pre=np.ones(2), betaene=np.array([0., 0.5])*(1+1e-14),
+                                                     preT=np.ones(4),
+                                                     betaeneT=np.array([1., 1.5, 2., 2.5])*(1+1e-14))
+        vTKdiff = OnsagerCalc.vacancyThermoKinetics(pre=np.ones(2), betaene=np.array([0., 0.6]),
+                                                    preT=np.ones(4), betaeneT=np.array([1., 1.5, 2., 2.5]))
+        for vTKequiv in (vTKshift, vTKround):
+            self.assertEqual(vTK, vTKequiv)
+            self.assertEqual(hash(vTK), hash(vTKequiv))
+        self.assertNotEqual(vTK, vTKdiff)
+        self.assertEqual(len({vTK: 0, vTKshift: 1, vTKround: 2, vTKdiff: 3}), 2)
+
+    def testGFcacheLRU(self):
+        """Test that the in-memory GF cache is bounded, and removes the least recently used entry"""
+        HCP = crystal.Crystal.HCP(1., np.sqrt(8/3))
+        HCP_diffuser = OnsagerCalc.VacancyMediated(HCP, 0, HCP.sitelist(0), HCP.jumpnetwork(0, 1.01), 1)
+        HCP_diffuser.GFcachemax = 2
+        thermaldef = {'preV': np.array([1.]), 'eneV': np.array([0.]),
+                      'preT0': np.array([1.,1.5]), 'eneT0': np.array([0.25,0.35])}
+        thermaldef.update(HCP_diffuser.maketracerpreene(**thermaldef))
+        for kT in (0.5, 1., 0.5, 2.):
+            HCP_diffuser.Lij(*HCP_diffuser.preene2betafree(kT, **thermaldef))
+        for cache in (HCP_diffuser.GFvalues, HCP_diffuser.Lvvvalues, HCP_diffuser.etavvalues):
+            self.assertEqual(len(cache), 2)
+        bFV, bFS, bFSV, bFT0, bFT1, bFT2 = HCP_diffuser.preene2betafree(1., **thermaldef)
+        vTK = OnsagerCalc.vacancyThermoKinetics(pre=np.ones_like(bFV), betaene=bFV,
+                                                preT=np.ones_like(bFT0), betaeneT=bFT0)
+        self.assertNotIn(vTK, HCP_diffuser.GFvalues)
+
     def testOnsagerVacancyMediated(self):
         """Test whether we can write and read an HDF5 group containing a VacancyMediated Onsager Calculator"""
         HCP = crystal.Crystal.HCP(1., np.sqrt(8/3))
@@ -186,3 +238,91 @@ class HDF5ParsingTests(unittest.TestCase):
         # compare tags
         for k in tria2diffuser.tags.keys():
             self.assertEqual(tria2diffuser.tags[k], tria2diffuser_copy.tags[k])
+
+    def testGFcache(self):
+        """Test whether a persistent GF cache is shared between diffusers, and is size-bounded"""
+        HCP = crystal.Crystal.HCP(1., np.sqrt(8/3))
+        HCP_diffuser = OnsagerCalc.VacancyMediated(HCP, 0, HCP.sitelist(0), HCP.jumpnetwork(0, 1.01), 1)
+        thermaldef = {'preV': np.array([1.]), 'eneV': np.array([0.]),
+                      'preT0': np.array([1.,1.5]), 'eneT0': np.array([0.25,0.35])}
+        thermaldef.update(HCP_diffuser.maketracerpreene(**thermaldef))
+        kTlist = (0.5, 1., 2.)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            GFcache = OnsagerCalc.GFcacheHDF5(os.path.join(tmpdir, 'GFcache.hdf5'), maxentries=2)
+            HCP_diffuser.setGFcache(GFcache)
+            Llist = [HCP_diffuser.Lij(*HCP_diffuser.preene2betafree(kT, **thermaldef)) for kT in kTlist]
+            self.assertEqual(len(GFcache), 2)
+            # a new diffuser (or one read from HDF5) should find what is left without evaluating the GF:
+            HCP_diffuser.addhdf5(self.f)
+            HCP_diffuser_copy = OnsagerCalc.VacancyMediated.loadhdf5(self.f)
+            self.assertEqual(HCP_diffuser.GFcachekey(), HCP_diffuser_copy.GFcachekey())
+            HCP_diffuser_copy.clearcache()
+            HCP_diffuser_copy.setGFcache(GFcache)
+            def noSetRates(**kwargs): raise AssertionError('GF evaluated instead of read from cache')
+            HCP_diffuser_copy.GFcalc.SetRates = noSetRates
+            for kT, L in zip(kTlist[1:], Llist[1:]):
+                for L0, Lcopy in zip(L, HCP_diffuser_copy.Lij(*HCP_diffuser_copy.preene2betafree(kT, **thermaldef))):
+                    self.assertTrue(np.allclose(L0, Lcopy), msg='{}\n!=\n{}'.format(L0, Lcopy))
+            # oldest entry was evicted:
+            with self.assertRaises(AssertionError):
+                HCP_diffuser_copy.Lij(*HCP_diffuser_copy.preene2betafree(kTlist[0], **thermaldef))
+
+    def testSymmetryCache(self):
+        """Test whether a persistent symmetry cache reproduces the crystal, and is size-bounded"""
+        B2spin = crystal.Crystal(np.eye(3), [np.zeros(3), np.array([0.5, 0.5, 0.5])], spins=[1, -1])
+        crystals = (lambda **kw: crystal.Crystal.HCP(1., np.sqrt(8/3), chemistry=['Ti']),
+                    lambda **kw: crystal.Crystal.fromdict(crystal.yaml.load(B2spin.simpleYAML())),
+                    lambda **kw: crystal.Crystal(np.eye(3), [[np.zeros(3), np.array([0., 0.5, 0.5]),
+                                                              np.array([0.5, 0., 0.5]), np.array([0.5, 0.5, 0.])],
+                                                             [np.array([0.5, 0.5, 0.5])]], **kw))
+        reference = [crys() for crys in crystals]
+        gengroup = crystal.Crystal.gengroup
+        def nogengroup(self): raise AssertionError('symmetry analysis done instead of read from cache')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            symmcache = crystal.SymmetryCacheHDF5(os.path.join(tmpdir, 'symmetry.hdf5'), maxentries=2)
+            try:
+                with crystal.symmetrycache(symmcache):
+                    for crys in crystals[:2]: crys()
+                self.assertEqual(len(symmcache), 2)
+                crystal.Crystal.gengroup = nogengroup
+                with crystal.symmetrycache(symmcache):
+                    cached = [crys() for crys in crystals[:2]]
+                for crys0, crys in zip(reference, cached):
+                    self.assertEqual(repr(crys0), repr(crys))
+                    self.assertTrue(np.all(crys0.lattice == crys.lattice))
+                    self.assertTrue(np.all(crys0.BZG == crys.BZG))
+                    self.assertEqual(crys0.threshold, crys.threshold)
+                    self.assertEqual(list(crys0.G), list(crys.G))  # same order, too
+                    self.assertEqual(crys0.pointG, crys.pointG)
+                    self.assertEqual(crys0.Wyckoff, crys.Wyckoff)
+                    for jumplist0, jumplist in zip(crys0.jumpnetwork(0, 1.01), crys.jumpnetwork(0, 1.01)):
+                        self.assertEqual([ij for ij, dx in jumplist0], [ij for ij, dx in jumplist])
+                        self.assertTrue(np.allclose([dx for ij, dx in jumplist0], [dx for ij, dx in jumplist]))
+                # the cache is only used inside the block:
+                with self.assertRaises(AssertionError):
+                    crystals[0]()
+                # oldest entry is evicted once we add a third (passed explicitly):
+                crystal.Crystal.gengroup = gengroup
+                crystals[2](symmcache=symmcache)
+                self.assertEqual(len(symmcache), 2)
+                crystal.Crystal.gengroup = nogengroup
+                crystals[2](symmcache=symmcache)
+                with crystal.symmetrycache(symmcache):
+                    crystals[1]()
+                    with self.assertRaises(AssertionError):
+                        crystals[0]()
+                # an entry that does not match the crystal is not used, and is replaced:
+                key = reference[1].symmetrykey()
+                symmdata = symmcache.get(key)
+                symmdata['BZG'] = symmdata['BZG'][:, :2]
+                symmcache.put(key, symmdata, replace=True)
+                self.assertEqual(len(symmcache), 2)
+                with crystal.symmetrycache(symmcache):
+                    with self.assertRaises(AssertionError):
+                        crystals[1]()
+                    crystal.Crystal.gengroup = gengroup
+                    crystals[1]()
+                    crystal.Crystal.gengroup = nogengroup
+                    self.assertEqual(repr(reference[1]), repr(crystals[1]()))
+            finally:
+                crystal.Crystal.gengroup = gengroup
@@ -146,6 +146,12 @@ class CrystalOnsagerTestsSC(DiffusionTestCase):
         # test large_om2 version:
         self.assertEqualDiffusivity(Diffusivity, thermaldef, Diffusivity, thermaldef,
                                     diffuserargs2={'large_om2': 0}, msg='large omega test fail')
+        # test low-rank omega2 update (default) against a full solve, for both small and large omega2:
+        for large_om2 in (1e8, 0):
+            self.assertEqualDiffusivity(Diffusivity, thermaldef, Diffusivity, thermaldef,
+                                        diffuserargs1={'large_om2': large_om2},
+                                        diffuserargs2={'large_om2': large_om2, 'lowrank_om2': False},
+                                        msg='low-rank omega2 test fail')
 
 
 class CrystalOnsagerTestsFCC(CrystalOnsagerTestsSC):
@@ -773,6 +779,19 @@ class CrystalOnsagerTestsRumpledOmega(DiffusionTestCase):
         # vacancy probability, and solute binding
         self.vacancyprob, self.solutebinding = 4., 3.
 
+    def makesolutediffuser(self):
+        """Diffuser for the rumpled crystal, with solute binding and unequal vacancy energies and barriers"""
+        Diffusivity = OnsagerCalc.VacancyMediated(self.crys2, self.chem, self.sitelist2, self.jumpnetwork2, 1)
+        thermaldef = {'preV': np.array([self.vacancyprob if indices == [0] else 1. for indices in self.sitelist2]),
+                      'eneV': np.array([0.1 if indices == [0] else 0. for indices in self.sitelist2]),
+                      'preS': np.ones(len(self.sitelist2)), 'eneS': np.zeros(len(self.sitelist2)),
+                      'preSV': self.solutebinding * np.ones(len(Diffusivity.interactlist())),
+                      'eneSV': -0.1 * np.ones(len(Diffusivity.interactlist())),
+                      'preT0': np.ones(len(self.jumpnetwork2)),
+                      'eneT0': 0.5 + 0.1 * np.arange(len(self.jumpnetwork2))}
+        thermaldef.update(Diffusivity.makeLIMBpreene(**thermaldef))
+        return Diffusivity, thermaldef
+
     def testtracer(self):
         """Test that Omega and rumpled Omega match exactly"""
         # Make a calculator with one neighbor shell
@@ -826,6 +845,45 @@ class CrystalOnsagerTestsRumpledOmega(DiffusionTestCase):
         self.assertEqualDiffusivity(Diffusivity2, thermaldef2, Diffusivity2, thermaldef2,
                                 diffuserargs2={'large_om2': 0}, msg='large omega test fail')
 
+    def testbatch(self):
+        """Test that the batched temperature calculation matches individual calls to Lij()"""
+        Diffusivity, thermaldef = self.makesolutediffuser()
+        kTlist = np.linspace(0.2, 1., 5)
+        for diffuserargs in ({}, {'large_om2': 0}):
+            Lbatch = Diffusivity.Lijbatch(*Diffusivity.preene2betafreebatch(kTlist, **thermaldef),
+                                          **diffuserargs)
+            for Lb in Lbatch:
+                self.assertEqual(Lb.shape, (len(kTlist), 3, 3))
+            for n, kT in enumerate(kTlist):
+                for Lb, L, Lname in zip(Lbatch,
+                                        Diffusivity.Lij(*Diffusivity.preene2betafree(kT, **thermaldef),
+                                                        **diffuserargs),
+                                        ['Lvv', 'Lss', 'Lsv', 'L1vv']):
+                    self.assertTrue(np.allclose(Lb[n], L),
+                                    msg='Batch {} does not match at kT={}?\n{}\n!=\n{}'.format(Lname, kT, Lb[n], L))
+
+    def testlowrank(self):
+        """Test that the low-rank omega2 update matches a full solve, with solute interactions"""
+        # the update itself, on a stack of random symmetric matrices:
+        np.random.seed(0)
+        N, om2indices = 8, [1, 4, 5]
+        G = np.random.randn(2, N, N)
+        G = np.matmul(G, np.transpose(G, (0, 2, 1)))
+        om = np.random.randn(2, len(om2indices), len(om2indices))
+        om = om + np.transpose(om, (0, 2, 1))
+        omfull = np.zeros((2, N, N))
+        omfull[:, np.array(om2indices)[:, np.newaxis], np.array(om2indices)] = om
+        self.assertTrue(np.allclose(OnsagerCalc.lowrankGFupdate(G, om2indices, om),
+                                    np.linalg.solve(np.eye(N) + np.matmul(G, omfull), G)))
+        self.assertTrue(np.all(OnsagerCalc.lowrankGFupdate(G, [], om[:, :0, :0]) == G))
+        # and in the transport coefficients:
+        Diffusivity, thermaldef = self.makesolutediffuser()
+        for large_om2 in (1e8, 0):
+            self.assertEqualDiffusivity(Diffusivity, thermaldef, Diffusivity, thermaldef, kTlist=(0.5, 1., 2.),
+                                        diffuserargs1={'large_om2': large_om2},
+                                        diffuserargs2={'large_om2': large_om2, 'lowrank_om2': False},
+                                        msg='low-rank omega2 test fail')
+
 
 
 class InterstitialTests(unittest.TestCase):
@@ -1199,6 +1257,53 @@ BETrans: {}  BEoct: {}  BEtet: {}  Eave: {}
 """.format(Eb, Eb_anal, BETrans, BEoct, BEtet, Eave)
         self.assertTrue(np.allclose(Eb_anal, Eb), msg=failmsg)
 
+    def testDiffusivityBatch(self):
+        """Does the batched diffusivity match diffusivity for a range of temperatures?"""
+        rumpledcrys = crystal.Crystal(np.array([[2., 0., 0.], [0., 1., 0.], [0., 0., 10.]]),
+                                      [np.array([0., 0., 0.]), np.array([0.5, 0, 0.1])])
+        Drumpled = OnsagerCalc.Interstitial(rumpledcrys, 0, rumpledcrys.sitelist(0), rumpledcrys.jumpnetwork(0, 1.5))
+        betalist = np.linspace(1., 20., 16)
+        for diffuser in (self.Dfcc, self.Dhcp, Drumpled):
+            pre = np.random.uniform(0.5, 2., len(diffuser.sitelist))
+            ene = np.random.uniform(0., 0.3, len(diffuser.sitelist))
+            preT = np.random.uniform(0.5, 2., len(diffuser.jumpnetwork))
+            eneT = np.random.uniform(0.5, 1., len(diffuser.jumpnetwork))
+            D, DE = diffuser.diffusivitybatch(pre, np.outer(betalist, ene), preT, np.outer(betalist, eneT),
+                                              CalcDeriv=True)
+            self.assertEqual(D.shape, (len(betalist), 3, 3))
+            self.assertEqual(DE.shape, (len(betalist), 3, 3))
+            for beta, Db, DEb in zip(betalist, D, DE):
+                D0, DE0 = diffuser.diffusivity(pre, beta * ene, preT, beta * eneT, CalcDeriv=True)
+                self.assertTrue(np.allclose(D0, Db), msg='{}\n!=\n{}'.format(D0, Db))
+                self.assertTrue(np.allclose(DE0, DEb), msg='{}\n!=\n{}'.format(DE0, DEb))
+            # single entry:
+            D = diffuser.diffusivitybatch(pre, ene, preT, eneT)
+            self.assertEqual(D.shape, (1, 3, 3))
+            self.assertTrue(np.allclose(diffuser.diffusivity(pre, ene, preT, eneT), D[0]))
+
+    def testElastodiffusionBatch(self):
+        """Does the batched elastodiffusion match elastodiffusion for a range of temperatures and dipoles?"""
+        betalist = np.linspace(1., 20., 8)
+        for diffuser in (self.Dfcc, self.Dhcp):
+            pre = np.random.uniform(0.5, 2., len(diffuser.sitelist))
+            ene = np.random.uniform(0., 0.3, len(diffuser.sitelist))
+            preT = np.random.uniform(0.5, 2., len(diffuser.jumpnetwork))
+            eneT = np.random.uniform(0.5, 1., len(diffuser.jumpnetwork))
+            dipole = [np.diag(np.random.uniform(-1, 1, 3)) for w in diffuser.sitelist]
+            dipoleT = [np.diag(np.random.uniform(-1, 1, 3)) for t in diffuser.jumpnetwork]
+            D, Dp = diffuser.elastodiffusionbatch(pre, np.outer(betalist, ene),
+                                                  [beta * np.array(dipole) for beta in betalist],
+                                                  preT, np.outer(betalist, eneT),
+                                                  [beta * np.array(dipoleT) for beta in betalist])
+            self.assertEqual(D.shape, (len(betalist), 3, 3))
+            self.assertEqual(Dp.shape, (len(betalist), 3, 3, 3, 3))
+            for beta, Db, Dpb in zip(betalist, D, Dp):
+                D0, Dp0 = diffuser.elastodiffusion(pre, beta * ene, [beta * d for d in dipole],
+                                                   preT, beta * eneT, [beta * d for d in dipoleT])
+                self.assertTrue(np.allclose(D0, Db), msg='{}\n!=\n{}'.format(D0, Db))
+                self.assertTrue(np.allclose(Dp0, Dpb), msg='{}\n!=\n{}'.format(Dp0, Dpb))
+                self.assertTrue(np.allclose(D0, diffuser.diffusivity(pre, beta * ene, preT, beta * eneT)))
+
     def testBias(self):
         """Quick check that the bias and correction are computed correctly"""
         rumpledcrys = crystal.Crystal(np.array([[2., 0., 0.], [0., 1., 0.], [0., 0., 10.]]),
@@ -1608,6 +1713,31 @@ class InternalFrictionTests(unittest.TestCase):
                 self.assertAlmostEqual(L[0,0,1,1], -(1/9)*(Ppara-Pperp)**2)
                 self.assertAlmostEqual(L[0,1,0,1], 0)
 
+    def testBCCinternalfrictionbatch(self):
+        """Check that the batched internal friction calculator matches losstensors"""
+        betalist = np.linspace(0.5, 5., 10)
+        frequencies = np.logspace(-2, 2, 5)
+        dipole = np.diag([-1.3, 0.4, 0.4])
+        pre, ene = self.thermodict['pre'], self.thermodict['ene'] + np.random.uniform(0, 0.1, len(self.BCC_sitelist))
+        preT, eneT = self.thermodict['preT'], self.thermodict['eneT'] + 1.
+        lamb, L, Q = self.Dbcc.losstensorsbatch(pre, np.outer(betalist, ene), [[beta*dipole] for beta in betalist],
+                                                preT, np.outer(betalist, eneT), frequencies)
+        self.assertEqual(lamb.shape, (len(betalist), self.Dbcc.N))
+        self.assertEqual(L.shape, (len(betalist), self.Dbcc.N, 3, 3, 3, 3))
+        self.assertEqual(Q.shape, (len(betalist), len(frequencies), 3, 3, 3, 3))
+        for beta, lambbatch, Lbatch, Qbatch in zip(betalist, lamb, L, Q):
+            lambdaL = self.Dbcc.losstensors(pre, beta*ene, [beta*dipole], preT, beta*eneT)
+            self.assertAlmostEqual(lambbatch[0], 0)  # equilibrium mode
+            self.assertTrue(np.allclose(Lbatch[0], 0))
+            for (l, Ltens) in lambdaL:
+                # degenerate modes are not combined in the batch:
+                self.assertTrue(np.allclose(Ltens, sum(Lm for lm, Lm in zip(lambbatch, Lbatch)
+                                                       if np.isclose(lm, l))))
+            for nu, Qnu in zip(frequencies, Qbatch):
+                self.assertTrue(np.allclose(Qnu, sum(Ltens*nu*l/(nu**2 + l**2) for (l, Ltens) in lambdaL)))
+        lamb1, L1 = self.Dbcc.losstensorsbatch(pre, ene, [dipole], preT, eneT)
+        self.assertEqual(lamb1.shape, (1, self.Dbcc.N))
+
 if __name__ == '__main__':
     # check our command line options for "verbose" to set the logging level higher
     import sys
@@ -148,6 +148,34 @@ class PowerExpansionTests(unittest.TestCase):
             self.assertTrue(np.allclose(np.dot(value, prod), c7(u, fval)),
                             msg="Failure with tensor dot product inplace?")
 
+    def testEvaluationArray(self):
+        """Test that evaluating on an array of points matches evaluating one point at a time"""
+
+        def createExpansion(n):
+            return lambda u: u ** n / PE.factorial(n, True)
+
+        c = T3D()
+        for coeff in c.constructexpansion(self.basis):
+            c.addterms(coeff)
+        fnu = {(n, l): createExpansion(n) for (n, l) in c.nl()}
+        fval = {(n, l): 1. / (n + 1) for (n, l) in c.nl()}
+        uarray = np.array([[0., 0., 0.], [1., 0., 0.], [0.234, -0.85, 1.25], [1.24, 0.71, -0.98]])
+        for f in (fnu, fval):
+            carray = c(uarray, f)
+            self.assertEqual(carray.shape, (len(uarray), 2, 2))
+            for u, cu in zip(uarray, carray):
+                self.assertTrue(np.allclose(c(u, f), cu),
+                                msg="Failure for array call for {}\n{} != {}".format(u, c(u, f), cu))
+        cdict = c(uarray)
+        for u, n in zip(uarray, range(len(uarray))):
+            for k, v in c(u).items():
+                self.assertTrue(np.allclose(v, cdict[k][n]))
+        upow, umagn = T3D.powexparray(uarray)
+        for u, up, um in zip(uarray, upow, umagn):
+            up0, um0 = T3D.powexp(u)
+            self.assertTrue(np.allclose(up, up0))
+            self.assertAlmostEqual(um, um0)
+
     def testProduct(self):
         """Test out the evaluation functions in an expansion, using coefficient products"""
 
@@ -548,6 +576,34 @@ class PowerExpansion2DTests(unittest.TestCase):
             self.assertTrue(np.allclose(np.dot(value, prod), c7(u, fval)),
                             msg="Failure with tensor dot product inplace?")
 
+    def testEvaluationArray(self):
+        """Test that evaluating on an array of points matches evaluating one point at a time"""
+
+        def createExpansion(n):
+            return lambda u: u ** n / PE.factorial(n, True)
+
+        c = T2D()
+        for coeff in c.constructexpansion(self.basis):
+            c.addterms(coeff)
+        fnu = {(n, l): createExpansion(n) for (n, l) in c.nl()}
+        fval = {(n, l): 1. / (n + 1) for (n, l) in c.nl()}
+        uarray = np.array([[0., 0.], [1., 0.], [0.234, -0.85], [1.24, 0.71]])
+        for f in (fnu, fval):
+            carray = c(uarray, f)
+            self.assertEqual(carray.shape, (len(uarray), 2, 2))
+            for u, cu in zip(uarray, carray):
+                self.assertTrue(np.allclose(c(u, f), cu),
+                                msg="Failure for array call for {}\n{} != {}".format(u, c(u, f), cu))
+        cdict = c(uarray)
+        for u, n in zip(uarray, range(len(uarray))):
+            for k, v in c(u).items():
+                self.assertTrue(np.allclose(v, cdict[k][n]))
+        upow, umagn = T2D.powexparray(uarray)
+        for u, up, um in zip(uarray, upow, umagn):
+            up0, um0 = T2D.powexp(u)
+            self.assertTrue(np.allclose(up, up0))
+            self.assertAlmostEqual(um, um0)
+
     def testProduct(self):
         """Test out the evaluation functions in an expansion, using coefficient products"""
 
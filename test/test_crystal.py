@@ -5,6 +5,7 @@ Unit tests for crystal class
 __author__ = 'Dallas R. Trinkle'
 
 import unittest
+import itertools
 import numpy as np
 import onsager.crystal as crystal
 
@@ -580,6 +581,29 @@ class CrystalClassTests(unittest.TestCase):
         trans, indexmap = crystal.maptranslation(oldbasis, newbasis)
         self.assertEqual(indexmap, None)
 
+        # positions on either side of cell boundaries, to within threshold:
+        oldbasis = [[np.array([1e-9, 0.5, 0.]), np.array([0.5, 1 - 1e-9, 0.25]), np.array([0.25, 0.25, 0.75])]]
+        newbasis = [[np.array([-1e-9, 0.5, 1.]), np.array([0.25, 0.25, -0.25]), np.array([0.5, 1e-9, 0.25])]]
+        trans, indexmap = crystal.maptranslation(oldbasis, newbasis)
+        self.assertTrue(np.allclose(trans, np.array([0., 0., 0.])))
+        self.assertEqual(indexmap, ((0, 2, 1),))
+
+    def testpositionhash(self):
+        """Does the position hash find all of the matching positions, and only neighbors?"""
+        threshold = 1e-8
+        atomlist = [np.array([0., 0., 0.]), np.array([0.5, 0.5, 0.5]), np.array([1 - 1e-9, 0.25, 0.5]),
+                    np.array([0.5, 0.5, 0.5 + 0.5e-8])]
+        poshash = crystal.positionhash(atomlist, threshold)
+        self.assertEqual(crystal.positionmatches(poshash, np.array([1., 2., -1.]), threshold), [0])
+        self.assertEqual(crystal.positionmatches(poshash, np.array([1e-9, 0.25, 1.5]), threshold), [2])
+        self.assertEqual(crystal.positionmatches(poshash, np.array([-0.5, 0.5, 0.5]), threshold), [1, 3])
+        self.assertEqual(crystal.positionmatches(poshash, np.array([0.25, 0.25, 0.25]), threshold), [])
+        # every position within threshold is a candidate:
+        for u in np.random.uniform(-1, 2, size=(32, 3)):
+            poshash = crystal.positionhash([u], threshold)
+            for du in np.random.uniform(-threshold, threshold, size=(8, 3)):
+                self.assertEqual(crystal.positionmatches(poshash, u + du + 1, threshold), [0])
+
     def testfccgroupops_directions(self):
         """Test out that we can apply group operations to directions"""
         crys = crystal.Crystal(self.fcclatt, self.basis)
@@ -718,6 +742,41 @@ class CrystalClassTests(unittest.TestCase):
         #     for ij, dx in t:
         #         print "{} -> {}: {}".format(ij[0], ij[1], dx)
 
+    def testJumpNetworkComplete(self):
+        """Does the jump network contain every transition in the cutoff once, closed under symmetry?"""
+        basis = [[np.array([1. / 3., 2. / 3., 0.25]),
+                  np.array([2. / 3., 1. / 3., 0.75])]]
+        HCPcrys = crystal.Crystal(self.hexlatt, basis)
+        interstitials = HCPcrys.Wyckoffpos(np.array([0., 0., 0.5])) + \
+                        HCPcrys.Wyckoffpos(np.array([1. / 3., 2. / 3., 0.625]))
+        HCP_intercrys = crystal.Crystal(self.hexlatt, basis + [interstitials])
+        cutoff = 1.2 * self.a0
+        jumpnetwork = HCP_intercrys.jumpnetwork(1, cutoff)
+        # every transition, from a direct search:
+        uint = HCP_intercrys.basis[1]
+        transitions = {(i, j) + tuple(n)
+                       for i, ui in enumerate(uint) for j, uj in enumerate(uint)
+                       for n in itertools.product(range(-3, 4), repeat=3)
+                       if 0 < np.linalg.norm(HCP_intercrys.unit2cart(np.array(n), uj - ui)) < cutoff}
+        jumplattice = HCP_intercrys.jumpnetwork2lattice(1, jumpnetwork)
+        jumpkeys = [(i, j) + tuple(R) for jumplist in jumplattice for (i, j), R in jumplist]
+        self.assertEqual(len(jumpkeys), len(set(jumpkeys)))
+        self.assertEqual(set(jumpkeys), transitions)
+        for jumplist in jumpnetwork:
+            for g in HCP_intercrys.G:
+                for (i, j), dx in jumplist:
+                    gdx = HCP_intercrys.g_direc(g, dx)
+                    gij = (g.indexmap[1][i], g.indexmap[1][j])
+                    self.assertTrue(any(gij == ij and np.allclose(gdx, v) for ij, v in jumplist))
+        # removing collisions with the metal atoms only removes whole symmetry-unique transitions:
+        jumpnetwork0 = HCP_intercrys.jumpnetwork(1, cutoff, 0.5 * self.a0)
+        self.assertLess(len(jumpnetwork0), len(jumpnetwork))
+        for jumplist0 in jumpnetwork0:
+            self.assertTrue(any(len(jumplist0) == len(jumplist) and
+                                all(ij0 == ij and np.allclose(dx0, dx)
+                                    for (ij0, dx0), (ij, dx) in zip(jumplist0, jumplist))
+                                for jumplist in jumpnetwork))
+
     def testNNfcc(self):
         """Test of the nearest neighbor construction"""
         crys = crystal.Crystal(self.fcclatt, self.basis)
@@ -952,6 +1011,25 @@ class KPTgentest(unittest.TestCase):
             self.assertTrue(self.crys.inBZ(q),
                             msg="Failed with vector {} not in BZ".format(q))
 
+    def testKPT_fullmesh_chunks(self):
+        """Are the mesh indices, and the chunked mesh, consistent with the full mesh?"""
+        for crys, N in ((self.crys, (5, 5, 5)), (crystal.Crystal.FCC(1.), (11, 11, 11)),
+                        (crystal.Crystal(np.array([[1., 0.3, 0.2], [0, 1.1, 0.4], [0, 0, 0.9]]),
+                                         self.basis), (7, 7, 3))):
+            kpts, meshindices, Ndiv = crys.fullkptmesh(N, returnindices=True)
+            self.assertTrue(np.array_equal(kpts, crys.fullkptmesh(N)))
+            self.assertTrue(np.allclose(np.dot(meshindices, crys.reciplatt.T) / Ndiv, kpts))
+            for q in kpts:
+                self.assertTrue(crys.inBZ(q), msg="Failed with vector {} not in BZ".format(q))
+            # every point (1/2 - j/N) of the mesh appears once, up to a reciprocal lattice vector:
+            frac = (meshindices / Ndiv - 0.5) * np.array(N)
+            self.assertTrue(np.allclose(frac, np.round(frac)))
+            self.assertEqual(len({tuple(f) for f in np.round(frac).astype(int) % N}), np.prod(N))
+            chunks = list(crys.fullkptmeshchunks(N, Nchunk=100, returnindices=True))
+            self.assertEqual(len(chunks), -(-np.prod(N) // 100))
+            self.assertTrue(np.array_equal(kpts, np.vstack([k for k, m, nd in chunks])))
+            self.assertTrue(np.array_equal(meshindices, np.vstack([m for k, m, nd in chunks])))
+
     def testKPT_IRZ(self):
         """Do we produce a correct irreducible wedge?"""
         Nkpt = np.prod(self.N)
@@ -976,6 +1054,31 @@ class KPTgentest(unittest.TestCase):
         self.assertNotAlmostEqual(sum(wtfull * [np.cos(k[0]) for k in kptfull]),
                                   sum(wts * [np.cos(k[0]) for k in kpts]))
 
+    def testKPT_reduceindex(self):
+        """Does the mesh reduction agree with direct comparison, and map every point correctly?"""
+        for crys, N in ((self.crys, (5, 5, 5)), (crystal.Crystal.FCC(1.), (6, 6, 6)),
+                        (crystal.Crystal.HCP(1., np.sqrt(8 / 3)), (6, 6, 4))):
+            kptfull = crys.fullkptmesh(N)
+            meshindices, Ndiv = crys.kptmeshindices(kptfull)
+            self.assertTrue(np.allclose(np.dot(meshindices, crys.reciplatt.T) / Ndiv, kptfull))
+            kpts, wts, index = crys.reducekptmesh(kptfull, returnindex=True)
+            kptlist, wtlist, indexlist = crys._reducekptlist(kptfull, crys.threshold)
+            self.assertEqual(len(kpts), len(kptlist))
+            self.assertAlmostEqual(np.sum(wts), 1)
+            self.assertTrue(np.allclose(wts, np.bincount(index) / len(kptfull)))
+            for k, kred in zip(kptfull, kpts[index]):
+                self.assertTrue(any(np.allclose(k, crys.g_direc(g, kred)) for g in crys.G))
+            # same orbits, with the same weights, as direct comparison:
+            for k, w in zip(kptlist, wtlist):
+                i = index[[n for n, kfull in enumerate(kptfull) if np.allclose(k, kfull)][0]]
+                self.assertAlmostEqual(w, wts[i])
+        # not a regular mesh: direct comparison
+        kptfull = np.vstack((self.crys.fullkptmesh(self.N), [(0.1, 0.2, 0.3), (0.2, 0.1, -0.3)]))
+        self.assertIsNone(self.crys.kptmeshindices(kptfull)[0])
+        kpts, wts, index = self.crys.reducekptmesh(kptfull, returnindex=True)
+        self.assertEqual(index[-1], index[-2])
+        self.assertTrue(np.allclose(wts, np.bincount(index) / len(kptfull)))
+
     def testKPT_integration(self):
         """Do we get integral values that we expect? 1/(2pi)^3 int cos(kx+ky+kz)^3 = 1/2"""
         Nkpt = np.prod(self.N)
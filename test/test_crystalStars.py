@@ -214,6 +214,21 @@ class StarTests(unittest.TestCase):
             for starindex in range(self.starset.Nstars):
                 self.assertTrue(self.isclosed(self.starset, starindex))
 
+    def testOrbitKeys(self):
+        """Do states share an orbit key if and only if they are related by symmetry?"""
+        self.starset.generate(3)
+        keys = stars.PSorbitkeys(self.crys, self.chem, self.starset.states)
+        self.assertEqual(len(keys), self.starset.Nstates)
+        for si, star in enumerate(self.starset.stars):
+            ps0 = self.starset.states[star[0]]
+            for i in star:
+                self.assertEqual(keys[star[0]], keys[i])
+            for star2 in self.starset.stars[:si]:
+                ps1 = self.starset.states[star2[0]]
+                self.assertNotEqual(keys[star[0]], keys[star2[0]])
+                self.assertFalse(any(ps0 == ps1.g(self.crys, self.chem, g) for g in self.crys.G))
+        self.assertEqual(stars.PSorbitkeys(self.crys, self.chem, []), [])
+
     def testStarindices(self):
         """Check that our indexing is correct."""
         dim = self.crys.dim
@@ -224,6 +239,32 @@ class StarTests(unittest.TestCase):
         self.assertEqual(None, self.starset.starindex(stars.PairState.zero(dim=dim)))
         self.assertEqual(None, self.starset.stateindex(stars.PairState.zero(dim=dim)))
         self.assertNotIn(stars.PairState.zero(dim=dim), self.starset)  # test __contains__ (PS in starset)
+        # deprecated dictionary of (state index, star index):
+        with self.assertWarns(DeprecationWarning):
+            indexdict = self.starset.indexdict
+        self.assertEqual(len(indexdict), self.starset.Nstates)
+        for xi, PS in enumerate(self.starset.states):
+            self.assertEqual((xi, self.starset.starindex(PS)), indexdict[PS])
+
+    def testStateArrays(self):
+        """Are the state arrays consistent with the states, and can we look up arrays of states?"""
+        dim = self.crys.dim
+        self.starset.generate(3)
+        for xi, PS in enumerate(self.starset.states):
+            self.assertEqual((PS.i, PS.j), tuple(self.starset.states_ij[xi]))
+            self.assertTrue(np.all(PS.R == self.starset.states_R[xi]))
+            self.assertTrue(np.allclose(PS.dx, self.starset.states_dx[xi]))
+        ij, R = self.starset.states_ij, self.starset.states_R
+        self.assertTrue(np.all(self.starset.stateindex((ij, R)) == np.arange(self.starset.Nstates)))
+        self.assertTrue(np.all(self.starset.starindex((ij, R)) == self.starset.index))
+        # states that are not present: zero, outside our range, and not in the basis
+        missing = (np.array([[0, 0], ij[-1], [len(self.crys.basis[self.chem]), 0]]),
+                   np.array([np.zeros(dim, dtype=int), 2 * R[-1] + 1, np.zeros(dim, dtype=int)]))
+        self.assertTrue(np.all(self.starset.stateindex(missing) == -1))
+        self.assertTrue(np.all(self.starset.starindex(missing) == -1))
+        empty = self.starset.copy(empty=True)
+        self.assertTrue(np.all(empty.stateindex((ij, R)) == -1))
+        self.assertEqual(None, empty.stateindex(self.starset.states[0]))
 
     def assertEqualStars(self, s1, s2):
         """Asserts that two star sets are equal."""
@@ -409,6 +450,24 @@ class JumpNetworkTests(unittest.TestCase):
                     sf = self.starset.index[f]
                     self.assertTrue((s1, s2) == (si, sf) or (s1, s2) == (sf, si))
 
+    def testJumpNetworkSymmetry(self):
+        """Are the jumps unique, and equal to the PairState group operations on the first jump?"""
+        self.starset.generate(3)
+        gstateindex = self.starset.stategroupindex()
+        for jumpnetwork, jt, sp in (self.starset.jumpnetwork_omega1(), self.starset.jumpnetwork_omega2()):
+            jumps = [ij for jumplist in jumpnetwork for ij, dx in jumplist]
+            self.assertEqual(len(jumps), len(set(jumps)))
+            for jumplist in jumpnetwork:
+                (i, f), dx = jumplist[0]
+                PSi, PSf = self.starset.states[i], self.starset.states[f]
+                for g in self.crys.G:
+                    gi = self.starset.stateindex(PSi.g(self.crys, self.chem, g))
+                    gf = self.starset.stateindex(PSf.g(self.crys, self.chem, g))
+                    gdx = self.crys.g_direc(g, dx)
+                    self.assertTrue(any(ij == (gi, gf) and np.allclose(jdx, gdx) for ij, jdx in jumplist))
+                self.assertEqual(len(jumplist), len(self.starset.symmequivjumplist(i, f, dx)))
+                self.assertEqual(len(jumplist), len(self.starset.symmequivjumplist(i, f, dx, gstateindex)))
+
 
 class VectorStarTests(unittest.TestCase):
     """Set of tests that our VectorStar class is behaving correctly"""
@@ -425,6 +484,70 @@ class VectorStarTests(unittest.TestCase):
         self.vecstarset = stars.VectorStarSet(self.starset)
         self.assertTrue(self.vecstarset.Nvstars > 0)
 
+    def testVectorStarIncidence(self):
+        """Does the incidence table match the vector stars?"""
+        self.starset.generate(2)
+        self.vecstarset = stars.VectorStarSet(self.starset)
+        ptr, vstar, vvec = self.vecstarset.stateincidence()
+        self.assertIs(self.vecstarset.stateincidence()[0], ptr)  # cached
+        for si in range(self.starset.Nstates):
+            entries = [(i, v) for i, (s, vec) in enumerate(zip(self.vecstarset.vecpos, self.vecstarset.vecvec))
+                       for sj, v in zip(s, vec) if sj == si]
+            self.assertEqual([i for i, v in entries], vstar[ptr[si]:ptr[si + 1]].tolist())
+            for (i, v), v1 in zip(entries, vvec[ptr[si]:ptr[si + 1]]):
+                self.assertTrue(np.allclose(v, v1))
+
+    def testGFexpansionPairs(self):
+        """Does the GF expansion match a direct loop over pairs of states in the vector stars?"""
+        self.starset.generate(2)
+        self.vecstarset = stars.VectorStarSet(self.starset)
+        GFexpansion, GFstarset = self.vecstarset.GFexpansion()
+        GFexpansion0 = np.zeros((self.vecstarset.Nvstars, self.vecstarset.Nvstars, GFstarset.Nstars))
+        for i in range(self.vecstarset.Nvstars):
+            for si, vi in zip(self.vecstarset.vecpos[i], self.vecstarset.vecvec[i]):
+                for j in range(i, self.vecstarset.Nvstars):
+                    for sj, vj in zip(self.vecstarset.vecpos[j], self.vecstarset.vecvec[j]):
+                        try:
+                            ds = self.starset.states[sj] ^ self.starset.states[si]
+                        except:
+                            continue
+                        GFexpansion0[i, j, GFstarset.starindex(ds)] += np.dot(vi, vj)
+                for j in range(i):
+                    GFexpansion0[i, j, :] = GFexpansion0[j, i, :]
+        self.assertTrue(np.allclose(GFexpansion, GFexpansion0))
+        GFsparse, GFstarset = self.vecstarset.GFexpansion(sparse=True)
+        self.assertTrue(np.allclose(GFsparse.toarray(), GFexpansion0))
+
+    def testSparseExpansions(self):
+        """Do the sparse expansions and outer products match the dense arrays?"""
+        self.starset.generate(2, originstates=True)
+        self.vecstarset = stars.VectorStarSet(self.starset)
+        GFexpand, GFstarset = self.vecstarset.GFexpansion()
+        GFsparse = self.vecstarset.GFexpansion(sparse=True)[0]
+        self.assertEqual(GFsparse.shape, GFexpand.shape)
+        self.assertEqual(GFsparse.nnz, np.count_nonzero(GFexpand))
+        self.assertTrue(np.all(GFsparse.toarray() == GFexpand))
+        GF = np.random.rand(GFstarset.Nstars)
+        self.assertTrue(np.allclose(GFsparse.dot(GF), np.dot(GFexpand, GF)))
+        GFstack = np.random.rand(3, GFstarset.Nstars)
+        self.assertTrue(np.allclose(GFsparse.dotstack(GFstack), np.tensordot(GFstack, GFexpand, axes=(1, 2))))
+        for omega2, (jumpnetwork, jt, SP) in ((False, self.starset.jumpnetwork_omega1()),
+                                              (True, self.starset.jumpnetwork_omega2())):
+            dense = self.vecstarset.rateexpansions(jumpnetwork, jt, omega2=omega2)
+            sparse = self.vecstarset.rateexpansions(jumpnetwork, jt, omega2=omega2, sparse=True)
+            for n in (1, 3):
+                self.assertTrue(np.all(dense[n] == sparse[n]))
+            for n in (0, 2):
+                self.assertTrue(np.all(dense[n] == sparse[n].toarray()))
+                self.assertEqual(sparse[n].nonzeroindices().tolist(),
+                                 [i for i in range(self.vecstarset.Nvstars) if not np.allclose(dense[n][i], 0)])
+        outer = stars.SparseArray(self.vecstarset.outer)
+        eta = np.random.rand(self.vecstarset.Nvstars)
+        self.assertTrue(np.allclose(outer.dot(eta), np.dot(self.vecstarset.outer, eta)))
+        indices = list(range(0, self.vecstarset.Nvstars, 2))
+        self.assertTrue(np.all(outer.block(indices) ==
+                               self.vecstarset.outer[:, :, indices, :][:, :, :, indices]))
+
     def VectorStarConsistent(self, nshells):
         """Do the star vectors obey the definition?"""
         self.starset.generate(nshells)
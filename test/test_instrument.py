@@ -0,0 +1,82 @@
+"""
+Unit tests for timing instrumentation of the calculators
+"""
+
+__author__ = 'Dallas R. Trinkle'
+
+import unittest
+import json
+import numpy as np
+import onsager.crystal as crystal
+import onsager.OnsagerCalc as OnsagerCalc
+from onsager import instrument
+
+
+class InstrumentTests(unittest.TestCase):
+    """Tests of PhaseTimer, and recording of the phases in VacancyMediated"""
+
+    def setUp(self):
+        self.crys = crystal.Crystal.FCC(1.)
+        self.sitelist = self.crys.sitelist(0)
+        self.jumpnetwork = self.crys.jumpnetwork(0, 0.75)
+        instrument.timer.reset()
+
+    def thermodict(self, diffuser):
+        """Tracer thermodynamics / kinetics"""
+        thermodict = {'preV': np.ones(len(self.sitelist)), 'eneV': np.zeros(len(self.sitelist)),
+                      'preT0': np.ones(len(self.jumpnetwork)), 'eneT0': np.zeros(len(self.jumpnetwork))}
+        thermodict.update(diffuser.maketracerpreene(**thermodict))
+        return thermodict
+
+    def testDisabled(self):
+        """Does nothing get recorded when disabled?"""
+        self.assertFalse(instrument.timer.enabled)
+        diffuser = OnsagerCalc.VacancyMediated(self.crys, 0, self.sitelist, self.jumpnetwork, 1)
+        diffuser.Lij(*diffuser.preene2betafree(1., **self.thermodict(diffuser)))
+        self.assertEqual(instrument.timer.asdict(), {'phases': {}, 'counters': {}})
+        self.assertIs(instrument.timer.stopwatch('test'), instrument._nullstopwatch)
+
+    def testPhaseTimer(self):
+        """Do phases, steps, and counts accumulate correctly?"""
+        timer = instrument.PhaseTimer()
+        timer.enabled = True
+        for n in range(3):
+            clock = timer.stopwatch('test')
+            clock.split('a')
+            clock.split('b')
+            clock.stop()
+            with timer.phase('block'): pass
+            timer.count('cache', 'hit' if n > 0 else 'miss')
+        data = timer.asdict()
+        for name in ('test', 'test/a', 'test/b', 'block'):
+            self.assertEqual(data['phases'][name]['calls'], 3)
+            self.assertGreaterEqual(data['phases'][name]['time'], 0)
+        self.assertGreaterEqual(data['phases']['test']['time'],
+                                data['phases']['test/a']['time'] + data['phases']['test/b']['time'])
+        self.assertEqual(data['counters'], {'cache': {'miss': 1, 'hit': 2}})
+        self.assertEqual(json.loads(timer.tojson()), data)
+        timer.reset()
+        self.assertEqual(timer.asdict(), {'phases': {}, 'counters': {}})
+
+    def testVacancyMediated(self):
+        """Are the phases of VacancyMediated, StarSet, and SetRates recorded?"""
+        with instrument.recording() as timer:
+            diffuser = OnsagerCalc.VacancyMediated(self.crys, 0, self.sitelist, self.jumpnetwork, 1)
+            thermodict = self.thermodict(diffuser)
+            for n in range(2):
+                diffuser.Lij(*diffuser.preene2betafree(1., **thermodict))
+        self.assertFalse(instrument.timer.enabled)
+        data = timer.asdict()
+        for name in ('VacancyMediated.generate', 'VacancyMediated.generatematrices', 'StarSet.generate',
+                     'VacancyMediated.generate/vkinetic', 'VacancyMediated.generatematrices/rateexpansions'):
+            self.assertIn(name, data['phases'])
+        self.assertEqual(data['phases']['VacancyMediated.Lij']['calls'], 2)
+        for step in ('1.GF', '2.probabilities', '3.rates', '4.expansions', '5.Green', '6.bias'):
+            self.assertEqual(data['phases']['VacancyMediated.Lij/' + step]['calls'], 2)
+        self.assertEqual(data['phases']['GFCrystalcalc.SetRates']['calls'], 1)
+        for step in ('1.diagonalize', '2.diffusivity', '3.rotate', '4.Taylor', '5.Fourier', '6.slice'):
+            self.assertIn('GFCrystalcalc.SetRates/' + step, data['phases'])
+        self.assertEqual(data['counters']['VacancyMediated.GFvalues'], {'miss': 1, 'hit': 1})
+        # nothing more recorded after we leave:
+        diffuser.Lij(*diffuser.preene2betafree(1., **thermodict))
+        self.assertEqual(instrument.timer.phases['VacancyMediated.Lij']['calls'], 2)